@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Builds the engine of a parser with and without profile-guided optimisation
+(BisonParser.pgo_training), and reports the build time, and the parsing
+and scanning throughput on an input file.
+
+Usage: pgobench.py module:ParserClass traininginput input [runs]
+
+The module is imported from the current directory. The parser's read()
+method is replaced by the default one, so that the input files are read,
+and its output is discarded. Each engine is built and measured in a
+separate process, so that the build and the runs of one engine don't
+skew the timings of the other. The parse throughput includes the handlers of the parser, the
+scan throughput (BisonParser.tokenize()) only the engine.
+"""
+import os
+import subprocess
+import sys
+import time
+
+from bison import BisonParser
+
+
+def best(runs, func):
+    result = None
+
+    for i in xrange(runs):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if result is None or elapsed < result:
+            result = elapsed
+
+    return result
+
+
+def run(target, training, inputfile, runs, mode):
+    sys.path.insert(0, os.getcwd())
+    modname, clsname = target.split(':')
+    base = getattr(__import__(modname), clsname)
+
+    class Parser(base):
+        bisonEngineLibName = '%s-%s' % (modname, mode)
+        read = BisonParser.read.im_func
+
+        if mode == 'pgo':
+            pgo_training = [training]
+
+    size = os.path.getsize(inputfile)
+    f = open(inputfile, 'rb')
+    source = f.read()
+    f.close()
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        parser = Parser()
+        build = time.time() - start
+
+        parse = best(runs, lambda: parser.run(file=inputfile))
+        scan = best(runs, lambda: parser.tokenize(source))
+    finally:
+        sys.stdout = stdout
+
+    print '%-6s build %6.2fs, parse %7.2f MB/s, scan %8.2f MB/s' \
+          % (mode, build, size / parse / 1e6, size / scan / 1e6)
+
+
+def main(args):
+    if len(args) == 5:
+        return run(args[0], args[1], args[2], int(args[3]), args[4])
+
+    if len(args) < 3:
+        print __doc__
+        return 1
+
+    runs = args[3] if len(args) > 3 else '3'
+
+    for mode in ['plain', 'pgo']:
+        subprocess.call([sys.executable, __file__, args[0], args[1], args[2],
+                         runs, mode])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Builds the engine of a parser with each scanner profile, and reports the
+size of the scanner tables and engine lib, and the parsing throughput on
+an input file.
+
+Usage: scannerbench.py module:ParserClass inputfile [runs]
+
+The module is imported from the current directory. The parser's read()
+method is replaced by the default one, so that the input file is read,
+and its output is discarded. The engines of all profiles are loaded into
+this process side by side, each under its own lib name. The throughput is
+that of the whole parse, so the handlers of the parser are included; the
+difference between the profiles is the difference in scanning speed.
+"""
+import os
+import sys
+import time
+
+from bison import BisonParser
+
+
+def run(base, modname, inputfile, runs, profile):
+    class Parser(base):
+        scanner_profile = profile
+        bisonEngineLibName = '%s-%s' % (modname, profile)
+        read = BisonParser.read.im_func
+
+    size = os.path.getsize(inputfile)
+    best = None
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        parser = Parser()
+
+        for i in xrange(runs):
+            start = time.time()
+            parser.run(file=inputfile)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        sys.stdout = stdout
+
+    stats = parser.scanner_stats()
+    print '%-9s tables %8d bytes, lib %8d bytes, %7.2f MB/s' \
+          % (profile, stats['table_bytes'], stats['lib_bytes'],
+             size / best / 1e6)
+
+
+def main(args):
+    if len(args) < 2:
+        print __doc__
+        return 1
+
+    runs = int(args[2]) if len(args) > 2 else 3
+
+    sys.path.insert(0, os.getcwd())
+    modname, clsname = args[0].split(':')
+    base = getattr(__import__(modname), clsname)
+
+    profiles = BisonParser.scanner_profiles.keys()
+    profiles.sort()
+
+    for profile in profiles:
+        run(base, modname, args[1], runs, profile)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
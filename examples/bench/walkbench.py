@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Measures walking a large parse tree with the BisonNode traversal
+generators and the NodeVisitor class, compared with a walker which looks up
+its visit method with getattr() for every node.
+
+Usage: walkbench.py [nlines]
+
+The trees are built like those of xmlbench.py, with five nodes per line
+(counting the shared NUMBER node twice), so the default of 200000 lines
+gives a tree of a million nodes. Its depth is far beyond the recursion
+limit, so recursive walkers cannot be compared.
+"""
+import sys
+import time
+
+from bison import NodeVisitor
+from xmlbench import make_tree
+
+
+class Counter(NodeVisitor):
+    def __init__(self):
+        self.count = 0
+
+    def visit_exp(self, node):
+        self.count += 1
+
+    def visit_line(self, node):
+        self.count += 1
+
+    def generic_visit(self, node):
+        self.count += 1
+
+
+class GetattrCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def visit(self, tree):
+        for node in tree.iter_preorder():
+            getattr(self, 'visit_' + node.target, self.generic_visit)(node)
+
+    def visit_exp(self, node):
+        self.count += 1
+
+    def visit_line(self, node):
+        self.count += 1
+
+    def generic_visit(self, node):
+        self.count += 1
+
+
+def timed(label, func):
+    start = time.time()
+    count = func()
+    print '%-16s %8d nodes: %7.3fs' % (label, count, time.time() - start)
+
+
+def count(iterable):
+    n = 0
+    for item in iterable:
+        n += 1
+    return n
+
+
+def visit(visitor, tree):
+    visitor.visit(tree)
+    return visitor.count
+
+
+def main(args):
+    nlines = int(args[0]) if args else 200000
+    tree = make_tree(nlines)
+
+    timed('iter_preorder', lambda: count(tree.iter_preorder()))
+    timed('iter_postorder', lambda: count(tree.iter_postorder()))
+    timed('walk', lambda: count(tree.walk()) // 2)
+    timed('getattr walker', lambda: visit(GetattrCounter(), tree))
+    timed('NodeVisitor', lambda: visit(Counter(), tree))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
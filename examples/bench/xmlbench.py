@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Compares the xml.dom.minidom based xml serialisation of a parse tree with
+the streaming BisonNode.writexml() serialiser.
+
+Usage: xmlbench.py [nlines]
+
+Each serialiser is run in a separate process, so the peak memory usage
+reported for it is not affected by the other one.
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from bison import BisonNode
+
+
+def make_tree(nlines):
+    """
+    Builds a tree like the calc example produces for 'nlines' lines of
+    input: a left-recursive chain of 'input' nodes, each holding a 'line'.
+    """
+    tree = BisonNode(target='input', option=0, names=[], values=[])
+
+    for i in xrange(nlines):
+        num = BisonNode(target='exp', option=0, names=['NUMBER'],
+                        values=[str(i)])
+        exp = BisonNode(target='exp', option=1,
+                        names=['exp', 'PLUS', 'exp'],
+                        values=[num, '+', num])
+        line = BisonNode(target='line', option=1, names=['exp', 'NEWLINE'],
+                         values=[exp, '\n'])
+        tree = BisonNode(target='input', option=1, names=['input', 'line'],
+                         values=[tree, line])
+
+    return tree
+
+
+def run(mode, nlines):
+    sys.setrecursionlimit(max(1000, nlines * 4))
+    tree = make_tree(nlines)
+    out = open(os.devnull, 'w')
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+
+    if mode == 'minidom':
+        out.write(tree.toxmldoc().toxml())
+    else:
+        tree.writexml(out)
+
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print '%-8s %8d lines: %7.3fs, peak memory +%d KiB' \
+          % (mode, nlines, elapsed, after - before)
+
+
+def main(args):
+    if len(args) > 1:
+        return run(args[0], int(args[1]))
+
+    nlines = int(args[0]) if args else 5000
+
+    tree = make_tree(100)
+    assert tree.toxml() == tree.toxmldoc().toxml()
+    assert tree.toprettyxml() == tree.toxmldoc().toprettyxml(indent='  ')
+
+    for mode in ['minidom', 'stream']:
+        subprocess.call([sys.executable, __file__, mode, str(nlines)])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
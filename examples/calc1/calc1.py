@@ -39,6 +39,9 @@ class Parser(BisonParser):
     # --------------------------------------------
     bisonEngineLibName = "calc1-engine"
 
+    # share token value objects between repeated identifiers and operators
+    intern_tokens = 'parse'
+
     # ------------------------------------------------------------------
     # override default read method with a version that prompts for input
     # ------------------------------------------------------------------
@@ -214,7 +217,7 @@ class Parser(BisonParser):
     #include "tokens.h"
     extern void *py_parser;
     extern void (*py_input)(PyObject *parser, char *buf, int *result, int max_size);
-    #define returntoken(tok) yylval = PyString_FromString(strdup(yytext)); return (tok);
+    #define returntoken(tok) yylval = py_token_value(yytext, yyleng); return (tok);
     #define YY_INPUT(buf,result,max_size) { (*py_input)(py_parser, buf, &result, max_size); }
     %}
     
@@ -5,9 +5,11 @@ Builds bison python module
 version = '0.1'
 
 from distutils.core import setup
+from distutils.command.build_py import build_py as _build_py
 from distutils.extension import Extension
 from Pyrex.Distutils import build_ext
 
+import os
 import sys
 
 if sys.platform == 'win32':
@@ -33,6 +35,16 @@ else:
     print('Sorry, your platform is presently unsupported.')
     sys.exit(1)
 
+class build_py(_build_py):
+    """
+    Also installs the C source of the callback layer into the bison package,
+    for parsers which compile it into their engine (callback_linkage).
+    """
+    def run(self):
+        _build_py.run(self)
+        self.copy_file(os.path.join('src', 'c', 'bison_callback.c'),
+                       os.path.join(self.build_lib, 'bison'))
+
 setup(
         name='bison',
         version=version,
@@ -52,6 +64,6 @@ setup(
         packages=['bison'],
         package_dir={'bison': 'src/python'},
         #py_modules=['node', 'xmlifier', 'convert'],
-        cmdclass={'build_ext': build_ext},
+        cmdclass={'build_ext': build_ext, 'build_py': build_py},
         scripts=[bison2pyscript],
         )
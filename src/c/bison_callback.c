@@ -30,6 +30,19 @@
 #include <stdio.h>
 #include <string.h>
 
+/*
+ * Engines which link the callback layer in (see BisonParser.callback_linkage)
+ * compile this file with PY_LINKED_CALLBACKS defined. Their copies of the
+ * callbacks get names of their own, and are kept private to the engine lib,
+ * so that they neither clash with the bison_ module nor with other engines.
+ */
+#ifdef PY_LINKED_CALLBACKS
+#define py_callback py_linked_callback
+#define py_callback_array py_linked_callback_array
+#define py_input py_linked_input
+#pragma GCC visibility push(hidden)
+#endif
+
 #define likely(x)       __builtin_expect((x),1)
 #define unlikely(x)     __builtin_expect((x),0)
 
@@ -56,35 +69,14 @@ static PyObject *py_attr_close_name;
     }
 
 /*
- * Callback function which is invoked by target handlers within the C yyparse()
- * function. This callback function will return parser._handle's python object
- * or, on failure, NULL is returned.
+ * Calls parser._handle, and the "hook_handler" callback if it exists, for a
+ * reduction with the given names and values lists.
  */
-PyObject* py_callback(PyObject *parser, char *target, int option, int nargs,
-                      ...)
+static PyObject* py_call_handler(PyObject *parser, char *target, int option,
+                                 PyObject *names, PyObject *values)
 {
-    va_list ap;
-    int i;
-
     PyObject *res;
 
-    PyObject *names = PyList_New(nargs),
-        *values = PyList_New(nargs);
-
-    va_start(ap, nargs);
-
-    // Construct the names and values list from the variable argument list.
-    for(i = 0; i < nargs; i++) {
-        PyObject *name = PyString_FromString(va_arg(ap, char *));
-        PyList_SetItem(names, i, name);
-
-        PyObject *value = va_arg(ap, PyObject *);
-        Py_INCREF(value);
-        PyList_SetItem(values, i, value);
-    }
-
-    va_end(ap);
-
     INIT_ATTR(py_attr_handle_name, "_handle", return NULL);
     INIT_ATTR(py_attr_hook_handler_name, "hook_handler", return NULL);
 
@@ -127,6 +119,60 @@ PyObject* py_callback(PyObject *parser, char *target, int option, int nargs,
     return res;
 }
 
+/*
+ * Callback function which is invoked by target handlers within the C yyparse()
+ * function. This callback function will return parser._handle's python object
+ * or, on failure, NULL is returned.
+ */
+PyObject* py_callback(PyObject *parser, char *target, int option, int nargs,
+                      ...)
+{
+    va_list ap;
+    int i;
+
+    PyObject *names = PyList_New(nargs),
+        *values = PyList_New(nargs);
+
+    va_start(ap, nargs);
+
+    // Construct the names and values list from the variable argument list.
+    for(i = 0; i < nargs; i++) {
+        PyObject *name = PyString_FromString(va_arg(ap, char *));
+        PyList_SetItem(names, i, name);
+
+        PyObject *value = va_arg(ap, PyObject *);
+        Py_INCREF(value);
+        PyList_SetItem(values, i, value);
+    }
+
+    va_end(ap);
+
+    return py_call_handler(parser, target, option, names, values);
+}
+
+/*
+ * Same as py_callback(), with the names and values passed as arrays. Engines
+ * which link the callback layer in call this one, as compilers do not inline
+ * functions taking a variable argument list.
+ */
+PyObject* py_callback_array(PyObject *parser, char *target, int option,
+                            int nargs, char **names, PyObject **values)
+{
+    int i;
+
+    PyObject *namelist = PyList_New(nargs),
+        *valuelist = PyList_New(nargs);
+
+    for(i = 0; i < nargs; i++) {
+        PyList_SetItem(namelist, i, PyString_FromString(names[i]));
+
+        Py_INCREF(values[i]);
+        PyList_SetItem(valuelist, i, values[i]);
+    }
+
+    return py_call_handler(parser, target, option, namelist, valuelist);
+}
+
 void py_input(PyObject *parser, char *buf, int *result, int max_size)
 {
     PyObject *handle, *arglist, *res;
@@ -231,3 +277,7 @@ finish_input:
         if (unlikely(!res)) return;
     }
 }
+
+#ifdef PY_LINKED_CALLBACKS
+#pragma GCC visibility pop
+#endif
@@ -2,4 +2,6 @@
 #include "stdarg.h"
 
 PyObject* py_callback(PyObject *, char *, int, int,...);
+PyObject* py_callback_array(PyObject *, char *, int, int, char **,
+                            PyObject **);
 void py_input(PyObject *, char *, int *, int);
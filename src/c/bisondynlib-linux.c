@@ -6,20 +6,16 @@
 #include <stdio.h>
 #include <dlfcn.h>
 
-void (*reset_flex_buffer)(void) = NULL;
-
+/*
+ * Loads a parser lib. Its symbols are kept local to the lib, so that the
+ * engines of several grammars in one process don't interpose each other;
+ * everything is looked up through the handle.
+ */
 void *bisondynlib_open(char *filename)
 {
     void *handle;
 
-    handle = dlopen(filename, (RTLD_NOW|RTLD_GLOBAL));
-
-    dlerror();
-
-    if (!handle)
-        return NULL;
-
-    reset_flex_buffer = dlsym(handle, "reset_flex_buffer");
+    handle = dlopen(filename, (RTLD_NOW|RTLD_LOCAL));
 
     dlerror();
 
@@ -31,8 +27,20 @@ int bisondynlib_close(void *handle)
     return dlclose(handle);
 }
 
-void bisondynlib_reset(void)
+/*
+ * Calls the reset_flex_buffer() function of the parser lib, if it has one.
+ * This is looked up in the lib at hand, as several libs may be loaded at the
+ * same time.
+ */
+void bisondynlib_reset(void *handle)
 {
+    void (*reset_flex_buffer)(void) = NULL;
+
+    if (handle)
+        reset_flex_buffer = dlsym(handle, "reset_flex_buffer");
+
+    dlerror();
+
     if (reset_flex_buffer)
         reset_flex_buffer();
 }
@@ -79,6 +87,50 @@ PyObject *bisondynlib_run(void *handle, PyObject *parser, void *cb, void *in, in
 
 }
 
+/*
+ * Calls the 'PyObject *name(void)' function exported by the parser lib, which
+ * is used to fetch data collected by the engine. Returns None if the lib has
+ * no such function.
+ */
+PyObject *bisondynlib_call(void *handle, char *name)
+{
+    PyObject *(*func)(void) = NULL;
+
+    if (handle)
+        func = dlsym(handle, name);
+
+    dlerror();
+
+    if (!func) {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+
+    return (*func)();
+}
+
+/*
+ * Runs the scanner of the parser lib over the whole input, without the
+ * parser. Returns the columnar token data built by the lib's do_tokenize().
+ */
+PyObject *bisondynlib_tokenize(void *handle, PyObject *parser, void *in)
+{
+    PyObject *(*tokenize)(PyObject *, void *) = NULL;
+
+    if (handle)
+        tokenize = dlsym(handle, "do_tokenize");
+
+    dlerror();
+
+    if (!tokenize) {
+        PyErr_SetString(PyExc_RuntimeError,
+                        "parser lib has no do_tokenize()");
+        return NULL;
+    }
+
+    return (*tokenize)(parser, in);
+}
+
 /*
  * function(void *) returns a pointer to a function(PyObject *, char *)
  * returning PyObject*
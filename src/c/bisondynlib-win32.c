@@ -58,6 +58,35 @@ PyObject * bisondynlib_run(void *handle, PyObject *parser, char *filename, void
 
 }
 
+PyObject * bisondynlib_call(void *handle, char *name)
+{
+    PyObject *(*func)(void);
+
+    func = (PyObject *(*)(void))GetProcAddress((HINSTANCE)handle, name);
+
+    if (!func) {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+
+    return (*func)();
+}
+
+PyObject *bisondynlib_tokenize(void *handle, PyObject *parser, void *in)
+{
+    PyObject *(*tokenize)(PyObject *, void *);
+
+    tokenize = (PyObject *(*)(PyObject *, void *))GetProcAddress((HINSTANCE)handle, "do_tokenize");
+
+    if (!tokenize) {
+        PyErr_SetString(PyExc_RuntimeError,
+                        "parser lib has no do_tokenize()");
+        return NULL;
+    }
+
+    return (*tokenize)(parser, in);
+}
+
 /*
  * function(void *) returns a pointer to a function(PyObject *, char *) returning PyObject*
  */
@@ -7,7 +7,7 @@
 
 void *bisondynlib_open(char *filename);
 int bisondynlib_close(void *handle);
-void bisondynlib_reset(void);
+void bisondynlib_reset(void *handle);
 char *bisondynlib_err(void);
 
 PyObject *(*bisondynlib_lookup_parser(void *handle))(PyObject *, void *, void *, int);
@@ -15,6 +15,10 @@ PyObject *(*bisondynlib_lookup_parser(void *handle))(PyObject *, void *, void *,
 char *bisondynlib_lookup_hash(void *handle);
 
 PyObject *bisondynlib_run(void *handle, PyObject *parser, void *cb, void *in, int debug);
+
+PyObject *bisondynlib_call(void *handle, char *name);
+
+PyObject *bisondynlib_tokenize(void *handle, PyObject *parser, void *in);
 /*
 int bisondynlib_build(char *libName, char *pyincdir);
 */
@@ -53,17 +53,20 @@ cdef extern from "../c/bison_callback.h":
 cdef extern from "../c/bisondynlib.h":
     void *bisondynlib_open(char *filename)
     int bisondynlib_close(void *handle)
-    void bisondynlib_reset()
+    void bisondynlib_reset(void *handle)
     char *bisondynlib_err()
     object (*bisondynlib_lookup_parser(void *handle))(object, char *)
     char *bisondynlib_lookup_hash(void *handle)
     object bisondynlib_run(void *handle, object parser, void *cb, void *pyin, int debug)
+    object bisondynlib_call(void *handle, char *name)
+    object bisondynlib_tokenize(void *handle, object parser, void *pyin)
 
     #int bisondynlib_build(char *libName, char *includedir)
 
 
-import sys, os, sha, re, imp, traceback
+import sys, os, sha, re, imp, traceback, copy
 import shutil
+from array import array
 import distutils.sysconfig
 import distutils.ccompiler
 
@@ -73,6 +76,378 @@ reSpaces = re.compile("\\s+")
 #unquoted = r"""^|[^'"]%s[^'"]?"""
 unquoted = '[^\'"]%s[^\'"]?'
 
+# Version of the code which buildLib() generates. This is part of the parser
+# hash, so bump it whenever the generated code changes to get the existing
+# engine libs rebuilt.
+engineFormat = '14'
+
+# Static table declarations in flex and bison generated code.
+reTable = re.compile(r'static\s+(?:yyconst\s+|const\s+)*'
+                     r'(struct\s+yy_trans_info|[\w ]+?)\s*(\*?)\s*'
+                     r'(yy\w+)\s*\[[^=;]*\]\s*=\s*\{(.*?)\}\s*;', re.S)
+reNumber = re.compile(r'-?\b\d+\b')
+
+# State headings and conflict reports in bison's .output file.
+reState = re.compile(r'^state \d+\s*$', re.M | re.I)
+reConflicts = re.compile(r'^state \d+ conflicts?:(.*)$', re.M | re.I)
+reConflictCount = re.compile(r'(\d+) (shift/reduce|reduce/reduce)')
+
+def bisonDefines(parser):
+    """
+    Returns the %define lines for the parser's table construction options.
+    """
+    lines = []
+
+    for name, value in [('lr.type', parser.lr_type),
+                        ('lr.default-reduction', parser.lr_default_reduction),
+                        ('parse.lac', parser.parse_lac)]:
+        if value:
+            lines.append('%%define %s %s' % (name, value))
+
+    return lines
+
+def grammarStats(report):
+    """
+    Returns the number of states, and the numbers of shift/reduce and
+    reduce/reduce conflicts, listed in a bison .output report.
+    """
+    counts = {'shift/reduce': 0, 'reduce/reduce': 0}
+
+    for match in reConflicts.finditer(report):
+        for count, kind in reConflictCount.findall(match.group(1)):
+            counts[kind] = counts[kind] + int(count)
+
+    return (len(reState.findall(report)), counts['shift/reduce'],
+            counts['reduce/reduce'])
+
+def scannerOptions(parser):
+    """
+    Returns the flex options of the parser's scanner profile.
+    """
+    if not parser.scanner_profile:
+        return []
+
+    try:
+        return list(parser.scanner_profiles[parser.scanner_profile])
+    except KeyError:
+        raise ValueError('Unknown scanner profile %r'
+                         % parser.scanner_profile)
+
+def usesTokenizer(parser):
+    """
+    Tells if the parser has a Python tokenizer, which replaces the flex
+    scanner built from its lex script.
+    """
+    return getattr(parser, 'tokenizer', None) is not None
+
+def symbolPrefix(parser):
+    """
+    Returns the prefix which takes the place of 'yy' in the global symbols
+    of the parser engine, through bison's api.prefix and flex's -P option,
+    so that the engines of different grammars don't share symbol names.
+    """
+    return 'pyb_%s_' % re.sub(r'\W', '_', parser.bisonEngineLibName)
+
+def nativeActions(handler):
+    """
+    Returns the options of a rule handler which the engine reduces in C, as
+    declared with the native_actions decorator: a dict mapping option numbers
+    to the number of the term passed on, or to None.
+    """
+    return getattr(handler, 'native_actions', None) or {}
+
+def listRule(handler):
+    """
+    Returns the element terms declared for the options of a list rule
+    handler (see the list_rule decorator), or None if the handler is not
+    one.
+    """
+    return getattr(handler, 'list_rule', None)
+
+def passThroughCode(term):
+    """
+    Returns the C code of an option which passes on the value of the given
+    term, or None if term is None. The reference held by the stack moves
+    along with the value.
+    """
+    if term is None:
+        return '          Py_INCREF(Py_None);\n          $$ = Py_None;\n'
+
+    return '          $$ = $%d;\n' % term
+
+def listCode(target, option, term):
+    """
+    Returns the C code of an option of a list rule (see list_rule): an
+    option starting with the target appends the value of the given term to
+    the list, other options start a new list with it, or an empty list if
+    term is None. The reference held by the stack moves into the list.
+    """
+    if option and option[0] == target:
+        return ''.join([
+            '          $$ = $1;\n',
+            '          if (PyList_Append($$, $%d))\n' % term,
+            '              YYERROR;\n',
+            '          Py_DECREF($%d);\n' % term,
+            ])
+
+    if term is None:
+        return '          $$ = PyList_New(0);\n' \
+               '          if (!$$)\n' \
+               '              YYERROR;\n'
+
+    return ''.join([
+        '          $$ = PyList_New(1);\n',
+        '          if (!$$)\n',
+        '              YYERROR;\n',
+        '          PyList_SET_ITEM($$, 0, $%d);\n' % term,
+        ])
+
+def nativeCode(handler, target, options):
+    """
+    Returns the C code of the options of a rule handler which the engine
+    reduces without calling the handler, as a dict keyed by option number.
+    Raises ValueError if the declared actions don't fit the options.
+    """
+    natives = nativeActions(handler)
+    elements = listRule(handler)
+
+    if natives and elements is not None:
+        raise ValueError('%s is declared both a list rule and with native'
+                         ' actions' % target)
+
+    if elements is not None:
+        for option, term in elements.items():
+            if option >= len(options):
+                raise ValueError('%s has no option %d' % (target, option))
+
+        natives = {}
+        for option in range(len(options)):
+            terms = termCount(options[option])
+            recursive = terms and options[option][0] == target
+            natives[option] = elements.get(option, terms or None)
+
+            if target in options[option][recursive and 1 or 0:terms]:
+                raise ValueError('List rule %s must be left-recursive'
+                                 % target)
+            if recursive and natives[option] in (1, None):
+                raise ValueError('Option %d of %s appends no element'
+                                 % (option, target))
+
+    code = {}
+
+    for option, term in natives.items():
+        if option >= len(options):
+            raise ValueError('%s has no option %d' % (target, option))
+        if 'error' in options[option]:
+            raise ValueError('Option %d of %s is an error rule, which'
+                             ' needs its handler' % (option, target))
+        if term is not None and term > termCount(options[option]):
+            raise ValueError('Option %d of %s has no term %d'
+                             % (option, target, term))
+
+        if elements is not None:
+            code[option] = listCode(target, options[option], term)
+        else:
+            code[option] = passThroughCode(term)
+
+    return code
+
+def termCount(option):
+    """
+    Returns the number of terms of a rule option (as split into words),
+    leaving out a trailing %prec declaration.
+    """
+    if '%prec' in option:
+        return option.index('%prec')
+
+    return len([term for term in option if term])
+
+def callbackSource(parser):
+    """
+    Returns the path of bison_callback.c, the C source of the callback layer,
+    as found in the parser's callbackSourcePath, or None.
+    """
+    for directory in parser.callbackSourcePath:
+        filename = os.path.join(directory, 'bison_callback.c')
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+def callbackLinkage(parser):
+    """
+    Returns where the parser engine takes its callback layer from: 'module'
+    (the bison_ module), or 'linked' or 'lto' (compiled into the engine lib).
+    Engines fall back to the callbacks of the module when bison_callback.c
+    isn't found.
+    """
+    linkage = parser.callback_linkage or 'module'
+
+    if linkage not in ('module', 'linked', 'lto'):
+        raise ValueError('Unknown callback linkage %r' % linkage)
+
+    if linkage != 'module' and callbackSource(parser) is None:
+        if parser.verbose:
+            print 'bison_callback.c not found, using the module callbacks'
+        return 'module'
+
+    return linkage
+
+def scannerTableBytes(source):
+    """
+    Estimates the size in bytes of the tables of a flex generated scanner,
+    from the table initialisers in its C source.
+    """
+    return tableBytes(source, 1)
+
+def parserTableBytes(source):
+    """
+    Estimates the size in bytes of the tables of a bison generated parser.
+    """
+    return tableBytes(source, 0)
+
+def tableBytes(source, scanner):
+    """
+    Adds up the sizes of the numeric tables in generated C source: those of
+    the scanner (named yy_*) or those of the parser (other yy* names).
+    """
+    total = 0
+
+    for match in reTable.finditer(source):
+        ctype, pointer, name, body = match.groups()
+
+        if name.startswith('yy_') != bool(scanner):
+            continue
+
+        if pointer:
+            total += 8 * body.count('&')
+            continue
+
+        if 'int16' in ctype or 'short' in ctype:
+            size = 2
+        elif 'char' in ctype or 'CHAR' in ctype or 'int8' in ctype:
+            size = 1
+        else:
+            size = 4
+
+        total += size * len(reNumber.findall(body))
+
+    return total
+
+def writeScannerStats(filename, profile, tableBytes):
+    """
+    Appends py_scanner_stats(), which reports the scanner profile and the
+    size of the scanner tables, to a C file of the parser engine.
+    """
+    f = open(filename, 'a')
+    f.write('\n'.join([
+        '',
+        '#include "Python.h"',
+        '',
+        'PyObject *py_scanner_stats(void)',
+        '{',
+        '  return Py_BuildValue("(sl)", "%s", %dL);' % (profile, tableBytes),
+        '}',
+        '']))
+    f.close()
+
+def writeScannerReset(filename):
+    """
+    Appends reset_flex_buffer(), which ParserEngine.reset() calls through
+    bisondynlib_reset(), to the C file of the scanner. It drops the input
+    which flex buffered but did not scan, such as the rest of the input of
+    an aborted parse, and returns the scanner to its initial state.
+    """
+    f = open(filename, 'a')
+    f.write('\n'.join([
+        '',
+        'void reset_flex_buffer(void)',
+        '{',
+        '  YY_FLUSH_BUFFER;',
+        '  yyrestart(yyin);',
+        '  BEGIN(INITIAL);',
+        '}',
+        '']))
+    f.close()
+
+def objectFilename(parser, half, fingerprint, extension, cflags):
+    """
+    Returns the filename of the object file of one half ('grammar' or
+    'scanner') of the parser engine, or of its linked in callback layer
+    ('callback'), built from the inputs with the given
+    hash, with the given compiler options.
+    """
+    hasher = sha.new(fingerprint)
+    hasher.update(repr((parser.cflags_pre, cflags,
+                        bool(parser.debugSymbols))))
+
+    return '%s%s-%s-%s%s' % (parser.buildDirectory,
+                             parser.bisonEngineLibName, half,
+                             hasher.hexdigest()[:16], extension)
+
+def pgoFlags(phase, profileDir):
+    """
+    Returns the gcc options which instrument the parser engine to collect a
+    profile in profileDir ('generate' phase), or which optimise it with the
+    profile collected there ('use' phase).
+    """
+    if phase == 'generate':
+        return ['-fprofile-generate=' + profileDir]
+    if phase == 'use':
+        return ['-fprofile-use=' + profileDir, '-fprofile-correction',
+                '-Wno-missing-profile']
+    return []
+
+def profileDirectory(parser, parserHash):
+    """
+    Returns the directory which holds the profile of the parser engine with
+    the given hash, for profile-guided optimised builds.
+    """
+    return '%s%s-pgo-%s' % (parser.buildDirectory, parser.bisonEngineLibName,
+                            parserHash[:16])
+
+def hasProfile(profileDir):
+    """
+    Tells if a profile was collected in profileDir.
+    """
+    if not os.path.isdir(profileDir):
+        return 0
+
+    for name in os.listdir(profileDir):
+        if name.endswith('.gcda'):
+            return 1
+    return 0
+
+def libraryFilename(parser, parserHash):
+    """
+    Returns the filename of the parser engine lib built for the given parser
+    hash. Each version of the engine gets a file of its own, so that a
+    rebuilt engine can be loaded while an older one is still in use.
+    """
+    return '%s%s-%s%s' % (parser.buildDirectory, parser.bisonEngineLibName,
+                          parserHash[:16], imp.get_suffixes()[0][0])
+
+def headerFilename(objFile):
+    """
+    Returns the filename under which the bison generated header is kept
+    with the object file of the grammar half of the engine.
+    """
+    return os.path.splitext(objFile)[0] + '.h'
+
+def dropObjects(objFile):
+    """
+    Removes the object files (and headers) of other builds of the same half
+    of the parser engine as objFile. Given an engine lib, removes the other
+    versions of the engine lib.
+    """
+    directory, name = os.path.split(objFile)
+    stem, ext = os.path.splitext(name)
+    pattern = re.compile(re.escape(stem[:-16]) + '[0-9a-f]{16}'
+                         + '(%s|\\.h)$' % re.escape(ext))
+
+    for other in os.listdir(directory or '.'):
+        if other != name and pattern.match(other):
+            os.unlink(os.path.join(directory, other))
+
 cdef class ParserEngine:
     """
     Wraps the interface to the binary bison/lex-generated parser engine dynamic
@@ -93,17 +468,31 @@ cdef class ParserEngine:
     cdef object parserHash # hash of current python parser object
     cdef object libFilename_py
 
+    # phase ('generate' or 'use') and profile directory of a profile-guided
+    # optimised build in progress
+    cdef object pgoPhase
+    cdef object pgoDir
+
+    # whether the engine may train itself while it is built, and whether a
+    # built engine still waits for its training (see finishTraining())
+    cdef object canTrain
+    cdef object untrained
+
     cdef void *libHandle
 
     # rules hash str embedded in bison parser lib
     cdef char *libHash
 
-    def __init__(self, parser):
+    def __init__(self, parser, load=1, train=1):
         """
         Creates a ParserEngine wrapper, and builds/loads the library.
 
         Arguments:
             - parser - an instance of a subclass of Parser
+            - load - set to 0 to only build the library if it doesn't exist,
+              and leave loading it to openCurrentLib()
+            - train - set to 0 to leave the training of a profile-guided
+              optimised build to finishTraining()
 
         In the course of initialisation, we check the library against the
         parser object's rules. If the lib doesn't exist, or can't be loaded, or
@@ -113,20 +502,35 @@ cdef class ParserEngine:
         current rules in the parser object.
         """
         self.parser = parser
-
-        self.libFilename_py = parser.buildDirectory \
-                              + parser.bisonEngineLibName \
-                              + imp.get_suffixes()[0][0]
+        self.canTrain = train
+        self.untrained = 0
 
         self.parserHash = hashParserObject(self.parser)
 
-        self.openCurrentLib()
+        self.libFilename_py = libraryFilename(parser, self.parserHash)
+
+        if load:
+            self.openCurrentLib()
+        elif not os.path.isfile(self.libFilename_py):
+            self.build()
+
+    def getParserHash(self):
+        """
+        Returns the hash of the parser object which the engine was built for.
+        """
+        return self.parserHash
+
+    def getLibFilename(self):
+        """
+        Returns the filename of the parser engine lib.
+        """
+        return self.libFilename_py
 
     def reset(self):
         """
         Reset Flex's buffer and state.
         """
-        bisondynlib_reset()
+        bisondynlib_reset(self.libHandle)
 
     def openCurrentLib(self):
         """
@@ -141,7 +545,7 @@ cdef class ParserEngine:
             distutils.log.set_verbosity(1)
 
         if not os.path.isfile(self.libFilename_py):
-            self.buildLib()
+            self.build()
 
         self.openLib()
 
@@ -153,7 +557,7 @@ cdef class ParserEngine:
                 print "  current parser class: %s" % self.parserHash
                 print "         bison library: %s" % libHash
             self.closeLib()
-            self.buildLib()
+            self.build()
             self.openLib()
         else:
             if verbose:
@@ -179,51 +583,1421 @@ cdef class ParserEngine:
         cdef char *err
         cdef void *handle
 
-        # convert python filename string to c string
-        libFilename = PyString_AsString(self.libFilename_py)
+        # convert python filename string to c string
+        libFilename = PyString_AsString(self.libFilename_py)
+
+        parser = self.parser
+
+        if parser.verbose:
+            print 'Opening library %s' % self.libFilename_py
+        handle = bisondynlib_open(libFilename)
+        self.libHandle = handle
+        err = bisondynlib_err()
+        if err:
+            printf('ParserEngine.openLib: error "%s"\n', err)
+            return
+
+        # extract symbols
+        self.libHash = bisondynlib_lookup_hash(handle)
+
+        if parser.verbose:
+            print 'Successfully loaded library'
+
+    def generate_exception_handler(self):
+        s = ''
+
+        s += '          {\n'
+        s += '            PyObject* obj = PyErr_Occurred();\n'
+        s += '            if (obj) {\n'
+        s += '              //yyerror("exception raised");\n'
+        s += '              YYERROR;\n'
+        s += '            }\n'
+        s += '          }\n'
+
+        return s
+
+    def generate_native_action(self, target, code):
+        """
+        Returns the rest of the C action of a rule option which is reduced
+        without calling its handler (see native_actions and list_rule): the
+        given code, which sets $$.
+
+        No location is recorded, as no node is created. The start target
+        also takes the place of the handler in setting parser.last.
+        """
+        s = '          if (py_trace_size)\n'
+        s += '              py_trace(PY_TRACE_REDUCE, *yyssp, yychar, yyn - 1, &@$);\n'
+        s += code
+
+        if target == self.parser.start:
+            s += '          PyObject_SetAttrString(py_parser, "last", $$);\n'
+            s += self.generate_exception_handler()
+
+        s += '        }\n'
+
+        return s
+
+    def generate_callback_linkage(self):
+        """
+        Returns the C code which hooks the engine up to its callback layer:
+        the py_set_callback() and py_set_input() macros, which set the
+        py_callback and py_input pointers (through which lex scripts read
+        their input), and the declarations of the callbacks compiled into the
+        lib, if any.
+        """
+        if callbackLinkage(self.parser) == 'module':
+            return '\n'.join([
+                '/* the callbacks of the bison_ module, passed to do_parse() */',
+                '#define py_set_callback(cb) (py_callback = (cb))',
+                '#define py_set_input(in) (py_input = (in))',
+                ])
+
+        return '\n'.join([
+            '/* the callbacks compiled into this lib, see bison_callback.c */',
+            '#ifdef __GNUC__',
+            '#define PY_HIDDEN __attribute__((visibility("hidden")))',
+            '#else',
+            '#define PY_HIDDEN',
+            '#endif',
+            '',
+            'PyObject *py_linked_callback(PyObject *, char *, int, int, ...)',
+            '    PY_HIDDEN;',
+            'PyObject *py_linked_callback_array(PyObject *, char *, int, int,',
+            '                                   char **, PyObject **) PY_HIDDEN;',
+            'void py_linked_input(PyObject *, char *, int *, int) PY_HIDDEN;',
+            '',
+            '#define py_set_callback(cb) (py_callback = \\',
+            '    (void *(*)(void *, char *, int, int, ...))py_linked_callback)',
+            '#define py_set_input(in) (py_input = \\',
+            '    (void (*)(void *, char *, int *, int))py_linked_input)',
+            ])
+
+    def generate_stack_depth(self):
+        """
+        Returns the definitions of the initial and maximum parser stack
+        depths, if the parser sets them.
+        """
+        parser = self.parser
+        lines = []
+
+        if parser.initial_stack_depth:
+            lines.append('#define YYINITDEPTH %d' % parser.initial_stack_depth)
+        if parser.max_stack_depth:
+            lines.append('#define YYMAXDEPTH %d' % parser.max_stack_depth)
+
+        return '\n'.join(lines)
+
+    def generate_token_value_helper(self):
+        """
+        Returns the C code of py_token_value(), which lex scripts can use to
+        create their token values. When the parser has an intern table, equal
+        lexemes share one string object instead of getting a copy each.
+        """
+        return '\n'.join([
+            'PyObject *py_intern_table = NULL;',
+            'Py_ssize_t py_intern_limit = 0;',
+            '',
+            'void *py_token_value(const char *text, int len)',
+            '{',
+            '  PyObject *value, *shared;',
+            '',
+            '  value = PyString_FromStringAndSize(text, len);',
+            '  if (!value || !py_intern_table)',
+            '      return value;',
+            '',
+            '  shared = PyDict_GetItem(py_intern_table, value);',
+            '  if (shared) {',
+            '      Py_INCREF(shared);',
+            '      Py_DECREF(value);',
+            '      return shared;',
+            '  }',
+            '',
+            '  if (PyDict_Size(py_intern_table) < py_intern_limit',
+            '          && PyDict_SetItem(py_intern_table, value, value))',
+            '      PyErr_Clear();',
+            '',
+            '  return value;',
+            '}',
+            '',
+            ])
+
+    def generate_location_helper(self):
+        """
+        Returns the C code which keeps track of the current scanner position,
+        and which records the location of every reduction (plus the offsets at
+        which lines start) when the parser's track_locations is set.
+        """
+        return '\n'.join([
+            'int py_loc_line = 1, py_loc_column = 1, py_loc_byte = 0;',
+            '',
+            'int py_track_locations = 0;',
+            'int *py_loc_nodes = NULL, *py_loc_lines = NULL;',
+            'size_t py_loc_nodes_len = 0, py_loc_nodes_size = 0;',
+            'size_t py_loc_lines_len = 0, py_loc_lines_size = 0;',
+            '',
+            '#define PY_LOC_FIELDS 6',
+            '',
+            'static int py_loc_grow(int **buf, size_t *size, size_t needed)',
+            '{',
+            '  size_t newsize = *size ? *size : 1024;',
+            '  int *newbuf;',
+            '',
+            '  while (newsize < needed)',
+            '      newsize *= 2;',
+            '',
+            '  newbuf = realloc(*buf, newsize * sizeof(int));',
+            '  if (!newbuf) {',
+            '      py_track_locations = 0;',
+            '      return 0;',
+            '  }',
+            '',
+            '  *buf = newbuf;',
+            '  *size = newsize;',
+            '  return 1;',
+            '}',
+            '',
+            'void py_update_location(const char *text, int len)',
+            '{',
+            '  int i;',
+            '',
+            '  yylloc.first_line = py_loc_line;',
+            '  yylloc.first_column = py_loc_column;',
+            '  yylloc.first_byte = py_loc_byte;',
+            '',
+            '  for (i = 0; i < len; i++) {',
+            '      if (text[i] != \'\\n\') {',
+            '          py_loc_column++;',
+            '          continue;',
+            '      }',
+            '',
+            '      py_loc_line++;',
+            '      py_loc_column = 1;',
+            '',
+            '      if (py_track_locations && (py_loc_lines_len < py_loc_lines_size',
+            '              || py_loc_grow(&py_loc_lines, &py_loc_lines_size,',
+            '                             py_loc_lines_len + 1)))',
+            '          py_loc_lines[py_loc_lines_len++] = py_loc_byte + i + 1;',
+            '  }',
+            '',
+            '  py_loc_byte += len;',
+            '',
+            '  yylloc.last_line = py_loc_line;',
+            '  yylloc.last_column = py_loc_column;',
+            '  yylloc.last_byte = py_loc_byte;',
+            '}',
+            '',
+            'static void py_record_location(YYLTYPE *loc)',
+            '{',
+            '  int *rec;',
+            '',
+            '  if (py_loc_nodes_len + PY_LOC_FIELDS > py_loc_nodes_size',
+            '          && !py_loc_grow(&py_loc_nodes, &py_loc_nodes_size,',
+            '                          py_loc_nodes_len + PY_LOC_FIELDS))',
+            '      return;',
+            '',
+            '  rec = py_loc_nodes + py_loc_nodes_len;',
+            '  rec[0] = loc->first_line;',
+            '  rec[1] = loc->first_column;',
+            '  rec[2] = loc->last_line;',
+            '  rec[3] = loc->last_column;',
+            '  rec[4] = loc->first_byte;',
+            '  rec[5] = loc->last_byte;',
+            '  py_loc_nodes_len += PY_LOC_FIELDS;',
+            '}',
+            '',
+            'PyObject *py_reset_locations(void)',
+            '{',
+            '  py_loc_line = py_loc_column = 1;',
+            '  py_loc_byte = 0;',
+            '',
+            '  yylloc.first_line = yylloc.last_line = 1;',
+            '  yylloc.first_column = yylloc.last_column = 1;',
+            '  yylloc.first_byte = yylloc.last_byte = 0;',
+            '  py_loc_nodes_len = py_loc_lines_len = 0;',
+            '',
+            '  Py_INCREF(Py_None);',
+            '  return Py_None;',
+            '}',
+            '',
+            'PyObject *py_location_data(void)',
+            '{',
+            '  PyObject *res;',
+            '',
+            '  res = Py_BuildValue("(s#s#)",',
+            '                      py_loc_nodes ? (char *)py_loc_nodes : "",',
+            '                      (int)(py_loc_nodes_len * sizeof(int)),',
+            '                      py_loc_lines ? (char *)py_loc_lines : "",',
+            '                      (int)(py_loc_lines_len * sizeof(int)));',
+            '',
+            '  py_loc_nodes_len = py_loc_lines_len = 0;',
+            '  return res;',
+            '}',
+            '',
+            ])
+
+    def generate_tree_helper(self):
+        """
+        Returns the C code which builds the parse tree in native columns when
+        the parser's tree_mode is 'columnar', in place of calling the
+        handlers. Each node and token gets an entry with its symbol (the rule
+        number for nodes, the negated token id for tokens), first child and
+        next sibling entries, start and end byte offsets, and the index of
+        its token value in a list (-1 for none).
+
+        In this mode, the value of a target on the parser stack is the index
+        of its entry, plus one.
+        """
+        return '\n'.join([
+            '#define PY_TREE_FIELDS 6',
+            '#define PY_TREE_REF(i) ((void *)(intptr_t)((i) + 1))',
+            '#define PY_TREE_INDEX(v) ((int)(intptr_t)(v) - 1)',
+            '',
+            'int py_columnar = 0;',
+            'int *py_tree_cols[PY_TREE_FIELDS];',
+            'size_t py_tree_len = 0, py_tree_size = 0;',
+            'PyObject *py_tree_values = NULL;',
+            '',
+            'static int py_tree_add(int symbol, YYLTYPE *loc, int value)',
+            '{',
+            '  int i;',
+            '',
+            '  if (py_tree_len == py_tree_size) {',
+            '      size_t size = py_tree_size ? py_tree_size * 2 : 4096;',
+            '      for (i = 0; i < PY_TREE_FIELDS; i++) {',
+            '          int *col = realloc(py_tree_cols[i], size * sizeof(int));',
+            '          if (!col) {',
+            '              PyErr_NoMemory();',
+            '              return -1;',
+            '          }',
+            '          py_tree_cols[i] = col;',
+            '      }',
+            '      py_tree_size = size;',
+            '  }',
+            '',
+            '  i = (int)py_tree_len++;',
+            '  py_tree_cols[0][i] = symbol;',
+            '  py_tree_cols[1][i] = -1;',
+            '  py_tree_cols[2][i] = -1;',
+            '  py_tree_cols[3][i] = loc->first_byte;',
+            '  py_tree_cols[4][i] = loc->last_byte;',
+            '  py_tree_cols[5][i] = value;',
+            '  return i;',
+            '}',
+            '',
+            'static int py_tree_leaf(int token, YYLTYPE *loc, PyObject *value)',
+            '{',
+            '  int index = -1;',
+            '',
+            '  if (value) {',
+            '      if (!py_tree_values && !(py_tree_values = PyList_New(0)))',
+            '          return -1;',
+            '      index = (int)PyList_GET_SIZE(py_tree_values);',
+            '      if (PyList_Append(py_tree_values, value))',
+            '          return -1;',
+            '  }',
+            '',
+            '  return py_tree_add(-token, loc, index);',
+            '}',
+            '',
+            'static int py_tree_node(int rule, YYLTYPE *loc, int *children, int n)',
+            '{',
+            '  int i, node;',
+            '',
+            '  for (i = 0; i < n; i++)',
+            '      if (children[i] < 0)',
+            '          return -1;',
+            '',
+            '  node = py_tree_add(rule, loc, -1);',
+            '  if (node < 0 || !n)',
+            '      return node;',
+            '',
+            '  py_tree_cols[1][node] = children[0];',
+            '  for (i = 1; i < n; i++)',
+            '      py_tree_cols[2][children[i - 1]] = children[i];',
+            '  return node;',
+            '}',
+            '',
+            'PyObject *py_reset_tree(void)',
+            '{',
+            '  int i;',
+            '',
+            '  for (i = 0; i < PY_TREE_FIELDS; i++) {',
+            '      free(py_tree_cols[i]);',
+            '      py_tree_cols[i] = NULL;',
+            '  }',
+            '  py_tree_len = py_tree_size = 0;',
+            '  Py_CLEAR(py_tree_values);',
+            '  Py_RETURN_NONE;',
+            '}',
+            '',
+            '/* copies a column into an array(\'i\') made by repeating zero */',
+            'static PyObject *py_tree_column(PyObject *zero, int field)',
+            '{',
+            '  PyObject *col = PySequence_Repeat(zero, (Py_ssize_t)py_tree_len);',
+            '  void *buf;',
+            '  Py_ssize_t len;',
+            '',
+            '  if (!col || !py_tree_len)',
+            '      return col;',
+            '',
+            '  if (PyObject_AsWriteBuffer(col, &buf, &len)) {',
+            '      Py_DECREF(col);',
+            '      return NULL;',
+            '  }',
+            '  memcpy(buf, py_tree_cols[field], py_tree_len * sizeof(int));',
+            '  return col;',
+            '}',
+            '',
+            'PyObject *py_tree_data(void)',
+            '{',
+            '  PyObject *module, *zero, *res, *col, *values;',
+            '  int i;',
+            '',
+            '  module = PyImport_ImportModule("array");',
+            '  if (!module)',
+            '      return NULL;',
+            '  zero = PyObject_CallMethod(module, "array", "s[i]", "i", 0);',
+            '  Py_DECREF(module);',
+            '  if (!zero)',
+            '      return NULL;',
+            '',
+            '  res = PyTuple_New(PY_TREE_FIELDS + 1);',
+            '  for (i = 0; res && i < PY_TREE_FIELDS; i++) {',
+            '      col = py_tree_column(zero, i);',
+            '      if (!col) {',
+            '          Py_CLEAR(res);',
+            '          break;',
+            '      }',
+            '      PyTuple_SET_ITEM(res, i, col);',
+            '  }',
+            '  Py_DECREF(zero);',
+            '',
+            '  if (res) {',
+            '      values = py_tree_values ? py_tree_values : Py_None;',
+            '      Py_INCREF(values);',
+            '      PyTuple_SET_ITEM(res, PY_TREE_FIELDS, values);',
+            '  }',
+            '  return res;',
+            '}',
+            '',
+            ])
+
+    def generate_columnar_action(self, option, targets):
+        """
+        Returns the C code which reduces a rule option in the columnar tree
+        mode (see generate_tree_helper): it adds entries for the tokens of
+        the option, and one for the node, which links the entries of its
+        terms as its children.
+        """
+        terms = option[:termCount(option)]
+        tokens = self.parser.tokens
+
+        s = '          if (py_columnar) {\n'
+        if terms:
+            s += '              int kids[%d];\n' % len(terms)
+        if 'error' in option:
+            s += '              yyerrok;\n'
+        s += '              if (py_trace_size)\n'
+        s += '                  py_trace(PY_TRACE_REDUCE, *yyssp, yychar, yyn - 1, &@$);\n'
+
+        for i in range(len(terms)):
+            term = terms[i]
+            if term in targets:
+                s += '              kids[%d] = PY_TREE_INDEX($%d);\n' % (i, i + 1)
+                continue
+
+            value = '(PyObject *)$%d' % (i + 1)
+            if term == 'error':
+                token, value = '256', 'NULL'
+            elif term in tokens or term.startswith("'"):
+                token = term
+            else:
+                token = '0'
+
+            s += '              kids[%d] = py_tree_leaf(%s, &@%d, %s);\n' \
+                 % (i, token, i + 1, value)
+
+        s += '              $$ = PY_TREE_REF(py_tree_node(yyn - 1, &@$, %s, %d));\n' \
+             % (terms and 'kids' or 'NULL', len(terms))
+        s += '              if (!$$)\n'
+        s += '                  YYERROR;\n'
+        s += '          }\n'
+
+        return s
+
+    def wrap_columnar_action(self, prelude, action, option, targets):
+        """
+        Returns the full C action of a rule option: the checks done for every
+        reduction (prelude), followed by the columnar tree mode code, with
+        the rest of the action in its else branch.
+        """
+        end = '        }\n'
+        body = action[len(prelude):-len(end)]
+
+        return prelude + self.generate_columnar_action(option, targets) \
+               + '          else {\n' + body + '          }\n' + end
+
+    def generate_trace_helper(self):
+        """
+        Returns the C code of the ring buffer which keeps the last events of
+        the parse when the parser's trace_size is set: the tokens read by the
+        parser ('shift'), the reductions and the syntax errors, each with the
+        parser state, the lookahead token, the rule and the location.
+        """
+        return '\n'.join([
+            '#define PY_TRACE_SHIFT 1',
+            '#define PY_TRACE_REDUCE 2',
+            '#define PY_TRACE_ERROR 3',
+            '',
+            '#define PY_TRACE_FIELDS 8',
+            '',
+            'int py_trace_size = 0;',
+            'int *py_trace_buf = NULL;',
+            'long py_trace_count = 0;',
+            '',
+            'static void py_trace(int kind, int state, int token, int rule,',
+            '                     YYLTYPE *loc)',
+            '{',
+            '  int *ev = py_trace_buf',
+            '            + (py_trace_count % py_trace_size) * PY_TRACE_FIELDS;',
+            '',
+            '  ev[0] = kind;',
+            '  ev[1] = state;',
+            '  ev[2] = token;',
+            '  ev[3] = rule;',
+            '  ev[4] = loc->first_line;',
+            '  ev[5] = loc->first_column;',
+            '  ev[6] = loc->last_line;',
+            '  ev[7] = loc->last_column;',
+            '  py_trace_count++;',
+            '}',
+            '',
+            'static void py_trace_resize(long size)',
+            '{',
+            '  if (size < 0)',
+            '      size = 0;',
+            '  if (size == py_trace_size)',
+            '      return;',
+            '',
+            '  free(py_trace_buf);',
+            '  py_trace_buf = NULL;',
+            '  py_trace_size = py_trace_count = 0;',
+            '',
+            '  if (size) {',
+            '      py_trace_buf = malloc(size * PY_TRACE_FIELDS * sizeof(int));',
+            '      if (py_trace_buf)',
+            '          py_trace_size = size;',
+            '  }',
+            '}',
+            '',
+            'PyObject *py_reset_trace(void)',
+            '{',
+            '  py_trace_count = 0;',
+            '  Py_RETURN_NONE;',
+            '}',
+            '',
+            'PyObject *py_trace_data(void)',
+            '{',
+            '  long n, first, i;',
+            '  size_t evbytes = PY_TRACE_FIELDS * sizeof(int);',
+            '  PyObject *data;',
+            '  char *out;',
+            '',
+            '  n = py_trace_count < py_trace_size ? py_trace_count : py_trace_size;',
+            '  first = py_trace_count - n;',
+            '',
+            '  data = PyString_FromStringAndSize(NULL, n * evbytes);',
+            '  if (!data)',
+            '      return NULL;',
+            '',
+            '  /* oldest event first */',
+            '  out = PyString_AS_STRING(data);',
+            '  for (i = first; i < py_trace_count; i++)',
+            '      memcpy(out + (i - first) * evbytes,',
+            '             py_trace_buf + (i % py_trace_size) * PY_TRACE_FIELDS,',
+            '             evbytes);',
+            '',
+            '  return Py_BuildValue("(Nl)", data, py_trace_count);',
+            '}',
+            '',
+            ])
+
+    def generate_limit_helper(self):
+        """
+        Returns the C code which aborts the parse when it runs into one of
+        the limits set for the run, or is cancelled.
+
+        The scanner is wrapped by a function which counts (and traces) the
+        tokens, and returns the end of input once the parse is to be
+        aborted. It is passed the parser state, so it can only be called
+        from within yyparse(). The
+        actions count the reductions, and YYABORT once the parse is to be
+        aborted. The clock is only read every PY_CLOCK_INTERVAL tokens and
+        reductions.
+        """
+        return '\n'.join([
+            '#include <sys/time.h>',
+            '',
+            '#define PY_LIMIT_NONE 0',
+            '#define PY_LIMIT_ERROR 1',
+            '#define PY_LIMIT_CANCELLED 2',
+            '#define PY_LIMIT_DEADLINE 3',
+            '#define PY_LIMIT_TOKENS 4',
+            '#define PY_LIMIT_REDUCTIONS 5',
+            '#define PY_LIMIT_BYTES 6',
+            '#define PY_LIMIT_NODES 7',
+            '#define PY_LIMIT_MEMORY 8',
+            '',
+            '#define PY_CLOCK_INTERVAL 256',
+            '',
+            'int py_abort = 0;',
+            'volatile int py_cancelled = 0;',
+            '',
+            'int py_limits_active = 0;',
+            'double py_deadline = 0;',
+            'long py_max_tokens = 0, py_max_reductions = 0, py_max_bytes = 0;',
+            'long py_token_count = 0, py_reduction_count = 0;',
+            'long py_stack_peak = 0;',
+            '',
+            'static int py_stop(int reason)',
+            '{',
+            '  py_abort = reason;',
+            '  return 1;',
+            '}',
+            '',
+            'static int py_past_deadline(long count)',
+            '{',
+            '  struct timeval now;',
+            '',
+            '  if (py_deadline <= 0 || count % PY_CLOCK_INTERVAL)',
+            '      return 0;',
+            '',
+            '  gettimeofday(&now, NULL);',
+            '  return now.tv_sec + now.tv_usec / 1e6 > py_deadline;',
+            '}',
+            '',
+            'static int py_check_token(void)',
+            '{',
+            '  py_token_count++;',
+            '',
+            '  if (py_cancelled)',
+            '      return py_stop(PY_LIMIT_CANCELLED);',
+            '  if (py_max_tokens && py_token_count > py_max_tokens)',
+            '      return py_stop(PY_LIMIT_TOKENS);',
+            '  if (py_max_bytes && py_loc_byte > py_max_bytes)',
+            '      return py_stop(PY_LIMIT_BYTES);',
+            '  if (py_past_deadline(py_token_count))',
+            '      return py_stop(PY_LIMIT_DEADLINE);',
+            '  return 0;',
+            '}',
+            '',
+            'static int py_check_reduction(void)',
+            '{',
+            '  py_reduction_count++;',
+            '',
+            '  if (py_cancelled)',
+            '      return py_stop(PY_LIMIT_CANCELLED);',
+            '  if (py_max_reductions && py_reduction_count > py_max_reductions)',
+            '      return py_stop(PY_LIMIT_REDUCTIONS);',
+            '  if (py_past_deadline(py_reduction_count))',
+            '      return py_stop(PY_LIMIT_DEADLINE);',
+            '  return 0;',
+            '}',
+            '',
+            'int yylex(void);',
+            '',
+            'static int py_yylex(int state)',
+            '{',
+            '  int tok;',
+            '',
+            '  if (py_abort || (py_limits_active && py_check_token()))',
+            '      return 0;',
+            '',
+            '  tok = yylex();',
+            '  if (py_trace_size)',
+            '      py_trace(PY_TRACE_SHIFT, state, tok, -1, &yylloc);',
+            '  return tok;',
+            '}',
+            '',
+            '#undef yylex',
+            '#define yylex() py_yylex(yystate)',
+            '',
+            'PyObject *py_reset_limits(void)',
+            '{',
+            '  py_cancelled = 0;',
+            '  py_token_count = py_reduction_count = 0;',
+            '  py_stack_peak = 0;',
+            '  Py_RETURN_NONE;',
+            '}',
+            '',
+            'PyObject *py_abort_nodes(void)',
+            '{',
+            '  py_stop(PY_LIMIT_NODES);',
+            '  Py_RETURN_NONE;',
+            '}',
+            '',
+            'PyObject *py_abort_memory(void)',
+            '{',
+            '  py_stop(PY_LIMIT_MEMORY);',
+            '  Py_RETURN_NONE;',
+            '}',
+            '',
+            '#ifndef YYINITDEPTH',
+            '# define PY_INITDEPTH 200',
+            '#else',
+            '# define PY_INITDEPTH YYINITDEPTH',
+            '#endif',
+            '',
+            '#ifndef YYMAXDEPTH',
+            '# define PY_MAXDEPTH 10000',
+            '#else',
+            '# define PY_MAXDEPTH YYMAXDEPTH',
+            '#endif',
+            '',
+            'PyObject *py_stack_stats(void)',
+            '{',
+            '  return Py_BuildValue("(lii)", py_stack_peak,',
+            '                       PY_INITDEPTH, PY_MAXDEPTH);',
+            '}',
+            '',
+            'PyObject *py_cancel(void)',
+            '{',
+            '  py_cancelled = 1;',
+            '  Py_RETURN_NONE;',
+            '}',
+            '',
+            'PyObject *py_limit_status(void)',
+            '{',
+            '  static const char *reasons[] = {NULL, "error", "cancelled",',
+            '      "deadline", "tokens", "reductions", "bytes", "nodes",',
+            '      "memory"};',
+            '',
+            '  if (py_abort <= PY_LIMIT_ERROR)',
+            '      Py_RETURN_NONE;',
+            '  return Py_BuildValue("(sll)", reasons[py_abort],',
+            '                       py_token_count, py_reduction_count);',
+            '}',
+            '',
+            ])
+
+    def generate_error_helper(self):
+        """
+        Returns the C code which collects syntax errors in a list of records
+        instead of reporting them to the parser one by one, when the parser's
+        error_mode is 'collect' or 'failfast', and which traces the errors
+        reported by the parser.
+
+        In the failfast mode, the first error aborts the parse (see
+        generate_limit_helper()), so no error recovery is attempted.
+        """
+        return '\n'.join([
+            '#define PY_ERRORS_RAISE 0',
+            '#define PY_ERRORS_COLLECT 1',
+            '#define PY_ERRORS_FAILFAST 2',
+            '',
+            'int py_error_mode = PY_ERRORS_RAISE;',
+            'PyObject *py_error_records = NULL;',
+            '',
+            'static void py_record_error(const char *msg)',
+            '{',
+            '  PyObject *record;',
+            '',
+            '  if (!py_error_records) {',
+            '      py_error_records = PyList_New(0);',
+            '      if (!py_error_records) {',
+            '          PyErr_Clear();',
+            '          return;',
+            '      }',
+            '  }',
+            '',
+            '  record = Py_BuildValue("(iiiiss)",',
+            '                         yylloc.first_line, yylloc.first_column,',
+            '                         yylloc.last_line, yylloc.last_column,',
+            '                         msg, yytext ? yytext : "");',
+            '  if (!record || PyList_Append(py_error_records, record))',
+            '      PyErr_Clear();',
+            '  Py_XDECREF(record);',
+            '}',
+            '',
+            'PyObject *py_error_data(void)',
+            '{',
+            '  PyObject *res = py_error_records;',
+            '',
+            '  py_error_records = NULL;',
+            '  if (!res)',
+            '      res = PyList_New(0);',
+            '  return res;',
+            '}',
+            '',
+            'int yyerror(char *msg);',
+            '',
+            'static int py_yyerror(const char *msg, int state, int token)',
+            '{',
+            '  if (py_trace_size && !py_abort)',
+            '      py_trace(PY_TRACE_ERROR, state, token, -1, &yylloc);',
+            '  return yyerror((char *)msg);',
+            '}',
+            '',
+            '#undef yyerror',
+            '#define yyerror(msg) py_yyerror(msg, yystate, yychar)',
+            '',
+            ])
+
+    def generate_token_bridge(self):
+        """
+        Returns the C code of the scanner of parsers with a Python tokenizer
+        (see BisonParser.tokenizer), which takes the place of yylex().
+
+        The tokenizer's iterator of token batches is the parser's
+        '_token_source' attribute. Each batch is fetched with one call into
+        Python, and its tokens are then handed to the parser from C, one per
+        yylex() call. The rest of a batch is kept when the engine is
+        restarted after an error, as long as the parser's token source stays
+        the same. Once the tokenizer is exhausted, '_token_source' is set to
+        None.
+
+        For lex script parsers, this is a no-op.
+        """
+        if not usesTokenizer(self.parser):
+            return '#define py_open_token_source()\n'
+
+        names = []
+        for name in self.parser.tokens:
+            names.append('  {"%s", %s},' % (name, name))
+
+        return '\n'.join([
+            'char *yytext = "";',
+            '',
+            'static const struct {',
+            '  const char *name;',
+            '  int id;',
+            '} py_token_table[] = {',
+            ] + names + [
+            '  {NULL, 0}',
+            '};',
+            '',
+            'static PyObject *py_token_ids = NULL;',
+            'static PyObject *py_token_source = NULL, *py_token_batch = NULL;',
+            'static Py_ssize_t py_token_pos = 0, py_token_len = 0;',
+            '',
+            'static void py_drop_tokens(void)',
+            '{',
+            '  Py_CLEAR(py_token_batch);',
+            '  Py_CLEAR(py_token_source);',
+            '  py_token_pos = py_token_len = 0;',
+            '  yytext = "";',
+            '}',
+            '',
+            'static void py_open_token_source(void)',
+            '{',
+            '  PyObject *source, *id;',
+            '  int i;',
+            '',
+            '  if (!py_token_ids) {',
+            '      py_token_ids = PyDict_New();',
+            '      for (i = 0; py_token_ids && py_token_table[i].name; i++) {',
+            '          id = PyInt_FromLong(py_token_table[i].id);',
+            '          if (!id || PyDict_SetItemString(py_token_ids,',
+            '                                          py_token_table[i].name, id))',
+            '              Py_CLEAR(py_token_ids);',
+            '          Py_XDECREF(id);',
+            '      }',
+            '      PyErr_Clear();',
+            '  }',
+            '',
+            '  source = PyObject_GetAttrString(py_parser, "_token_source");',
+            '  if (!source) {',
+            '      PyErr_Clear();',
+            '      py_drop_tokens();',
+            '      return;',
+            '  }',
+            '',
+            '  /* a restart after an error goes on with the same batch */',
+            '  if (source == py_token_source) {',
+            '      Py_DECREF(source);',
+            '      return;',
+            '  }',
+            '',
+            '  py_drop_tokens();',
+            '  if (source == Py_None)',
+            '      Py_DECREF(source);',
+            '  else',
+            '      py_token_source = source;',
+            '}',
+            '',
+            'static void py_close_token_source(void)',
+            '{',
+            '  py_drop_tokens();',
+            '  if (PyObject_SetAttrString(py_parser, "_token_source", Py_None))',
+            '      PyErr_Clear();',
+            '}',
+            '',
+            'static int py_token_error(void)',
+            '{',
+            '  py_abort = PY_LIMIT_ERROR;',
+            '  return 0;',
+            '}',
+            '',
+            'static int py_token_location(PyObject *loc)',
+            '{',
+            '  long f[6];',
+            '  Py_ssize_t i, n;',
+            '',
+            '  if (loc == Py_None) {',
+            '      yylloc.first_line = yylloc.last_line;',
+            '      yylloc.first_column = yylloc.last_column;',
+            '      yylloc.first_byte = yylloc.last_byte;',
+            '      return 1;',
+            '  }',
+            '',
+            '  n = PyTuple_Check(loc) ? PyTuple_GET_SIZE(loc) : 0;',
+            '  if (n != 4 && n != 6) {',
+            '      PyErr_SetString(PyExc_TypeError, "token locations must be "',
+            '                      "None, or tuples of 4 or 6 ints");',
+            '      return 0;',
+            '  }',
+            '',
+            '  for (i = 0; i < n; i++)',
+            '      f[i] = PyInt_AsLong(PyTuple_GET_ITEM(loc, i));',
+            '  if (PyErr_Occurred())',
+            '      return 0;',
+            '',
+            '  yylloc.first_line = f[0];',
+            '  yylloc.first_column = f[1];',
+            '  yylloc.last_line = f[2];',
+            '  yylloc.last_column = f[3];',
+            '  if (n == 6) {',
+            '      yylloc.first_byte = f[4];',
+            '      yylloc.last_byte = py_loc_byte = f[5];',
+            '  }',
+            '  return 1;',
+            '}',
+            '',
+            '/* the real scanner, which py_yylex() wraps */',
+            '#undef yylex',
+            '#define yylex %slex' % symbolPrefix(self.parser),
+            '',
+            'int yylex(void)',
+            '{',
+            '  PyObject *batch, *tok, *name, *value, *id;',
+            '  int tokid;',
+            '',
+            '  while (py_token_pos == py_token_len) {',
+            '      Py_CLEAR(py_token_batch);',
+            '      py_token_pos = py_token_len = 0;',
+            '',
+            '      if (!py_token_source)',
+            '          return 0;',
+            '',
+            '      batch = PyIter_Next(py_token_source);',
+            '      if (!batch) {',
+            '          if (PyErr_Occurred())',
+            '              return py_token_error();',
+            '          py_close_token_source();',
+            '          return 0;',
+            '      }',
+            '',
+            '      py_token_batch = PySequence_Fast(batch,',
+            '                                       "token batches must be sequences");',
+            '      Py_DECREF(batch);',
+            '      if (!py_token_batch)',
+            '          return py_token_error();',
+            '      py_token_len = PySequence_Fast_GET_SIZE(py_token_batch);',
+            '  }',
+            '',
+            '  tok = PySequence_Fast_GET_ITEM(py_token_batch, py_token_pos);',
+            '  py_token_pos++;',
+            '',
+            '  if (!PyTuple_Check(tok) || PyTuple_GET_SIZE(tok) != 3) {',
+            '      PyErr_SetString(PyExc_TypeError, "tokens must be "',
+            '                      "(token, value, location) tuples");',
+            '      return py_token_error();',
+            '  }',
+            '',
+            '  name = PyTuple_GET_ITEM(tok, 0);',
+            '  value = PyTuple_GET_ITEM(tok, 1);',
+            '',
+            '  if (PyInt_Check(name))',
+            '      tokid = PyInt_AS_LONG(name);',
+            '  else if (py_token_ids && (id = PyDict_GetItem(py_token_ids, name)))',
+            '      tokid = PyInt_AS_LONG(id);',
+            '  else if (PyString_Check(name) && PyString_GET_SIZE(name) == 1)',
+            '      tokid = (unsigned char)PyString_AS_STRING(name)[0];',
+            '  else {',
+            '      PyObject *repr = PyObject_Repr(name);',
+            '      PyErr_Format(PyExc_ValueError, "unknown token %s",',
+            '                   repr ? PyString_AsString(repr) : "?");',
+            '      Py_XDECREF(repr);',
+            '      return py_token_error();',
+            '  }',
+            '',
+            '  if (!py_token_location(PyTuple_GET_ITEM(tok, 2)))',
+            '      return py_token_error();',
+            '',
+            '  if (PyString_Check(value))',
+            '      yytext = PyString_AS_STRING(value);',
+            '  else if (PyString_Check(name))',
+            '      yytext = PyString_AS_STRING(name);',
+            '  else',
+            '      yytext = "";',
+            '',
+            '  /* token values are new references, as made by py_token_value() */',
+            '  Py_INCREF(value);',
+            '  yylval = value;',
+            '  return tokid;',
+            '}',
+            '',
+            '#undef yylex',
+            '#define yylex() py_yylex(yystate)',
+            '',
+            ])
+
+    def generate_tokenize_helper(self):
+        """
+        Returns the C code of do_tokenize(), which runs the scanner over the
+        whole input without the parser, and returns the token ids, start and
+        end byte offsets and first lines of the tokens as four strings of raw
+        ints.
+
+        Token values created by the lex script are dropped right away, so
+        they must be new references (as returned by py_token_value()).
+        """
+        return '\n'.join([
+            '/* the scanner itself, without the limit checks and tracing */',
+            '#undef yylex',
+            '#define yylex %slex' % symbolPrefix(self.parser),
+            '',
+            'PyObject *do_tokenize(void *parser1,',
+            '                      void (*in)(void *, char*, int *, int))',
+            '{',
+            '  int *cols[4] = {NULL, NULL, NULL, NULL};',
+            '  size_t len = 0, size = 0;',
+            '  PyObject *res = NULL;',
+            '  int i, tok;',
+            '',
+            '  py_set_input(in);',
+            '  py_parser = parser1;',
+            '  py_abort = 0;',
+            '  py_open_token_source();',
+            '',
+            '  for (;;) {',
+            '      yylval = NULL;',
+            '      tok = yylex();',
+            '      Py_XDECREF((PyObject *)yylval);',
+            '',
+            '      if (PyErr_Occurred())',
+            '          goto done;',
+            '      if (tok <= 0)',
+            '          break;',
+            '',
+            '      if (len == size) {',
+            '          size = size ? size * 2 : 4096;',
+            '          for (i = 0; i < 4; i++) {',
+            '              int *col = realloc(cols[i], size * sizeof(int));',
+            '              if (!col) {',
+            '                  PyErr_NoMemory();',
+            '                  goto done;',
+            '              }',
+            '              cols[i] = col;',
+            '          }',
+            '      }',
+            '',
+            '      cols[0][len] = tok;',
+            '      cols[1][len] = yylloc.first_byte;',
+            '      cols[2][len] = yylloc.last_byte;',
+            '      cols[3][len] = yylloc.first_line;',
+            '      len++;',
+            '  }',
+            '',
+            '  res = Py_BuildValue("(s#s#s#s#)",',
+            '                      cols[0] ? (char *)cols[0] : "",',
+            '                      (int)(len * sizeof(int)),',
+            '                      cols[1] ? (char *)cols[1] : "",',
+            '                      (int)(len * sizeof(int)),',
+            '                      cols[2] ? (char *)cols[2] : "",',
+            '                      (int)(len * sizeof(int)),',
+            '                      cols[3] ? (char *)cols[3] : "",',
+            '                      (int)(len * sizeof(int)));',
+            '',
+            'done:',
+            '  for (i = 0; i < 4; i++)',
+            '      free(cols[i]);',
+            '  return res;',
+            '}',
+            '',
+            ])
+
+    def generate_rule_names(self, rules):
+        """
+        Returns the C code of py_rule_names(), which returns the (target,
+        option) of each rule of the grammar by bison rule number, for
+        decoding the rules of trace events. Bison's rule 0 is its own start
+        rule, '$accept'.
+        """
+        targets = ['"$accept"']
+        options = ['0']
+        for rule in rules:
+            target, opts = rule[0], rule[1]
+            for i in range(len(opts)):
+                targets.append('"%s"' % target)
+                options.append(str(i))
+
+        return '\n'.join([
+            'static const char *py_rule_targets[] = {',
+            '  ' + ', '.join(targets),
+            '};',
+            '',
+            'static const int py_rule_options[] = {',
+            '  ' + ', '.join(options),
+            '};',
+            '',
+            'PyObject *py_rule_names(void)',
+            '{',
+            '  int i, n = sizeof(py_rule_options) / sizeof(int);',
+            '  PyObject *res = PyTuple_New(n), *item;',
+            '',
+            '  for (i = 0; res && i < n; i++) {',
+            '      item = Py_BuildValue("(si)", py_rule_targets[i],',
+            '                           py_rule_options[i]);',
+            '      if (!item) {',
+            '          Py_CLEAR(res);',
+            '          break;',
+            '      }',
+            '      PyTuple_SET_ITEM(res, i, item);',
+            '  }',
+            '  return res;',
+            '}',
+            '',
+            ])
+
+    def build(self):
+        """
+        Builds the parser engine lib, with profile-guided optimisation if
+        the parser has training inputs.
+        """
+        if self.parser.pgo_training:
+            self.buildProfiledLib()
+        else:
+            self.buildLib()
+
+    def buildProfiledLib(self):
+        """
+        Builds a profile-guided optimised parser engine lib (needs gcc)
+
+        This consists of:
+            1. Building an engine which is instrumented to collect a profile
+            2. Running the parser's training inputs through it, and writing
+               out the profile
+            3. Rebuilding the engine with the profile
+
+        The profile is kept in the build directory, by the parser hash
+        (which covers the training inputs), so the first two steps are
+        skipped when a profile for the current parser exists. Engines created
+        with train set to 0 stop after the first step, and leave the others
+        to finishTraining().
+        """
+        parser = self.parser
+        self.pgoDir = profileDirectory(parser, self.parserHash)
+
+        try:
+            if not hasProfile(self.pgoDir):
+                if parser.verbose:
+                    print 'building instrumented engine, profile in', \
+                          self.pgoDir
+                self.pgoPhase = 'generate'
+                self.buildLib()
+
+                if self.canTrain:
+                    self.openLib()
+                    try:
+                        self.train()
+                    finally:
+                        self.closeLib()
+                else:
+                    self.untrained = 1
+
+            if not self.untrained:
+                if parser.verbose:
+                    print 'building engine with profile', self.pgoDir
+                self.pgoPhase = 'use'
+                self.buildLib()
+        finally:
+            self.pgoPhase = None
+
+    def finishTraining(self):
+        """
+        Trains an engine which was built without its training, and rebuilds
+        it with the collected profile (see buildProfiledLib()). Does nothing
+        for other engines.
+
+        BisonParser.reload() builds engines in a background thread, and has
+        them trained here, in the thread using the parser, while the parser
+        is not running: the training parses run the parser's handlers.
+        """
+        if not self.untrained:
+            return
+
+        parser = self.parser
+
+        try:
+            try:
+                self.pgoPhase = 'generate'
+                self.openLib()
+                try:
+                    self.train()
+                finally:
+                    self.closeLib()
+
+                if parser.verbose:
+                    print 'building engine with profile', self.pgoDir
+                self.pgoPhase = 'use'
+                self.buildLib()
+            except:
+                # don't leave the instrumented lib to be loaded later on
+                if os.path.isfile(self.libFilename_py):
+                    os.unlink(self.libFilename_py)
+                raise
+        finally:
+            self.pgoPhase = None
+
+        self.untrained = 0
+
+    def train(self):
+        """
+        Parses the training inputs of the parser with the loaded (instrumented)
+        engine lib, and writes out the collected profile. Inputs which fail
+        to parse still add to the profile.
+
+        The inputs are parsed by a copy of the parser, which leaves the
+        engine and the run state of the parser itself alone. The copy shares
+        the rest of the parser's attributes, so the parser must not be
+        running meanwhile (see finishTraining()).
+        """
+        parser = self.parser
+        trainer = copy.copy(parser)
+        trainer.engine = self
+        trainer._next_engine = None
+        trainer._reload_thread = None
+        trainer._engine_users = 0
+        self.parser = trainer
+
+        try:
+            for filename in parser.pgo_training:
+                if parser.verbose:
+                    print 'training on', filename
+                try:
+                    trainer.run(file=filename, cache=0)
+                except Exception, e:
+                    if parser.verbose:
+                        print 'training on %s failed: %s' % (filename, e)
+        finally:
+            self.parser = parser
+
+        self.callEngine('py_gcov_dump')
+
+    def compileFlags(self):
+        """
+        Returns the compiler options which are added after the arguments of
+        the compiler, for the engine being built.
+        """
+        flags = self.parser.cflags_post + pgoFlags(self.pgoPhase, self.pgoDir)
+
+        if callbackLinkage(self.parser) == 'lto':
+            flags = flags + ['-flto']
+
+        return flags
+
+    def buildLib(self):
+        """
+        Creates the parser engine lib
+
+        This consists of:
+            1. Building the object file of the grammar half of the engine
+               (see buildGrammar())
+            2. Building the object file of the scanner half of the engine
+               (see buildScanner())
+            3. Compiling the callback layer, if the parser links it into
+               the engine (see buildCallbacks())
+            4. Compiling the file holding the parser hash, and linking it
+               with the object files into a dynamic lib
+
+        When the parser's cache_objects is set, the object files are kept in
+        the build directory, named by the fingerprints of the inputs of
+        their half (see grammarHash() and scannerHash()). A half whose object
+        file is found is not rebuilt, so a change to the lex script only
+        reruns flex and recompiles the scanner, and vice versa.
+        """
+        parser = self.parser
+        buildDirectory = parser.buildDirectory
+
+        # create and set up a compiler object
+        env = distutils.ccompiler.new_compiler(verbose=parser.verbose)
+        env.set_include_dirs([distutils.sysconfig.get_python_inc()])
+
+        objs = []
+
+        cflags = self.compileFlags()
+
+        grammarObj = objectFilename(parser, 'grammar', grammarHash(parser),
+                                    env.obj_extension, cflags)
+        if not (parser.cache_objects and os.path.isfile(grammarObj)
+                and os.path.isfile(headerFilename(grammarObj))):
+            self.buildGrammar(env, grammarObj)
+        elif parser.verbose:
+            print 'using cached grammar object:', grammarObj
+        objs.append(grammarObj)
+
+        if not usesTokenizer(parser):
+            scannerObj = objectFilename(parser, 'scanner',
+                                        scannerHash(parser),
+                                        env.obj_extension, cflags)
+            if not (parser.cache_objects and os.path.isfile(scannerObj)):
+                self.buildScanner(env, scannerObj, headerFilename(grammarObj))
+            elif parser.verbose:
+                print 'using cached scanner object:', scannerObj
+            objs.append(scannerObj)
+
+        if callbackLinkage(parser) != 'module':
+            callbackObj = objectFilename(parser, 'callback',
+                                         callbackHash(parser),
+                                         env.obj_extension, cflags)
+            if not (parser.cache_objects and os.path.isfile(callbackObj)):
+                self.buildCallbacks(env, callbackObj)
+            elif parser.verbose:
+                print 'using cached callback object:', callbackObj
+            objs.append(callbackObj)
+
+        # the parser hash is compiled on its own, so that neither half has
+        # to be rebuilt when only the other one changed
+        f = open(buildDirectory + parser.hashCFile, 'w')
+        f.write('char *rules_hash = "%s";\n' % self.parserHash)
+
+        # let the training runs of an instrumented engine write out their
+        # profile before the lib is unloaded
+        if self.pgoPhase == 'generate':
+            f.write('\n'.join([
+                '',
+                '#include "Python.h"',
+                '',
+                'extern void __gcov_dump(void);',
+                '',
+                'PyObject *py_gcov_dump(void)',
+                '{',
+                '  __gcov_dump();',
+                '  Py_RETURN_NONE;',
+                '}',
+                '']))
+        f.close()
+
+        hashObjs = env.compile([buildDirectory + parser.hashCFile],
+                               extra_preargs=parser.cflags_pre,
+                               extra_postargs=parser.cflags_post,
+                               debug=parser.debugSymbols)
+
+        # -----------------------------------------
+        # Now link the object files into a shared lib
+
+        #cl /DWIN32 /G4 /Gs /Oit /MT /nologo /W3 /WX bisondynlib-win32.c /Id:\python23\include
+        #cc.compile(['bisondynlib-win32.c'],
+        #           extra_preargs=['/DWIN32', '/G4', '/Gs', '/Oit', '/MT', '/nologo', '/W3', '/WX', '/Id:\python23\include'])
+
+        objs = objs + hashObjs
+
+        libFileName = self.libFilename_py
+
+        # a lib of the same version is only rebuilt when it is stale or
+        # instrumented; unlinking it leaves the copy mapped by a process
+        # which has it loaded intact, without keeping a backup around
+        if os.path.isfile(libFileName):
+            os.unlink(libFileName)
+
+        if parser.verbose:
+            print 'linking: %s => %s' % (', '.join(objs), libFileName)
+
+        if sys.platform.startswith('darwin'):
+            # on OSX, ld throws undefined symbol for shared library references
+            # however, we would like to link against libpython dynamically, so that
+            # the built .so will not depend on which python interpreter it runs on 
+            env.linker_so += ['-undefined', 'dynamic_lookup']
+
+        # instrumented engines are linked with the profiling runtime, and
+        # link-time optimised ones are optimised with the compiler options
+        linkFlags = []
+        if callbackLinkage(parser) == 'lto':
+            linkFlags = cflags
+        elif self.pgoPhase == 'generate':
+            linkFlags = pgoFlags('generate', self.pgoDir)
+
+        # engines are loaded RTLD_LOCAL, and each has its own symbol prefix;
+        # still bind the engine's own references within the lib, so that
+        # a symbol of the host or another lib never takes their place
+        if sys.platform.startswith('linux'):
+            linkFlags = linkFlags + ['-Wl,-Bsymbolic']
+
+        env.link_shared_object(objs, libFileName, extra_postargs=linkFlags)
+        dropObjects(libFileName)
+
+        #cdef char *incdir
+        #incdir = PyString_AsString(get_python_inc())
+        #bisondynlib_build(self.libFilename_py, incdir)
+
+        # --------------------------------------------
+        # clean up, if we succeeded
+        hitlist = hashObjs[:]
+        hitlist.append(parser.bisonOutputFile)
 
-        parser = self.parser
+        if not parser.cache_objects:
+            for obj in objs[:-len(hashObjs)]:
+                hitlist.append(obj)
+            hitlist.append(headerFilename(grammarObj))
 
-        if parser.verbose:
-            print 'Opening library %s' % self.libFilename_py
-        handle = bisondynlib_open(libFilename)
-        self.libHandle = handle
-        err = bisondynlib_err()
-        if err:
-            printf('ParserEngine.openLib: error "%s"\n', err)
-            return
+        if os.path.isfile(libFileName):
+            for name in ['bisonFile', 'bisonCFile', 'bisonHFile',
+                         'bisonCFile1', 'bisonHFile1', 'flexFile',
+                         'flexCFile', 'flexCFile1', 'hashCFile',
+                         'callbackCFile',
+                         ]:
+                if hasattr(parser, name):
+                    fname = buildDirectory + getattr(parser, name)
+                else:
+                    fname = None
+                #print "want to delete %s" % fname
+                if fname and os.path.isfile(fname):
+                    hitlist.append(fname)
 
-        # extract symbols
-        self.libHash = bisondynlib_lookup_hash(handle)
+        if not parser.keepfiles:
+            for f in hitlist:
+                if not os.path.isfile(f):
+                    continue
+                try:
+                    os.unlink(f)
+                except:
+                    print "Warning: failed to delete temporary file %s" % f
 
         if parser.verbose:
-            print 'Successfully loaded library'
-
-    def generate_exception_handler(self):
-        s = ''
+            print 'deleting temporary bison output files:'
 
-        s += '          {\n'
-        s += '            PyObject* obj = PyErr_Occurred();\n'
-        s += '            if (obj) {\n'
-        s += '              //yyerror("exception raised");\n'
-        s += '              YYERROR;\n'
-        s += '            }\n'
-        s += '          }\n'
+        for f in [parser.bisonCFile, parser.bisonHFile, parser.flexCFile]:
+            if parser.verbose:
+                print 'rm %s' % f
 
-        return s
+            if os.path.isfile(f):
+                os.unlink(f)
 
-    def buildLib(self):
+    def buildGrammar(self, env, objFile):
         """
-        Creates the parser engine lib
+        Builds the grammar half of the parser engine into an object file
 
         This consists of:
-            1. Ripping the tokens list, precedences, start target, handler docstrings
-               and lex script from this Parser instance's attribs and methods
-            2. Creating bison and lex files
-            3. Compiling bison/lex files to C
-            4. Compiling the C files, and link into a dynamic lib
+            1. Ripping the tokens list, precedences, start target and handler
+               docstrings from this Parser instance's attribs and methods
+            2. Creating the bison file
+            3. Compiling the bison file to C
+            4. Compiling the C file
+
+        The bison generated header, which the scanner includes, is kept next
+        to the object file.
         """
-
         # -------------------------------------------------
         # rip the pertinent grammar specs from parser class
         parser = self.parser
@@ -244,7 +2018,6 @@ cdef class ParserEngine:
         gStart = parser.start
         gTokens = parser.tokens
         gPrecedences = parser.precedences
-        gLex = parser.lexscript
 
         buildDirectory = parser.buildDirectory
 
@@ -260,43 +2033,103 @@ cdef class ParserEngine:
         write = f.write
         #writelines = f.writelines
 
+        # the bison and flex generated symbols are prefixed; the macros of
+        # bison take the prefix in upper case
+        prefix = symbolPrefix(parser)
+        PREFIX = prefix.upper()
+
         # grammar file prologue
         write('\n'.join([
             '%code top {',
             '',
             '#include "Python.h"',
+            '#define yyin %sin' % prefix,
+            '#define yytext %stext' % prefix,
             'extern FILE *yyin;',
             #'extern int yylineno;'
             'extern char *yytext;',
-            '#define YYSTYPE void*',
+            '#define %sSTYPE void*' % PREFIX,
             #'extern void *py_callback(void *, char *, int, void*, ...);',
             'void *(*py_callback)(void *, char *, int, int, ...);',
             'void (*py_input)(void *, char *, int *, int);',
             'void *py_parser;',
-            'char *rules_hash = "%s";' % self.parserHash,
+            self.generate_callback_linkage(),
             '#define YYERROR_VERBOSE 1',
+            self.generate_stack_depth(),
             '',
+            self.generate_token_value_helper(),
             '}',
             '',
             '%code requires {',
             '',
-            '#define YYLTYPE YYLTYPE',
-            'typedef struct YYLTYPE',
+            '#define %sLTYPE %sLTYPE' % (PREFIX, PREFIX),
+            'typedef struct %sLTYPE' % PREFIX,
             '{',
             '  int first_line;',
             '  int first_column;',
             '  int last_line;',
             '  int last_column;',
+            '  int first_byte;',
+            '  int last_byte;',
             '  char *filename;',
-            '} YYLTYPE;',
+            '} %sLTYPE;' % PREFIX,
+            '',
+            '/* the unprefixed names, as used by lex scripts */',
+            '#ifndef YYLTYPE',
+            '#define YYLTYPE %sLTYPE' % PREFIX,
+            '#endif',
+            '#if defined YYSTYPE && !defined %sSTYPE' % PREFIX,
+            '#define %sSTYPE YYSTYPE' % PREFIX,
+            '#endif',
             #'',
             #'YYLTYPE yylloc; /* location data */'
             '',
+            '#define YYLLOC_DEFAULT(Current, Rhs, N) \\',
+            '  do { \\',
+            '    YYLTYPE *first = &YYRHSLOC(Rhs, (N) ? 1 : 0); \\',
+            '    YYLTYPE *last = &YYRHSLOC(Rhs, (N) ? (N) : 0); \\',
+            '    (Current).first_line = (N) ? first->first_line \\',
+            '                               : last->last_line; \\',
+            '    (Current).first_column = (N) ? first->first_column \\',
+            '                                 : last->last_column; \\',
+            '    (Current).first_byte = (N) ? first->first_byte \\',
+            '                               : last->last_byte; \\',
+            '    (Current).last_line = last->last_line; \\',
+            '    (Current).last_column = last->last_column; \\',
+            '    (Current).last_byte = last->last_byte; \\',
+            '    (Current).filename = last->filename; \\',
+            '  } while (0)',
+            '',
+            '}',
+            '',
+            '%code provides {',
+            '',
+            '#define yylval %slval' % prefix,
+            '#define yylloc %slloc' % prefix,
+            '',
+            'void *py_token_value(const char *text, int len);',
+            'void py_update_location(const char *text, int len);',
+            '',
+            '#ifndef YY_USER_ACTION',
+            '#define YY_USER_ACTION py_update_location(yytext, yyleng);',
+            '#endif',
+            '',
+            '}',
+            '',
+            '%code {',
+            '',
+            self.generate_location_helper(),
+            self.generate_tree_helper(),
+            self.generate_trace_helper(),
+            self.generate_limit_helper(),
+            self.generate_error_helper(),
+            self.generate_token_bridge(),
             '}',
             '',
             '%locations',
+            '%%define api.prefix {%s}' % prefix,
             '',
-            ]))
+            ] + bisonDefines(parser) + ['', '']))
 
         # write out tokens and start target dec
         write('%%token %s\n\n' % ' '.join(gTokens))
@@ -343,7 +2176,16 @@ cdef class ParserEngine:
                 tmp.append(reSpaces.split(o))
             options = tmp
 
-            rules.append((target, options))
+            rules.append((target, options, nativeCode(h, target, options)))
+
+        # engines with the callback layer linked in call it directly, with the
+        # names and values in arrays
+        linked = callbackLinkage(parser) != 'module'
+
+        # nonterminals, whose values are nodes in the columnar tree mode
+        targets = {}
+        for rule in rules:
+            targets[rule[0]] = 1
 
         # and render rules to grammar file
         for rule in rules:
@@ -357,11 +2199,35 @@ cdef class ParserEngine:
                         nterms = 0
                         option = []
                     action = '\n        {\n'
+                    action = action + '          if (py_abort || (py_limits_active\n'
+                    action = action + '                  && py_check_reduction()))\n'
+                    action = action + '              YYABORT;\n'
+                    action = action + '          if (yyssp - yyss >= py_stack_peak)\n'
+                    action = action + '              py_stack_peak = yyssp - yyss + 1;\n'
+                    prelude = action
+                    if idx in rule[2]:
+                        action = action + self.generate_native_action(
+                                              rule[0], rule[2][idx])
+                        options.append(" ".join(option)
+                                       + self.wrap_columnar_action(
+                                             prelude, action, option, targets))
+                        idx = idx + 1
+                        continue
                     if 'error' in option:
                         action = action + "             yyerrok;\n"
-                    action = action + '          $$ = (*py_callback)(\n            py_parser, "%s", %s, %%s' % \
-                             (rule[0], idx) # note we're deferring the substitution of 'nterms' (last arg)
+                    action = action + '          if (py_track_locations)\n'
+                    action = action + '              py_record_location(&@$);\n'
+                    action = action + '          if (py_trace_size)\n'
+                    action = action + '              py_trace(PY_TRACE_REDUCE, *yyssp, yychar, yyn - 1, &@$);\n'
+                    if linked:
+                        action = action + '          $$ = py_linked_callback_array(\n            py_parser, "%s", %s, %%s' % \
+                                 (rule[0], idx)
+                    else:
+                        action = action + '          $$ = (*py_callback)(\n            py_parser, "%s", %s, %%s' % \
+                                 (rule[0], idx) # note we're deferring the substitution of 'nterms' (last arg)
                     args = []
+                    names = []
+                    values = []
                     i = -1
 
                     if nterms == 0:
@@ -373,10 +2239,19 @@ cdef class ParserEngine:
                                 break # hack for rules using '%prec'
                             o = option[i].replace('"', '\\"')
                             args.append('"%s", $%d' % (o, i+1))
+                            names.append('"%s"' % o)
+                            values.append('$%d' % (i+1))
 
                     # now, we have the correct terms count
                     action = action % (i + 1)
 
+                    if linked:
+                        if names:
+                            args = ['(char *[]){%s}' % ', '.join(names),
+                                    '(PyObject *[]){%s}' % ', '.join(values)]
+                        else:
+                            args = ['NULL', 'NULL']
+
                     # assemble the full rule + action, add to list
                     action = action + ",\n            "
                     action = action + ",\n            ".join(args) + "\n            );\n"
@@ -390,7 +2265,9 @@ cdef class ParserEngine:
 
                     action = action + '        }\n'
 
-                    options.append(" ".join(option) + action)
+                    options.append(" ".join(option)
+                                   + self.wrap_columnar_action(
+                                         prelude, action, option, targets))
                     idx = idx + 1
                 write("    | ".join(options) + "    ;\n\n")
             except:
@@ -406,15 +2283,94 @@ cdef class ParserEngine:
             '              int debug',
             '              )',
             '{',
-            '   py_callback = cb;',
-            '   py_input = in;',
+            '   py_set_callback(cb);',
+            '   py_set_input(in);',
             '   py_parser = parser1;',
+            '#if %sDEBUG' % PREFIX,
             '   yydebug = debug;',
+            '#endif',
+            '',
+            '   py_intern_table = PyObject_GetAttrString(py_parser,',
+            '                                            "_intern_table");',
+            '   if (!py_intern_table || py_intern_table == Py_None) {',
+            '       PyErr_Clear();',
+            '       Py_XDECREF(py_intern_table);',
+            '       py_intern_table = NULL;',
+            '   }',
+            '   else {',
+            '       PyObject *limit = PyObject_GetAttrString(py_parser,',
+            '                                                "intern_max_size");',
+            '       py_intern_limit = limit ? PyInt_AsLong(limit) : 0;',
+            '       Py_XDECREF(limit);',
+            '       PyErr_Clear();',
+            '   }',
+            '',
+            '   PyObject *track = PyObject_GetAttrString(py_parser,',
+            '                                            "track_locations");',
+            '   py_track_locations = track ? PyObject_IsTrue(track) == 1 : 0;',
+            '   Py_XDECREF(track);',
+            '   PyErr_Clear();',
+            '',
+            '   PyObject *tree = PyObject_GetAttrString(py_parser, "tree_mode");',
+            '   py_columnar = tree && PyString_Check(tree)',
+            '       && !strcmp(PyString_AS_STRING(tree), "columnar");',
+            '   Py_XDECREF(tree);',
+            '   PyErr_Clear();',
+            '',
+            '   PyObject *mode = PyObject_GetAttrString(py_parser, "error_mode");',
+            '   py_error_mode = PY_ERRORS_RAISE;',
+            '   if (mode && PyString_Check(mode)) {',
+            '       if (!strcmp(PyString_AS_STRING(mode), "collect"))',
+            '           py_error_mode = PY_ERRORS_COLLECT;',
+            '       else if (!strcmp(PyString_AS_STRING(mode), "failfast"))',
+            '           py_error_mode = PY_ERRORS_FAILFAST;',
+            '   }',
+            '   Py_XDECREF(mode);',
+            '   PyErr_Clear();',
+            '',
+            '   PyObject *trace = PyObject_GetAttrString(py_parser, "trace_size");',
+            '   py_trace_resize(trace && trace != Py_None ? PyInt_AsLong(trace) : 0);',
+            '   Py_XDECREF(trace);',
+            '   PyErr_Clear();',
+            '',
+            '   PyObject *limits = PyObject_GetAttrString(py_parser, "_limits");',
+            '   py_limits_active = 0;',
+            '   if (limits && PyTuple_Check(limits) && PyTuple_GET_SIZE(limits) == 4) {',
+            '       py_deadline = PyFloat_AsDouble(PyTuple_GET_ITEM(limits, 0));',
+            '       py_max_tokens = PyInt_AsLong(PyTuple_GET_ITEM(limits, 1));',
+            '       py_max_reductions = PyInt_AsLong(PyTuple_GET_ITEM(limits, 2));',
+            '       py_max_bytes = PyInt_AsLong(PyTuple_GET_ITEM(limits, 3));',
+            '       py_limits_active = !PyErr_Occurred();',
+            '   }',
+            '   Py_XDECREF(limits);',
+            '   PyErr_Clear();',
+            '   py_abort = 0;',
+            '   py_open_token_source();',
+            '',
             '   yyparse();',
+            '',
+            '   Py_XDECREF(py_intern_table);',
+            '   py_intern_table = NULL;',
             '}',
             '',
+            self.generate_tokenize_helper(),
+            self.generate_rule_names(rules),
+            '#undef yyerror',
+            '#define yyerror %serror' % prefix,
+            '',
             'int yyerror(char *msg)',
             '{',
+            '  /* errors caused by the end of input faked for an abort */',
+            '  if (py_abort)',
+            '      return 0;',
+            '',
+            '  if (py_error_mode != PY_ERRORS_RAISE) {',
+            '      py_record_error(msg);',
+            '      if (py_error_mode == PY_ERRORS_FAILFAST)',
+            '          py_abort = PY_LIMIT_ERROR;',
+            '      return 0;',
+            '  }',
+            '',
             '  PyObject *fn = PyObject_GetAttrString((PyObject *)py_parser,',
             '                                        "report_syntax_error");',
             '  if (!fn)',
@@ -447,27 +2403,13 @@ cdef class ParserEngine:
         # done with grammar file
         f.close()
 
-        # -----------------------------------------------
-        # now generate the lex script
-        if os.path.isfile(buildDirectory + parser.flexFile):
-            os.unlink(buildDirectory + parser.flexFile)
-
-        lexLines = gLex.split("\n")
-        tmp = []
-        for line in lexLines:
-            tmp.append(line.strip())
-        f = open(buildDirectory + parser.flexFile, 'w')
-        f.write('\n'.join(tmp) + '\n')
-        f.close()
-        
-        # create and set up a compiler object
-        env = distutils.ccompiler.new_compiler(verbose=parser.verbose)
-        env.set_include_dirs([distutils.sysconfig.get_python_inc()])
-
         # -----------------------------------------
         # Now run bison on the grammar file
         #os.system('bison -d tmp.y')
-        bisonCmd = parser.bisonCmd + [buildDirectory + parser.bisonFile]
+        bisonCmd = parser.bisonCmd
+        if parser.parse_trace:
+            bisonCmd = bisonCmd + ['-t']
+        bisonCmd = bisonCmd + [buildDirectory + parser.bisonFile]
 
         if parser.verbose:
             print 'bison cmd:', ' '.join(bisonCmd)
@@ -491,10 +2433,88 @@ cdef class ParserEngine:
 
         shutil.copy(parser.bisonHFile, buildDirectory + parser.bisonHFile1)
 
+        # let the engine report the size of the parser tables, and the
+        # states and conflicts listed in the bison report
+        f = open(parser.bisonCFile)
+        tableBytes = parserTableBytes(f.read())
+        f.close()
+
+        if os.path.isfile(parser.bisonOutputFile):
+            f = open(parser.bisonOutputFile)
+            states, srConflicts, rrConflicts = grammarStats(f.read())
+            f.close()
+        else:
+            states = srConflicts = rrConflicts = 0
+
+        if parser.verbose:
+            print 'parser: %d states, %d shift/reduce and %d reduce/reduce' \
+                  ' conflicts, %d bytes of tables' \
+                  % (states, srConflicts, rrConflicts, tableBytes)
+
+        f = open(buildDirectory + parser.bisonCFile1, 'a')
+        f.write('\n'.join([
+            '',
+            'PyObject *py_grammar_stats(void)',
+            '{',
+            '  return Py_BuildValue("{s:i,s:i,s:i,s:l,s:s,s:s,s:s,s:i}",',
+            '                       "states", %d,' % states,
+            '                       "shift_reduce", %d,' % srConflicts,
+            '                       "reduce_reduce", %d,' % rrConflicts,
+            '                       "table_bytes", %dL,' % tableBytes,
+            '                       "lr_type", "%s",'
+                % (parser.lr_type or 'default'),
+            '                       "lr_default_reduction", "%s",'
+                % (parser.lr_default_reduction or 'default'),
+            '                       "parse_lac", "%s",'
+                % (parser.parse_lac or 'default'),
+            '                       "parse_trace", %d);'
+                % (parser.parse_trace and 1 or 0),
+            '}',
+            '']))
+        f.close()
+
+        # with a Python tokenizer, there are no scanner tables to report
+        if usesTokenizer(parser):
+            writeScannerStats(buildDirectory + parser.bisonCFile1,
+                              'python', 0)
+
+        self.compileObject(env, buildDirectory + parser.bisonCFile1, objFile)
+        shutil.copy(buildDirectory + parser.bisonHFile1,
+                    headerFilename(objFile))
+
+    def buildScanner(self, env, objFile, headerFile):
+        """
+        Builds the scanner half of the parser engine into an object file:
+        creates the lex file from the parser's lex script, compiles it to C
+        with flex, and compiles the C file against the header of the grammar
+        half.
+        """
+        parser = self.parser
+        buildDirectory = parser.buildDirectory
+
+        # -----------------------------------------------
+        # now generate the lex script
+        if os.path.isfile(buildDirectory + parser.flexFile):
+            os.unlink(buildDirectory + parser.flexFile)
+
+        lexLines = parser.lexscript.split("\n")
+        tmp = []
+        for line in lexLines:
+            tmp.append(line.strip())
+        f = open(buildDirectory + parser.flexFile, 'w')
+        f.write('\n'.join(tmp) + '\n')
+        f.close()
+
+        # the lex script includes the token definitions of the grammar
+        shutil.copy(headerFile, buildDirectory + parser.bisonHFile1)
+
         # -----------------------------------------
         # Now run lex on the lex file
         #os.system('lex tmp.l')
-        flexCmd = parser.flexCmd + [buildDirectory + parser.flexFile]
+        # -P also changes the name of the output file, so give it explicitly
+        flexCmd = parser.flexCmd + scannerOptions(parser) \
+                  + ['-P' + symbolPrefix(parser), '-o' + parser.flexCFile] \
+                  + [buildDirectory + parser.flexFile]
 
         if parser.verbose:
             print 'flex cmd:', ' '.join(flexCmd)
@@ -510,88 +2530,187 @@ cdef class ParserEngine:
 
         shutil.copy(parser.flexCFile, buildDirectory + parser.flexCFile1)
 
-        # -----------------------------------------
-        # Now compile the files into a shared lib
+        # let the engine report the size of the scanner tables
+        f = open(parser.flexCFile)
+        tableBytes = scannerTableBytes(f.read())
+        f.close()
 
-        # compile bison and lex c sources
-        #bisonObj = env.compile([parser.bisonCFile1])
-        #lexObj = env.compile([parser.flexCFile1])
+        if parser.verbose:
+            print 'scanner tables: %d bytes' % tableBytes
 
-        #cl /DWIN32 /G4 /Gs /Oit /MT /nologo /W3 /WX bisondynlib-win32.c /Id:\python23\include
-        #cc.compile(['bisondynlib-win32.c'],
-        #           extra_preargs=['/DWIN32', '/G4', '/Gs', '/Oit', '/MT', '/nologo', '/W3', '/WX', '/Id:\python23\include'])
+        writeScannerStats(buildDirectory + parser.flexCFile1,
+                          parser.scanner_profile or 'default', tableBytes)
+        writeScannerReset(buildDirectory + parser.flexCFile1)
+
+        self.compileObject(env, buildDirectory + parser.flexCFile1, objFile)
+
+    def buildCallbacks(self, env, objFile):
+        """
+        Compiles the callback layer (bison_callback.c) into an object file,
+        to be linked into the parser engine lib.
+        """
+        parser = self.parser
+        source = parser.buildDirectory + parser.callbackCFile
+
+        if parser.verbose:
+            print '%s => %s' % (callbackSource(parser), source)
+
+        shutil.copy(callbackSource(parser), source)
+
+        self.compileObject(env, source, objFile,
+                           macros=[('PY_LINKED_CALLBACKS', None)])
+
+    def compileObject(self, env, source, objFile, macros=None):
+        """
+        Compiles a C file of the parser engine into the given object file,
+        and removes the object files of earlier builds of the same part of
+        the engine.
+        """
+        parser = self.parser
 
-        # link 'em into a shared lib
-        objs = env.compile([buildDirectory + parser.bisonCFile1,
-                            buildDirectory + parser.flexCFile1],
+        objs = env.compile([source],
+                           macros=macros,
                            extra_preargs=parser.cflags_pre,
-                           extra_postargs=parser.cflags_post,
+                           extra_postargs=self.compileFlags(),
                            debug=parser.debugSymbols)
 
-        libFileName = buildDirectory + parser.bisonEngineLibName \
-                      + imp.get_suffixes()[0][0]
+        dropObjects(objFile)
+        os.rename(objs[0], objFile)
 
-        if os.path.isfile(libFileName+".bak"):
-            os.unlink(libFileName+".bak")
+    def callEngine(self, name):
+        """
+        Calls the 'PyObject *name(void)' function exported by the parser lib,
+        and returns its result (None if the lib has no such function).
+        """
+        return bisondynlib_call(self.libHandle, name)
 
-        if os.path.isfile(libFileName):
-            os.rename(libFileName, libFileName+".bak")
+    def resetLocations(self):
+        """
+        Rewinds the engine's scanner position to the start of the input, and
+        drops any recorded locations.
+        """
+        self.callEngine('py_reset_locations')
 
-        if parser.verbose:
-            print 'linking: %s => %s' % (', '.join(objs), libFileName)
+    def locationData(self):
+        """
+        Returns the locations recorded since the last call, as a tuple of raw
+        int arrays: six fields per reduction, and the offsets of line starts.
+        """
+        data = self.callEngine('py_location_data')
+        if data is None:
+            return '', ''
+        return data
 
-        if sys.platform.startswith('darwin'):
-            # on OSX, ld throws undefined symbol for shared library references
-            # however, we would like to link against libpython dynamically, so that
-            # the built .so will not depend on which python interpreter it runs on 
-            env.linker_so += ['-undefined', 'dynamic_lookup']
+    def resetTree(self):
+        """
+        Drops the parse tree built in the columnar tree mode.
+        """
+        self.callEngine('py_reset_tree')
 
-        env.link_shared_object(objs, libFileName)
+    def treeData(self):
+        """
+        Returns the parse tree built in the columnar tree mode since the last
+        resetTree() call, as a tuple of six array('i') columns (symbols,
+        first children, next siblings, start and end offsets, value indices),
+        each copied once from the engine, and the list of token values.
+        """
+        data = self.callEngine('py_tree_data')
+        if data is None:
+            return tuple([array('i') for i in range(6)]) + (None,)
+        return data
 
-        #cdef char *incdir
-        #incdir = PyString_AsString(get_python_inc())
-        #bisondynlib_build(self.libFilename_py, incdir)
+    def resetLimits(self):
+        """
+        Resets the engine's token and reduction counts, and clears a pending
+        cancellation.
+        """
+        self.callEngine('py_reset_limits')
 
-        # --------------------------------------------
-        # clean up, if we succeeded
-        hitlist = objs[:]
-        hitlist.append("tmp.output")
+    def cancel(self):
+        """
+        Makes the running parse abort at the next token or reduction. Can be
+        called from another thread.
+        """
+        self.callEngine('py_cancel')
 
-        if os.path.isfile(libFileName):
-            for name in ['bisonFile', 'bisonCFile', 'bisonHFile',
-                         'bisonCFile1', 'bisonHFile1', 'flexFile',
-                         'flexCFile', 'flexCFile1',
-                         ] + objs:
-                if hasattr(parser, name):
-                    fname = buildDirectory + getattr(parser, name)
-                else:
-                    fname = None
-                #print "want to delete %s" % fname
-                if fname and os.path.isfile(fname):
-                    hitlist.append(fname)
+    def abortParse(self, reason):
+        """
+        Makes the running parse abort at the next token or reduction because
+        it exceeded its budget of nodes ('nodes') or memory ('memory').
+        """
+        self.callEngine('py_abort_' + reason)
 
-        if not parser.keepfiles:
-            for f in hitlist:
-                try:
-                    os.unlink(f)
-                except:
-                    print "Warning: failed to delete temporary file %s" % f
+    def stackStats(self):
+        """
+        Returns the peak parser stack depth of the last run, and the initial
+        and maximum stack depths of the engine, as a tuple.
+        """
+        return self.callEngine('py_stack_stats')
 
-        if parser.verbose:
-            print 'deleting temporary bison output files:'
+    def scannerStats(self):
+        """
+        Returns the scanner profile the engine was built with, and the
+        estimated size of its scanner tables in bytes, as a tuple.
+        """
+        return self.callEngine('py_scanner_stats')
 
-        for f in [parser.bisonCFile, parser.bisonHFile, parser.flexCFile]:
-            if parser.verbose:
-                print 'rm %s' % f
+    def grammarStats(self):
+        """
+        Returns a dict with the number of parser states, conflicts and the
+        size of the parser tables of the engine, and the table construction
+        options it was built with.
+        """
+        return self.callEngine('py_grammar_stats')
 
-            if os.path.isfile(f):
-                os.unlink(f)
+    def resetTrace(self):
+        """
+        Empties the engine's trace buffer.
+        """
+        self.callEngine('py_reset_trace')
+
+    def traceData(self):
+        """
+        Returns the events in the engine's trace buffer, oldest first, as a
+        string of raw ints (eight per event), and the number of events traced
+        since the buffer was emptied.
+        """
+        data = self.callEngine('py_trace_data')
+        if data is None:
+            return '', 0
+        return data
+
+    def ruleNames(self):
+        """
+        Returns the (target, option) of each grammar rule, by bison rule
+        number.
+        """
+        return self.callEngine('py_rule_names') or ()
+
+    def limitStatus(self):
+        """
+        Returns None, or a (reason, tokens, reductions) tuple if the last
+        parse was aborted because of a limit or a cancellation.
+        """
+        return self.callEngine('py_limit_status')
+
+    def errorData(self):
+        """
+        Returns the syntax errors collected since the last call, as a list
+        of (first_line, first_col, last_line, last_col, message, token text)
+        tuples.
+        """
+        data = self.callEngine('py_error_data')
+        if data is None:
+            return []
+        return data
 
     def closeLib(self):
         """
         Does the necessary cleanups and closes the parser library
         """
-        bisondynlib_close(self.libHandle)
+        if self.libHandle:
+            bisondynlib_close(self.libHandle)
+            self.libHandle = NULL
 
     def runEngine(self, debug=0):
         """
@@ -610,6 +2729,18 @@ cdef class ParserEngine:
 
         return bisondynlib_run(handle, parser, cbvoid, invoid, debug)
 
+    def runTokenizer(self):
+        """
+        Runs the scanner of the binary parser engine over the input, and
+        returns the token data as a tuple of raw int arrays: token ids, start
+        and end byte offsets, and first lines.
+        """
+        cdef void *invoid
+
+        invoid = <void *>py_input
+
+        return bisondynlib_tokenize(self.libHandle, self.parser, invoid)
+
     def __del__(self):
         """
         Clean up and bail
@@ -638,16 +2769,87 @@ def hashParserObject(parser):
     and grammar rules in a parser class instance.
 
     This is based on the raw text of the lex script attribute,
-    and the grammar rule docstrings within the handler methods.
+    and the grammar rule docstrings within the handler methods
+    (as well as the version of the generated engine code).
 
     Used to detect if someone has changed any grammar rules or
     lex script, and therefore, whether a shared parser lib rebuild
     is required.
+
+    The hash combines the hashes of the grammar and scanner halves of the
+    engine, which decide which of the halves need to be rebuilt.
+    """
+    hasher = sha.new()
+    hasher.update(grammarHash(parser))
+    hasher.update(scannerHash(parser))
+
+    # profile-guided optimised engines depend on their training inputs
+    if parser.pgo_training:
+        hasher.update(repr(list(parser.pgo_training)))
+
+    # and engines with the callback layer linked in on its source
+    if callbackLinkage(parser) != 'module':
+        hasher.update(callbackHash(parser))
+
+    return hasher.hexdigest()
+
+
+def scannerHash(parser):
+    """
+    Calculates an sha1 hex 'hash' of everything that goes into the scanner
+    half of the parser engine: the lex script, the flex options, and the
+    tokens it returns.
+    """
+    hasher = sha.new()
+
+    # add the version of the generated engine code
+    hasher.update(engineFormat)
+
+    # add the lex script, or mark the use of a Python tokenizer
+    if usesTokenizer(parser):
+        hasher.update('tokenizer')
+    else:
+        hasher.update(parser.lexscript)
+
+    hasher.update(repr((scannerOptions(parser), parser.scanner_profile)))
+    hasher.update(symbolPrefix(parser))
+    hasher.update(",".join(list(parser.tokens)))
+
+    return hasher.hexdigest()
+
+
+def callbackHash(parser):
+    """
+    Calculates an sha1 hex 'hash' of the callback layer which is compiled
+    into the parser engine: the source of bison_callback.c.
+    """
+    hasher = sha.new()
+    hasher.update(engineFormat)
+
+    f = open(callbackSource(parser))
+    hasher.update(f.read())
+    f.close()
+
+    return hasher.hexdigest()
+
+
+def grammarHash(parser):
+    """
+    Calculates an sha1 hex 'hash' of everything that goes into the grammar
+    half of the parser engine: the tokens, precedences, start target,
+    grammar rule docstrings, native actions and list rules, and the build
+    options of the parser.
     """
     hasher = sha.new()
 
-    # add the lex script
-    hasher.update(parser.lexscript)
+    # add the version of the generated engine code
+    hasher.update(engineFormat)
+
+    # add the build options which end up in the generated code
+    hasher.update(repr((usesTokenizer(parser), parser.start)))
+    hasher.update(repr((callbackLinkage(parser), symbolPrefix(parser))))
+    hasher.update(repr((parser.initial_stack_depth, parser.max_stack_depth)))
+    hasher.update(repr((bisonDefines(parser), bool(parser.parse_trace))))
 
     # add the tokens
 
@@ -685,5 +2887,14 @@ def hashParserObject(parser):
         docString = h.__doc__
         hasher.update(docString)
 
+        # and the options reduced in C
+        natives = nativeActions(h)
+        if natives:
+            hasher.update(repr(sorted(natives.items())))
+
+        elements = listRule(h)
+        if elements is not None:
+            hasher.update('list' + repr(sorted(elements.items())))
+
     # done
     return hasher.hexdigest()
@@ -17,12 +17,25 @@ depart from the GPL licensing requirements, please contact the author and apply
 for a commercial license.
 """
 
+import os
 import sys
+import threading
+import time
 import traceback
+from array import array
+from cStringIO import StringIO
 
-from bison_ import ParserEngine
+from bison_ import ParserEngine, hashParserObject
 from .node import BisonNode
+from .locations import LocationTable
+from .cache import ParseCache
+from .index import NodeIndex
+from .visitor import NodeVisitor
+from .tokenbuffer import TokenBuffer, token_batches, token_name
 from .convert import bisonToPython
+from .actions import native_actions, list_rule
+from .gcpause import GCPause
+from .columnar import ColumnarTree, NodeView
 
 class BisonSyntaxError(Exception):
     def __init__(self, msg, args=[]):
@@ -32,10 +45,39 @@ class BisonSyntaxError(Exception):
             self.first_line, self.first_col, self.last_line, self.last_col, \
                     self.message, self.token_value = args
 
-class TimeoutError(Exception):
+class ParseLimitExceeded(Exception):
+    """
+    Raised when a parse is aborted because it ran into one of its limits
+    (see BisonParser.run), or was cancelled.
+
+    Attributes:
+        - reason - 'deadline', 'tokens', 'reductions', 'bytes' or 'cancelled'
+        - tokens, reductions - the number of tokens read and reductions made
+          before the parse was aborted
+    """
+    def __init__(self, msg, reason=None, tokens=0, reductions=0):
+        super(ParseLimitExceeded, self).__init__(msg)
+
+        self.reason = reason
+        self.tokens = tokens
+        self.reductions = reductions
+
+class TimeoutError(ParseLimitExceeded):
     pass
 
 
+# Estimated sizes of an empty parse node (with its attribute dict and names
+# and values lists) and of an empty string, used for the memory budget.
+_NODE_SIZE = sys.getsizeof(BisonNode()) + sys.getsizeof({}) \
+        + 2 * sys.getsizeof([])
+_STR_SIZE = sys.getsizeof('')
+
+# Kinds of the events in the engine's trace buffer, by their number.
+_TRACE_KINDS = {1: 'shift', 2: 'reduce', 3: 'error'}
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
 class BisonParser(object):
     """
     Base parser class
@@ -48,7 +90,8 @@ class BisonParser(object):
     # override these if you need to
 
     # Command and options for running yacc/bison, except for filename arg
-    bisonCmd = ['bison', '-d', '-v', '-t']
+    # and the -t option (see parse_trace).
+    bisonCmd = ['bison', '-d', '-v']
 
     bisonFile = 'tmp.y'
     bisonCFile = 'tmp.tab.c'
@@ -56,6 +99,24 @@ class BisonParser(object):
     # Name of header file generated by bison cmd.
     bisonHFile = 'tmp.tab.h'
 
+    # Name of the report generated by bison -v.
+    bisonOutputFile = 'tmp.output'
+
+    # Parser table construction options, emitted as %define lines in the
+    # grammar; None leaves bison's default.
+    #  - lr_type - 'lalr' (default), 'ielr' or 'canonical-lr'
+    #  - lr_default_reduction - 'most' (default), 'consistent' or 'accepting'
+    #  - parse_lac - 'none' (default) or 'full'
+    # grammar_stats() reports the resulting number of states, conflicts and
+    # size of the parser tables.
+    lr_type = None
+    lr_default_reduction = None
+    parse_lac = None
+
+    # Compile in the tracing code of the parser, which the debug option of
+    # run() enables. Switch this off for smaller and faster engines.
+    parse_trace = 1
+
     # C output file from bison gets renamed to this.
     bisonCFile1 = 'tmp.bison.c'
 
@@ -64,18 +125,87 @@ class BisonParser(object):
 
     # command and options for running [f]lex, except for filename arg.
     flexCmd = ['flex', ]
+
+    # Scanner table compression profile, one of the keys of scanner_profiles,
+    # or None to use the flexCmd options only. The options of the profile are
+    # added to flexCmd. Smaller tables make a smaller engine lib, full tables
+    # a faster scanner; scanner_stats() reports the resulting table size.
+    scanner_profile = None
+
+    scanner_profiles = {
+        # compressed tables with (meta-)equivalence classes: flex's default
+        'small': ['-Cem'],
+        # full tables with equivalence classes
+        'balanced': ['-Cfe'],
+        # full tables without compression: fastest, largest
+        'fast': ['-Cf'],
+    }
     flexFile = 'tmp.l'
     flexCFile = 'lex.yy.c'
 
     # C output file from flex gets renamed to this.
     flexCFile1 = 'tmp.lex.c'
 
+    # C file holding the parser hash, which is compiled with each link.
+    hashCFile = 'tmp.hash.c'
+
+    # Keep the object files of the grammar and the scanner halves of the
+    # engine in the build directory, named by hashes of their inputs. When
+    # only the lex script (or only the grammar) changes, just that half is
+    # regenerated and recompiled before the engine is relinked.
+    cache_objects = 1
+
+    # Python tokenizer, used instead of a flex scanner built from the
+    # lexscript. Override this with a method which reads the input from
+    # self.file, and returns an iterable of token batches. A batch is a
+    # sequence of (token, value, location) tuples, where:
+    #  - token is a name from the tokens list, a single character, or a
+    #    bison token id
+    #  - value is the token value passed to the handlers
+    #  - location is None, or a (first_line, first_col, last_line, last_col)
+    #    tuple, optionally followed by the first and last byte offsets
+    # The engine calls into Python once per batch rather than once per
+    # token, so batches should hold hundreds of tokens or more;
+    # token_batches() groups the tokens of a plain generator.
+    tokenizer = None
+
+    # Iterator of the token batches of the running parse, as read by the
+    # engine, which sets it to None once the tokenizer is exhausted.
+    _token_source = None
+
     # CFLAGS added before all command line arguments.
     cflags_pre = ['-fPIC']
 
     # CFLAGS added after all command line arguments.
     cflags_post = ['-O3', '-g']
 
+    # Input files to train the engine on, for a profile-guided optimised
+    # build (which needs gcc). When set, an instrumented engine is built and
+    # run on the training inputs first, and the engine is then rebuilt with
+    # the collected profile. The profile is kept in the build directory, so
+    # the training is only repeated when the grammar, lex script or list of
+    # training inputs changes.
+    pgo_training = None
+
+    # Where the parser engine takes the callback layer (the C functions which
+    # call the handlers and read the input) from:
+    #  - 'module' - the bison_ module, which passes it to the engine at run
+    #    time, so that each reduction is an indirect call into the module
+    #  - 'linked' - a copy compiled into the engine lib, which the reductions
+    #    call directly
+    #  - 'lto' - as 'linked', with link-time optimisation of the whole engine
+    #    (gcc -flto), so that the callbacks can be inlined into the actions
+    # The module's callbacks remain the fallback when bison_callback.c isn't
+    # found in callbackSourcePath.
+    callback_linkage = 'module'
+
+    # Directories searched for bison_callback.c: this package (setup.py
+    # installs it there), and the src/c directory of the source tree.
+    callbackSourcePath = [_PACKAGE_DIR, os.path.join(_PACKAGE_DIR, '..', 'c')]
+
+    # Copy of bison_callback.c compiled into the engine lib.
+    callbackCFile = 'tmp.callback.c'
+
     # Directory used to store the generated / compiled files.
     buildDirectory = './'
 
@@ -85,9 +215,45 @@ class BisonParser(object):
     # Enable verbose debug message sent to stdout.
     verbose = 0
 
-    # Timeout in seconds after which the parser is terminated.
-    # TODO: this is currently not implemented.
-    timeout = 1
+    # Limits of each run: the time in seconds after which the parse is
+    # aborted, and the maximum number of tokens, reductions and input bytes.
+    # None means no limit. The byte count is that of the scanned input, as
+    # counted for the locations (which needs the default YY_USER_ACTION). A
+    # parse which runs into a limit raises ParseLimitExceeded (TimeoutError
+    # for the time limit). The limits can be overridden per run() call.
+    timeout = None
+    max_tokens = None
+    max_reductions = None
+    max_bytes = None
+
+    # Limits of the running parse, as read by the parser engine.
+    _limits = None
+
+    # Budgets of each run for the number of parse nodes created, and for the
+    # (roughly estimated) number of bytes they take. A parse which exceeds
+    # one raises ParseLimitExceeded, with the reason 'nodes' or 'memory'.
+    # The budgets can be overridden per run() call.
+    max_nodes = None
+    max_tree_bytes = None
+
+    # Numbers of nodes created and their estimated size in the last run;
+    # only counted when a node or memory budget is set.
+    node_count = 0
+    tree_bytes = 0
+
+    # Remaining node and memory budgets of the running parse.
+    _budget = None
+
+    # Initial and maximum depth of the parser stacks (YYINITDEPTH and
+    # YYMAXDEPTH), or None for the bison defaults of 200 and 10000. The
+    # stacks grow from the initial size to the maximum when needed, and a
+    # parse which needs more fails with a "memory exhausted" syntax error.
+    # The peak depth of the last run, as seen at its reductions, is in
+    # 'stack_depth'.
+    initial_stack_depth = None
+    max_stack_depth = None
+
+    stack_depth = 0
 
     # Default to sys.stdin.
     file = None
@@ -109,6 +275,112 @@ class BisonParser(object):
 
     error_threshold = 10
 
+    # How syntax errors are handled:
+    #  - 'raise' - each error is passed to report_syntax_error(), which raises
+    #    a BisonSyntaxError, and the parser engine is restarted after it
+    #  - 'collect' - the engine records the errors, and recovers from them
+    #    through the grammar's error rules. The errors are available as
+    #    BisonSyntaxError objects in the 'errors' attribute after the run.
+    #  - 'failfast' - the parse is aborted at the first error, which is
+    #    recorded as in the 'collect' mode. run() returns None in that case.
+    error_mode = 'raise'
+
+    # Syntax errors of the last run, in the 'collect' and 'failfast' modes.
+    errors = None
+
+    # Number of parser events kept in the engine's trace ring buffer, or 0
+    # to disable tracing. Unlike the debug option of run(), which makes
+    # bison print its full trace to stderr, tracing only records the last
+    # events of each run in a fixed-size native buffer, cheaply enough to
+    # leave it enabled; trace_events() and format_trace() return them.
+    trace_size = 0
+
+    # Share one string object between equal token values. Set to 'parse' to
+    # use a fresh intern table for each run() call, or to 'persistent' to keep
+    # the table across runs. Only token values created with py_token_value()
+    # in the lex script are interned, e.g.:
+    #
+    #   #define returntoken(tok) \
+    #           yylval = py_token_value(yytext, yyleng); return (tok);
+    intern_tokens = None
+
+    # Maximum number of distinct token values kept in the intern table. A
+    # persistent table that outgrew this size is cleared before the next run.
+    intern_max_size = 65536
+
+    # Intern table used by the parser engine, if interning is enabled.
+    _intern_table = None
+
+    # Record the location of every parse node. The locations are kept in a
+    # LocationTable (the 'locations' attribute after a run), and can be read
+    # through the location properties of the BisonNode objects.
+    track_locations = 0
+
+    # Location table of the last run, if track_locations is enabled.
+    locations = None
+
+    # Index the nodes of the parse tree by target, and link them to their
+    # parents. The index is built from the finished tree, so it holds no
+    # nodes which handlers or error recovery dropped. It is the 'index'
+    # attribute after a run, and is used by the find_all(), find_tokens()
+    # and ancestors() methods of the BisonNode objects.
+    build_index = 0
+
+    # Node index of the last run, if build_index is enabled.
+    index = None
+
+    # Directory of an on-disk cache of parse results. When set, run() looks
+    # up the result for the engine hash and the input in the cache, and skips
+    # parsing if it is found. Parse trees are stored in the tree file format,
+    # and loaded with the node classes found in the module of the parser
+    # class; trees which that would change (such as nodes with attributes
+    # set by handlers) are pickled. The cache is not used with a custom read
+    # method.
+    cache_directory = None
+
+    # Size in bytes and age in seconds above which cached results are evicted.
+    cache_max_bytes = 256 * 1024 * 1024
+    cache_max_age = 30 * 24 * 3600
+
+    # The cache key only covers the grammar and the input. Change this when
+    # the handlers change in a way that changes their results.
+    cache_version = None
+
+    # Result cache of the parser, if cache_directory is set.
+    cache = None
+
+    # How the parse tree is built: None calls the handlers, 'columnar' has
+    # the engine store the tree in native columns instead, without calling
+    # any handler. run() then returns a ColumnarTree, whose NodeView objects
+    # stand in for BisonNodes. In this mode, hook_run() gets None, and the
+    # result cache, locations, index and node budgets are not used.
+    tree_mode = None
+
+    # Keep the cyclic garbage collector from rescanning the growing parse
+    # tree: 'suspend' disables it during each run(), 'raise' multiplies its
+    # thresholds by gc_threshold_factor. Either way, the tree is moved to
+    # the oldest generation with one collection after the parse. None
+    # leaves the collector alone. Can be overridden per run() call.
+    gc_mode = None
+    gc_threshold_factor = 100
+
+    # Collections during and after the last run and the time spent in them,
+    # if a gc_mode was used (see GCPause.stats()).
+    gc_stats = None
+
+    # Error which made the last reload() fail, if any.
+    reload_error = None
+
+    # Engine built by reload() which waits to be swapped in, and the thread
+    # building it, both guarded by _reload_lock.
+    _next_engine = None
+    _reload_thread = None
+    _reload_lock = None
+
+    # Number of run() and tokenize() calls using the current engine, which
+    # keep it from being swapped out.
+    _engine_users = 0
+
     def __init__(self, **kw):
         """
         Abstract representation of parser
@@ -156,8 +428,15 @@ class BisonParser(object):
             self.bisonEngineLibName = self.__class__.__module__ + '-parser'
 
         # get an engine
+        self._reload_lock = threading.Lock()
         self.engine = ParserEngine(self)
 
+        if self.cache_directory:
+            self.cache = ParseCache(self.cache_directory,
+                                    self.cache_max_bytes, self.cache_max_age)
+        else:
+            self.cache = None
+
     def __getitem__(self, idx):
         return self.last[idx]
 
@@ -169,6 +448,10 @@ class BisonParser(object):
         Tries to dispatch to on_TargetName() methods if they exist,
         otherwise wraps the target in a BisonNode object
         """
+        if self.track_locations:
+            node_id = self._node_count
+            self._node_count += 1
+
         handler = getattr(self, 'on_' + targetname, None)
 
         if handler:
@@ -195,15 +478,230 @@ class BisonParser(object):
             self.last = cls(target=targetname, option=option, names=names,
                             values=values)
 
+        if self.track_locations and isinstance(self.last, BisonNode):
+            self.last._locations = self.locations
+            self.last._node_id = node_id
+
+        if self._budget is not None and isinstance(self.last, BisonNode):
+            self.charge_node(self.last)
+
         # assumedly the last thing parsed is at the top of the tree
         return self.last
 
-    def handle_timeout(self, signum, frame):
-        raise TimeoutError('Computation exceeded timeout limit.')
+    def charge_node(self, node):
+        """
+        Counts a newly created node against the node and memory budgets of
+        the running parse, and makes the engine abort the parse when one of
+        them is exhausted.
+
+        The size of a node is estimated from the size of an empty node, the
+        slots of its values list, and the sizes of its string values.
+        """
+        size = _NODE_SIZE + 8 * len(node.values)
+        for value in node.values:
+            if isinstance(value, str):
+                size += _STR_SIZE + len(value)
+
+        self.node_count += 1
+        self.tree_bytes += size
+
+        budget = self._budget
+        budget[0] -= 1
+        budget[1] -= size
+
+        if budget[0] < 0:
+            self.engine.abortParse('nodes')
+        elif budget[1] < 0:
+            self.engine.abortParse('memory')
+
+    def scanner_stats(self):
+        """
+        Returns a dict describing the scanner of the parser engine: the
+        scanner profile, the estimated size of the scanner tables, and the
+        size of the engine lib, in bytes.
+        """
+        profile, table_bytes = self.engine.scannerStats() or (None, 0)
+        libfile = self.engine.getLibFilename()
+
+        return {'profile': profile, 'table_bytes': table_bytes,
+                'lib_bytes': os.path.getsize(libfile)}
+
+    def grammar_stats(self):
+        """
+        Returns a dict describing the parser of the parser engine: the
+        number of 'states', of 'shift_reduce' and 'reduce_reduce' conflicts,
+        the estimated size of the parser tables ('table_bytes'), and the
+        table construction options it was built with.
+        """
+        return self.engine.grammarStats() or {}
+
+    def trace_events(self):
+        """
+        Returns the events in the engine's trace buffer, which holds the last
+        trace_size events of the last run, oldest first, as (kind, state,
+        token, rule, first_line, first_col, last_line, last_col) tuples:
+            - kind - 'shift' for a token read by the parser (in the state it
+              was read in), 'reduce' for a reduction, or 'error' for a
+              syntax error
+            - token - the name of the token read, or of the lookahead token
+              (None if the parser had none)
+            - rule - the (target, option) of the rule reduced, else None
+            - first_line ... last_col - the location of the token, of the
+              reduced target, or of the token the error was found at
+        """
+        fields = array('i')
+        fields.fromstring(self.engine.traceData()[0])
+
+        rules = self.engine.ruleNames()
+        events = []
+
+        for i in xrange(0, len(fields), 8):
+            kind, state, token, rule = fields[i:i + 4]
+            events.append((_TRACE_KINDS[kind], state,
+                           token_name(token, self.tokens),
+                           rule >= 0 and rules[rule] or None)
+                          + tuple(fields[i + 4:i + 8]))
+
+        return events
+
+    def format_trace(self):
+        """
+        Returns the events in the engine's trace buffer as text, one event per
+        line, e.g. for logging the context of a failed parse.
+        """
+        lines = []
+
+        for kind, state, token, rule, fl, fc, ll, lc in self.trace_events():
+            line = '%d.%d-%d.%d: %-6s state %d' % (fl, fc, ll, lc, kind, state)
+            if rule:
+                line += ', rule %s:%d' % rule
+            if token is not None:
+                line += ', token %s' % token
+            lines.append(line)
+
+        return '\n'.join(lines)
+
+    def cancel(self):
+        """
+        Aborts the running parse, which raises ParseLimitExceeded with the
+        reason 'cancelled'. Can be called from another thread.
+        """
+        self.engine.cancel()
 
     def reset(self):
         self.engine.reset()
 
+    def reload(self, wait=0):
+        """
+        Rebuilds the parser engine in a background thread, if the grammar or
+        the lex script of the parser changed since the engine was built.
+
+        Each version of the engine lib has a file of its own, so the new
+        engine is loaded next to the current one. It is swapped in at the
+        start of the first run() or tokenize() call after it is ready, and
+        the old engine is unloaded then; parses in progress finish with the
+        old engine. A failed build leaves the current engine in place, and
+        its error in reload_error.
+
+        The training parses of a profile-guided optimised build (see
+        pgo_training) run the parser's handlers, so they are not run in the
+        background: an engine without a profile yet is trained when it is
+        swapped in, before the run which swaps it in.
+
+        Returns True if the parser gets a new engine, False if its engine
+        is current. With wait set, waits for the build, raises its error if
+        it failed, and swaps in the new engine right away unless a parse is
+        running.
+        """
+        self._reload_lock.acquire()
+        try:
+            thread = self._reload_thread
+
+            if thread is None:
+                engine = self._next_engine
+                if engine is None:
+                    engine = self.engine
+
+                if engine.getParserHash() != hashParserObject(self):
+                    self.reload_error = None
+                    thread = threading.Thread(target=self._build_engine)
+                    thread.daemon = True
+                    self._reload_thread = thread
+                    thread.start()
+        finally:
+            self._reload_lock.release()
+
+        if wait:
+            if thread is not None:
+                thread.join()
+            if self.reload_error is not None:
+                raise self.reload_error
+            self._swap_engine()
+            if self.reload_error is not None:
+                raise self.reload_error
+
+        self._reload_lock.acquire()
+        try:
+            return self._next_engine is not None \
+                or self._reload_thread is not None
+        finally:
+            self._reload_lock.release()
+
+    def _build_engine(self):
+        """
+        Builds the engine lib for reload(), without loading it.
+        """
+        engine = None
+        try:
+            engine = ParserEngine(self, load=0, train=0)
+        except Exception as e:
+            if self.verbose:
+                traceback.print_exc()
+            self.reload_error = e
+
+        self._reload_lock.acquire()
+        try:
+            if engine is not None:
+                self._next_engine = engine
+            self._reload_thread = None
+        finally:
+            self._reload_lock.release()
+
+    def _swap_engine(self):
+        """
+        Loads the engine built by reload(), if any, and swaps it in for the
+        current engine, which is unloaded, unless a parse is using it. An
+        engine which waits for its training is trained first.
+        """
+        if self._engine_users:
+            return
+
+        self._reload_lock.acquire()
+        try:
+            engine = self._next_engine
+            self._next_engine = None
+        finally:
+            self._reload_lock.release()
+
+        if engine is None:
+            return
+
+        try:
+            engine.finishTraining()
+        except Exception as e:
+            if self.verbose:
+                traceback.print_exc()
+            self.reload_error = e
+            return
+
+        engine.openCurrentLib()
+
+        if self.verbose:
+            print 'Parser: swapping in engine', engine.getLibFilename()
+
+        old, self.engine = self.engine, engine
+        old.closeLib()
+
     def run(self, **kw):
         """
         Runs the parser, and returns the top-most parse target.
@@ -212,6 +710,41 @@ class BisonParser(object):
             - file - either a string, comprising a file to open and read input from, or
               a Python file object
             - debug - enables garrulous parser debugging output, default 0
+            - cache - set to 0 to bypass the result cache for this run
+            - timeout, max_tokens, max_reductions, max_bytes - limits of this
+              run, default to the attributes of the same name
+            - max_nodes, max_tree_bytes - node and memory budgets of this
+              run, default to the attributes of the same name
+            - gc_mode - garbage collector mode of this run, defaults to the
+              attribute of the same name
+        """
+        gc_mode = kw.get('gc_mode', self.gc_mode)
+        if gc_mode:
+            pause = GCPause(gc_mode, self.gc_threshold_factor)
+        else:
+            pause = None
+
+        self._swap_engine()
+        self._engine_users += 1
+
+        try:
+            if pause is not None:
+                pause.start()
+            return self._run(**kw)
+        finally:
+            self._engine_users -= 1
+
+            if pause is not None:
+                pause.finish()
+                self.gc_stats = pause.stats()
+                if self.verbose:
+                    print 'Parser.run: gc stats', self.gc_stats
+            else:
+                self.gc_stats = None
+
+    def _run(self, **kw):
+        """
+        Runs the parser, see run().
         """
         if self.verbose:
             print 'Parser.run: calling engine'
@@ -245,13 +778,91 @@ class BisonParser(object):
         if self.verbose and self.file.closed:
             print 'Parser.run(): self.file', self.file, 'is closed'
 
+        columnar = self.tree_mode == 'columnar'
+
+        if self.error_mode not in ('raise', 'collect', 'failfast'):
+            raise ValueError('Invalid error_mode value: %r' % self.error_mode)
+
+        # state of the last run, which a cached result doesn't bring along
+        self.errors = []
+        self.locations = None
+        self.node_count = self.tree_bytes = 0
+
+        namespace = sys.modules.get(self.__class__.__module__)
+
+        cachekey = None
+        if self.cache is not None and kw.get('cache', 1) and not columnar \
+                and getattr(self.read, 'im_func', None) \
+                    is BisonParser.read.im_func \
+                and not self.file.closed:
+            data = self.file.read()
+
+            # only close the file if run() opened it
+            if filename is not None:
+                self.file.close()
+
+            cachekey = self.cache.key(self.engine.getParserHash()
+                                      + repr(self.cache_version), data)
+            found, result = self.cache.get(cachekey, namespace)
+
+            if found:
+                if self.verbose:
+                    print 'Parser.run: using cached result'
+
+                if self.build_index:
+                    self.index = NodeIndex(self.tokens)
+                    if isinstance(result, (BisonNode, list, tuple)):
+                        self.index.addtree(result)
+
+                self.file = oldfile
+                self.read = oldread
+                self.last = result
+                return result
+
+            self.file = StringIO(data)
+
+        timeout = kw.get('timeout', self.timeout)
+        self._limits = (timeout and time.time() + timeout or 0.0,
+                        kw.get('max_tokens', self.max_tokens) or 0,
+                        kw.get('max_reductions', self.max_reductions) or 0,
+                        kw.get('max_bytes', self.max_bytes) or 0)
+        self.engine.resetLimits()
+        self.engine.resetTrace()
+        exceeded = None
+
+        max_nodes = kw.get('max_nodes', self.max_nodes)
+        max_tree_bytes = kw.get('max_tree_bytes', self.max_tree_bytes)
+        self.node_count = self.tree_bytes = 0
+        if max_nodes or max_tree_bytes:
+            self._budget = [max_nodes or sys.maxint,
+                            max_tree_bytes or sys.maxint]
+        else:
+            self._budget = None
+
+        self.prepare_intern_table()
+
+        self.engine.resetLocations()
+        self.engine.resetTree()
+
+        if self.track_locations:
+            self.locations = LocationTable()
+            self._node_count = 0
+
+        self.index = None
+
+        if self.tokenizer is not None:
+            self._token_source = iter(self.tokenizer())
+
         error_count = 0
 
-        # TODO: add option to fail on first error.
-        while not self.file.closed:
+        # drop what the scanner buffered of the input of an earlier run
+        # which stopped before the end; restarts after syntax errors go on
+        # with the buffered input
+        self.engine.reset()
+
+        while self._input_pending():
             # do the parsing job, spew if error
             self.last = None
-            self.engine.reset()
 
             try:
                 self.engine.runEngine(debug)
@@ -263,6 +874,23 @@ class BisonParser(object):
 
                 self.report_last_error(filename, e)
 
+            if self.track_locations:
+                self.locations.extend(*self.engine.locationData())
+
+            for record in self.engine.errorData():
+                self.errors.append(self.syntax_error(*record))
+
+            if self.error_mode == 'failfast' and self.errors:
+                self.last = None
+                self.engine.reset()
+                break
+
+            exceeded = self.engine.limitStatus()
+            if exceeded:
+                self.last = None
+                self.engine.reset()
+                break
+
             if self.verbose:
                 print 'Parser.run: back from engine'
 
@@ -272,13 +900,49 @@ class BisonParser(object):
             if self.verbose and not self.file.closed:
                 print 'last:', self.last
 
+        if columnar and not exceeded \
+                and not (self.error_mode == 'failfast' and self.errors):
+            self.last = ColumnarTree(self.engine.treeData(),
+                                     self.engine.ruleNames(), self.tokens)
+            self.engine.resetTree()
+
+        if self.build_index:
+            self.index = NodeIndex(self.tokens)
+            if isinstance(self.last, (BisonNode, list, tuple)):
+                self.index.addtree(self.last)
+
         if self.verbose:
             print 'last:', self.last
 
+        # aborted and failed parses are not cached
+        if cachekey is not None and not exceeded and not error_count \
+                and not self.errors:
+            self.cache.put(cachekey, self.last, namespace)
+
         # restore old values
         self.file = oldfile
         self.read = oldread
 
+        if self.intern_tokens != 'persistent':
+            self._intern_table = None
+
+        self._limits = None
+        self._budget = None
+        self._token_source = None
+
+        self.stack_depth = self.engine.stackStats()[0]
+
+        if exceeded:
+            reason, tokens, reductions = exceeded
+            if reason == 'cancelled':
+                msg = 'Parse cancelled'
+            else:
+                msg = 'Parse exceeded its %s limit' % reason
+            msg += ' after %d tokens and %d reductions' % (tokens, reductions)
+
+            cls = reason == 'deadline' and TimeoutError or ParseLimitExceeded
+            raise cls(msg, reason, tokens, reductions)
+
         if self.verbose:
             print '------------------ result=', self.last
 
@@ -286,6 +950,77 @@ class BisonParser(object):
         # return self.last[:-1]
         return self.last
 
+    def _input_pending(self):
+        """
+        Tells if the engine should be (re)started to parse more input: while
+        the input file is open, or the tokenizer is not exhausted.
+        """
+        if self.tokenizer is not None:
+            return self._token_source is not None
+
+        return not self.file.closed
+
+    def tokenize(self, source):
+        """
+        Runs only the scanner of the parser engine over a string (or the
+        contents of a file object), without parsing, and returns the tokens
+        as a TokenBuffer.
+
+        Unicode strings are tokenized in their utf-8 encoding. The token
+        values made by the lex script are discarded, so they must be new
+        references, as returned by py_token_value(). With a Python
+        tokenizer, the offsets are taken from the token locations.
+        """
+        if not isinstance(source, basestring):
+            source = source.read()
+        if isinstance(source, unicode):
+            source = source.encode('utf-8')
+
+        # the engine reads through self.read(), which is pointed at the
+        # source for the run, reading whole buffers instead of lines
+        oldfile = self.file
+        oldread = self.__dict__.get('read')
+        self.file = StringIO(source)
+        self.read = self.file.read
+
+        self._swap_engine()
+        self._engine_users += 1
+
+        try:
+            if self.tokenizer is not None:
+                self._token_source = iter(self.tokenizer())
+
+            self.engine.reset()
+            self.engine.resetLocations()
+            data = self.engine.runTokenizer()
+        finally:
+            self._engine_users -= 1
+            self._token_source = None
+            self.file = oldfile
+            if oldread is None:
+                del self.read
+            else:
+                self.read = oldread
+
+        return TokenBuffer(data, source, self.tokens)
+
+    def prepare_intern_table(self):
+        """
+        Sets up the token intern table for the next run, according to the
+        intern_tokens and intern_max_size attributes.
+        """
+        if self.intern_tokens == 'persistent':
+            if self._intern_table is None \
+                    or len(self._intern_table) >= self.intern_max_size:
+                self._intern_table = {}
+        elif self.intern_tokens == 'parse':
+            self._intern_table = {}
+        elif self.intern_tokens:
+            raise ValueError('Invalid intern_tokens value: %r'
+                             % self.intern_tokens)
+        else:
+            self._intern_table = None
+
     def read(self, nbytes):
         """
         Override this in your subclass, if you desire.
@@ -347,6 +1082,14 @@ class BisonParser(object):
 
     def report_syntax_error(self, msg, yytext, first_line, first_col,
             last_line, last_col):
+        raise self.syntax_error(first_line, first_col, last_line, last_col,
+                                msg, yytext)
+
+    def syntax_error(self, first_line, first_col, last_line, last_col, msg,
+            yytext):
+        """
+        Returns the BisonSyntaxError object for a syntax error.
+        """
         yytext = yytext.replace('\n', '\\n')
         args = (first_line, first_col, last_line, last_col, msg, yytext)
-        raise BisonSyntaxError('%d.%d-%d.%d: "%s" near "%s".' % args, args)
+        return BisonSyntaxError('%d.%d-%d.%d: "%s" near "%s".' % args, args)
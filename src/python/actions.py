@@ -0,0 +1,109 @@
+"""
+Declarations of rule actions which the parser engine performs in C.
+
+Released under the GNU General Public License, a copy of which should appear in
+this distribution in the file called 'COPYING'. If this file is missing, then
+you can obtain a copy of the GPL license document from the GNU website at
+http://www.gnu.org.
+
+This software is released with no warranty whatsoever. Use it at your own
+risk.
+
+If you wish to use this software in a commercial application, and wish to
+depart from the GPL licensing requirements, please contact the author and apply
+for a commercial license.
+"""
+
+
+def _check_terms(terms):
+    """
+    Returns a dict of the option numbers and term numbers (or None) given to
+    a decorator, after checking their values.
+    """
+    terms = dict(terms)
+
+    for option, term in terms.items():
+        if not isinstance(option, int) or option < 0:
+            raise ValueError('Invalid option number %r' % (option,))
+        if term is not None and (not isinstance(term, int) or term < 1):
+            raise ValueError('Invalid term number %r for option %d'
+                             % (term, option))
+
+    return terms
+
+
+def native_actions(actions):
+    """
+    Decorator for rule handlers, which makes the parser engine reduce some
+    options of the rule in C, without calling the handler.
+
+    'actions' maps option numbers to what the option returns: the number of
+    one of its terms, counting from 1 as $N does in bison, or None. The
+    engine then passes the value of that term (or None) on as the value of
+    the target, e.g.::
+
+        @native_actions({0: 1, 7: 2})
+        def on_exp(self, target, option, names, values):
+            '''
+            exp : NUMBER
+                | exp PLUS exp
+                ...
+                | LPAREN exp RPAREN
+            '''
+
+    The handler is still called for the other options. As no handler is
+    called for the native options, neither is hook_handler(), and they
+    create no parse nodes (nor locations or index entries for them).
+    """
+    actions = _check_terms(actions)
+
+    def decorate(handler):
+        handler.native_actions = actions
+        return handler
+
+    return decorate
+
+
+def list_rule(elements=None):
+    """
+    Decorator for the handler of a left-recursive sequence rule, which makes
+    the parser engine build the sequence as one flat Python list, without
+    calling the handler, e.g.::
+
+        @list_rule
+        def on_input(self, target, option, names, values):
+            '''
+            input :
+                  | input line
+            '''
+
+        @list_rule
+        def on_args(self, target, option, names, values):
+            '''
+            args : exp
+                 | args COMMA exp
+            '''
+
+    Options starting with the target append an element to its list; the
+    other options start a new list, holding one element, or none if the
+    option is empty. The element is the last term of the option, unless
+    'elements' maps the option number to another term (counting from 1, as
+    $N does in bison), or to None for an empty list.
+
+    As with native_actions, neither the handler nor hook_handler() is
+    called, and no parse nodes are created for the rule. The lists are
+    walked, written to xml and dumped along with the nodes holding them.
+    When the start target is a list rule, as 'input' above, run() returns
+    the list, and the node index and the result cache cover the nodes in
+    it.
+    """
+    if callable(elements):
+        return list_rule()(elements)
+
+    elements = _check_terms(elements or {})
+
+    def decorate(handler):
+        handler.list_rule = elements
+        return handler
+
+    return decorate
@@ -0,0 +1,238 @@
+"""
+On-disk cache of parse results.
+
+Released under the GNU General Public License, a copy of which should appear in
+this distribution in the file called 'COPYING'. If this file is missing, then
+you can obtain a copy of the GPL license document from the GNU website at
+http://www.gnu.org.
+
+This software is released with no warranty whatsoever. Use it at your own
+risk.
+
+If you wish to use this software in a commercial application, and wish to
+depart from the GPL licensing requirements, please contact the author and apply
+for a commercial license.
+"""
+import cPickle
+import errno
+import hashlib
+import os
+import tempfile
+import time
+
+from .node import BisonNode
+from . import treefile
+
+# Suffix of cache entry files, and prefix of files being written.
+ENTRY_SUFFIX = '.result'
+TEMP_PREFIX = 'tmp-'
+
+
+class ParseCache(object):
+    """
+    Stores parse results in a directory, keyed by the hash of the parser
+    engine and the hash of the parsed input.
+
+    Parse trees made of BisonNode objects are stored in the binary tree
+    format of the treefile module, other results (such as the values
+    returned by handlers) are pickled.
+
+    Several processes can share one cache directory: entries are written to
+    a temporary file first, and renamed into place once complete, and
+    entries which disappear while being read count as misses.
+
+    Attributes:
+        - hits, misses - number of cache lookups which found and did not find
+          a result
+        - evict_interval - number of stored results after which the cache is
+          checked for entries to evict
+    """
+    evict_interval = 100
+
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        """
+        Arguments:
+            - directory - the cache directory, created if it doesn't exist
+            - max_bytes - if set, the least recently used entries are evicted
+              when the cache grows beyond this size
+            - max_age - if set, entries not used for this many seconds are
+              evicted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def key(self, parserhash, data):
+        """
+        Returns the cache key of the result of parsing 'data' with the
+        parser engine identified by 'parserhash'.
+        """
+        hasher = hashlib.sha1(parserhash)
+        hasher.update(hashlib.sha1(data).digest())
+        return hasher.hexdigest()
+
+    def get(self, key, namespace=None):
+        """
+        Looks up a cached result. Returns a (found, result) tuple.
+
+        The namespace is used to find the node classes of stored parse
+        trees, as in treefile.load().
+        """
+        path = self._path(key)
+
+        try:
+            f = open(path, 'rb')
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.misses += 1
+            return False, None
+
+        try:
+            data = f.read()
+        finally:
+            f.close()
+
+        try:
+            if data[:1] == 'T':
+                result = treefile.loads(data[1:], namespace)
+            else:
+                result = cPickle.loads(data[1:])
+        except Exception:
+            # a damaged entry is treated as missing
+            self._unlink(path)
+            self.misses += 1
+            return False, None
+
+        # mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        self.hits += 1
+        return True, result
+
+    def put(self, key, result, namespace=None):
+        """
+        Stores a result in the cache. Results which can't be stored, because
+        they can't be serialised or the cache can't be written, are silently
+        not cached. None, the result of aborted parses, is never cached.
+
+        Parse trees, and lists of them (the results of list rules), are
+        stored in the tree file format if they come back the same from it,
+        with their node classes looked up in the namespace as in
+        treefile.load(). Other results are pickled.
+        """
+        if result is None:
+            return
+
+        try:
+            if isinstance(result, (BisonNode, list)) \
+                    and treefile.roundtrips(result, namespace):
+                data = 'T' + treefile.dumps(result)
+            else:
+                data = 'P' + cPickle.dumps(result, 2)
+        except Exception:
+            return
+
+        tmppath = None
+        try:
+            fd, tmppath = tempfile.mkstemp(prefix=TEMP_PREFIX,
+                                           dir=self.directory)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+            os.rename(tmppath, self._path(key))
+        except EnvironmentError:
+            if tmppath is not None:
+                self._unlink(tmppath)
+            return
+
+        self.stored += 1
+        if self.stored % self.evict_interval == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the entries which are too old, and then the least recently
+        used entries while the cache is larger than max_bytes.
+        """
+        if self.max_bytes is None and self.max_age is None:
+            return
+
+        now = time.time()
+        entries = []
+        total = 0
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            # remove temporary files left behind by crashed writers
+            if name.startswith(TEMP_PREFIX):
+                if now - st.st_mtime > 3600:
+                    self._unlink(path)
+                continue
+
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+
+            if self.max_age is not None \
+                    and now - st.st_mtime > self.max_age:
+                self._unlink(path)
+                continue
+
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        if self.max_bytes is None or total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._unlink(path)
+            total -= size
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        for name in os.listdir(self.directory):
+            if name.endswith(ENTRY_SUFFIX):
+                self._unlink(os.path.join(self.directory, name))
+
+    def stats(self):
+        """
+        Returns a dict with the hit and miss counts of this cache object.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'stored': self.stored}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def _unlink(self, path):
+        # other processes may have removed the file already
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
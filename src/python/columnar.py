@@ -0,0 +1,203 @@
+"""
+Parse trees stored in native columns, with node objects made on demand.
+
+Released under the GNU General Public License, a copy of which should appear in
+this distribution in the file called 'COPYING'. If this file is missing, then
+you can obtain a copy of the GPL license document from the GNU website at
+http://www.gnu.org.
+
+This software is released with no warranty whatsoever. Use it at your own
+risk.
+
+If you wish to use this software in a commercial application, and wish to
+depart from the GPL licensing requirements, please contact the author and apply
+for a commercial license.
+"""
+from .node import BisonNode
+from .tokenbuffer import token_name
+
+
+class ColumnarTree(object):
+    """
+    Parse tree built by the parser engine in the columnar tree mode (see
+    BisonParser.tree_mode), without calling the handlers.
+
+    Every node and every token of the tree is an entry, numbered in the
+    order the parser made them: the tokens of a node come before the node,
+    and the children of a node before the node itself. The root is the last
+    entry. The entries are stored column by column:
+
+        - symbols - the bison rule number of nodes, or the negated token id
+          of tokens
+        - first_child, next_sibling - the entries of the first child and of
+          the next sibling, or -1
+        - starts, ends - the byte offsets of the start and end of each entry
+          in the input
+        - value_ids - the index of the value of a token in 'values', or -1
+
+    The columns are array('i') objects, copied once from the engine. On
+    Python 2, arrays only have the old buffer interface: buffer(tree.symbols)
+    and numpy.frombuffer(tree.symbols, dtype=numpy.intc) read them without
+    a copy, memoryview() does not accept them. The offsets need the default
+    YY_USER_ACTION of the lex script.
+
+    node(i) returns a NodeView, which behaves like a BisonNode whose values
+    are made on access. The views are kept, so each entry has one view.
+    """
+
+    def __init__(self, data, rules, tokens):
+        self.symbols, self.first_child, self.next_sibling, self.starts, \
+            self.ends, self.value_ids = data[:6]
+
+        self.values = data[6] or []
+        self.rules = rules
+        self.tokens = list(tokens)
+        self._views = {}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    @property
+    def root(self):
+        """
+        The view of the root node, or None for an empty tree.
+        """
+        if not self.symbols:
+            return None
+        return self.node(len(self.symbols) - 1)
+
+    def is_node(self, i):
+        """
+        Tells if an entry is a node, rather than a token.
+        """
+        return self.symbols[i] > 0
+
+    def target(self, i):
+        """
+        Returns the target of a node entry.
+        """
+        return self.rules[self.symbols[i]][0]
+
+    def option(self, i):
+        """
+        Returns the option of a node entry.
+        """
+        return self.rules[self.symbols[i]][1]
+
+    def name(self, i):
+        """
+        Returns the name of an entry: the target of a node, or the token
+        name of a token.
+        """
+        symbol = self.symbols[i]
+        if symbol > 0:
+            return self.rules[symbol][0]
+        return token_name(-symbol, self.tokens)
+
+    def value(self, i):
+        """
+        Returns the value of an entry: the view of a node, or the value of
+        a token.
+        """
+        if self.symbols[i] > 0:
+            return self.node(i)
+
+        index = self.value_ids[i]
+        if index < 0:
+            return None
+        return self.values[index]
+
+    def children(self, i):
+        """
+        Generates the entries of the children of an entry.
+        """
+        child = self.first_child[i]
+        next_sibling = self.next_sibling
+
+        while child >= 0:
+            yield child
+            child = next_sibling[child]
+
+    def node(self, i):
+        """
+        Returns the NodeView of a node entry.
+        """
+        view = self._views.get(i)
+        if view is None:
+            if self.symbols[i] <= 0:
+                raise ValueError('Entry %d is a token' % i)
+            view = self._views[i] = NodeView(self, i)
+        return view
+
+    def find_all(self, target):
+        """
+        Returns the entries of the nodes of a target, scanning the symbols
+        column without making any views.
+        """
+        rules = self.rules
+        wanted = set()
+        for symbol in xrange(len(rules)):
+            if rules[symbol][0] == target:
+                wanted.add(symbol)
+
+        result = []
+        i = 0
+        for symbol in self.symbols:
+            if symbol in wanted:
+                result.append(i)
+            i += 1
+        return result
+
+    def text(self, i, source):
+        """
+        Returns the text of an entry, sliced from the parsed source.
+        """
+        return source[self.starts[i]:self.ends[i]]
+
+
+class NodeView(BisonNode):
+    """
+    Node of a ColumnarTree, which can be used where a BisonNode is
+    expected. The names and values of the node are made when they are read;
+    child nodes are NodeViews themselves.
+
+    Only the byte offsets of the node are known, the other location fields
+    are None.
+    """
+
+    def __init__(self, tree, entry):
+        self._tree = tree
+        self._entry = entry
+
+    def __str__(self):
+        return '<NodeView:%s>' % self.target
+
+    @property
+    def target(self):
+        return self._tree.target(self._entry)
+
+    @property
+    def option(self):
+        return self._tree.option(self._entry)
+
+    @property
+    def names(self):
+        tree = self._tree
+        return [tree.name(i) for i in tree.children(self._entry)]
+
+    @property
+    def values(self):
+        tree = self._tree
+        return [tree.value(i) for i in tree.children(self._entry)]
+
+    @property
+    def kw(self):
+        return {'target': self.target, 'option': self.option}
+
+    @property
+    def first_byte(self):
+        return self._tree.starts[self._entry]
+
+    @property
+    def last_byte(self):
+        return self._tree.ends[self._entry]
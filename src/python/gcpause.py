@@ -0,0 +1,136 @@
+"""
+Control of the cyclic garbage collector during parses.
+
+Released under the GNU General Public License, a copy of which should appear in
+this distribution in the file called 'COPYING'. If this file is missing, then
+you can obtain a copy of the GPL license document from the GNU website at
+http://www.gnu.org.
+
+This software is released with no warranty whatsoever. Use it at your own
+risk.
+
+If you wish to use this software in a commercial application, and wish to
+depart from the GPL licensing requirements, please contact the author and apply
+for a commercial license.
+"""
+import gc
+import threading
+import time
+
+# Modes of GCPause.
+MODES = ('suspend', 'raise')
+
+# The collector settings are process-wide: the first pause saves them, and
+# the last one to finish restores them.
+_lock = threading.Lock()
+_pauses = []
+_saved = None
+
+
+class GCPause(object):
+    """
+    Keeps the cyclic garbage collector from repeatedly scanning a parse tree
+    while it is being built, which makes large parses superlinear.
+
+    In the 'suspend' mode, the collector is disabled during the parse; in
+    the 'raise' mode, its thresholds are multiplied by a factor. Afterwards,
+    one collection of the younger generations moves the objects created by
+    the parse into the oldest generation, so that the collections which
+    follow don't rescan the finished tree.
+
+    The 'collections' and 'gc_time' attributes count the collections which
+    the interpreter ran during the pause, and the seconds spent in them.
+    These can only be measured where gc.callbacks exists; elsewhere they are
+    None, except in the 'suspend' mode, which lets no collection run. The
+    collection run by finish() is counted apart, in 'settle_collections'
+    and 'settle_time'.
+    """
+    def __init__(self, mode, factor=100):
+        if mode not in MODES:
+            raise ValueError('Invalid gc_mode value: %r' % (mode,))
+
+        self.mode = mode
+        self.factor = factor
+        self.settle_collections = 0
+        self.settle_time = 0.0
+        self._started = None
+
+        if hasattr(gc, 'callbacks') or mode == 'suspend':
+            self.collections = 0
+            self.gc_time = 0.0
+        else:
+            self.collections = None
+            self.gc_time = None
+
+    def start(self):
+        """
+        Suspends the collector, or raises its thresholds.
+        """
+        global _saved
+
+        callbacks = getattr(gc, 'callbacks', None)
+        if callbacks is not None:
+            callbacks.append(self._callback)
+
+        _lock.acquire()
+        try:
+            if not _pauses:
+                _saved = (gc.isenabled(), gc.get_threshold())
+            _pauses.append(self)
+
+            if self.mode == 'suspend':
+                gc.disable()
+            elif _saved[0]:
+                gc.set_threshold(*[n * self.factor for n in _saved[1]])
+        finally:
+            _lock.release()
+
+    def finish(self):
+        """
+        Restores the collector settings, unless other pauses are active,
+        and moves the objects created by the parse to the oldest generation.
+        """
+        callbacks = getattr(gc, 'callbacks', None)
+        if callbacks is not None and self._callback in callbacks:
+            callbacks.remove(self._callback)
+
+        _lock.acquire()
+        try:
+            _pauses.remove(self)
+            if not _pauses:
+                enabled, thresholds = _saved
+                gc.set_threshold(*thresholds)
+                if enabled:
+                    gc.enable()
+                settle = enabled
+            else:
+                settle = False
+        finally:
+            _lock.release()
+
+        if settle:
+            began = time.time()
+            gc.collect(1)
+            self.settle_time += time.time() - began
+            self.settle_collections += 1
+
+    def stats(self):
+        """
+        Returns the numbers of collections during the pause and after it,
+        and the time spent in them, as a dict.
+        """
+        return {'mode': self.mode, 'collections': self.collections,
+                'gc_time': self.gc_time,
+                'settle_collections': self.settle_collections,
+                'settle_time': self.settle_time}
+
+    def _callback(self, phase, info):
+        """
+        Counts a collection run by the interpreter, and times it.
+        """
+        if phase == 'start':
+            self._started = time.time()
+        elif self._started is not None:
+            self.gc_time += time.time() - self._started
+            self.collections += 1
+            self._started = None
@@ -0,0 +1,181 @@
+"""
+Per-target index of the nodes of a parse tree.
+
+Released under the GNU General Public License, a copy of which should appear in
+this distribution in the file called 'COPYING'. If this file is missing, then
+you can obtain a copy of the GPL license document from the GNU website at
+http://www.gnu.org.
+
+This software is released with no warranty whatsoever. Use it at your own
+risk.
+
+If you wish to use this software in a commercial application, and wish to
+depart from the GPL licensing requirements, please contact the author and apply
+for a commercial license.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+from .node import BisonNode, _children, _listchildren
+
+
+def _nodekey(node):
+    return node._lo, -node._seq
+
+
+class NodeIndex(object):
+    """
+    Maps parse targets and token names to the nodes and tokens of a parse
+    tree, in document order.
+
+    Nodes are added children before their parents, as by addtree(). Each
+    added node gets a sequence number, and remembers the lowest sequence
+    number found in its subtree; as the nodes of a subtree are added one
+    after the other, the nodes of a subtree are exactly those numbered from
+    that lowest number up to the number of its root. Queries
+    for the nodes below a node are answered by bisecting the per-target
+    lists of sequence numbers, in time proportional to the size of the
+    result.
+
+    Tokens are recorded as (node, index) pairs, where node.values[index] is
+    the token value, for the values of added nodes whose names are in the
+    set of token names given to the index.
+    """
+
+    def __init__(self, tokens=()):
+        self.tokennames = set(tokens)
+        self.count = 0
+
+        # target -> (array of sequence numbers, list of nodes)
+        self.targets = {}
+
+        # token name -> (array of the sequence numbers of the parent nodes,
+        # list of (document order key, node, index) tuples)
+        self.tokens = {}
+
+    def __len__(self):
+        return self.count
+
+    def add(self, node):
+        """
+        Adds a node, which must have been created after its child nodes
+        were added. Nodes which are in the index already are ignored.
+        """
+        if node._index is self:
+            return
+
+        self.count += 1
+        seq = self.count
+
+        node._index = self
+        node._seq = seq
+        node._lo = seq
+
+        # the subtree of a node starts with the subtree of its first child
+        children = _children(node)
+        if children:
+            children.reverse()
+            for child in children:
+                child._parent = node
+                if child._index is self and node._lo == seq:
+                    node._lo = child._lo
+
+        try:
+            seqs, nodes = self.targets[node.target]
+        except KeyError:
+            seqs, nodes = self.targets[node.target] = array('i'), []
+        seqs.append(seq)
+        nodes.append(node)
+
+        if not self.tokennames:
+            return
+
+        # tokens before the first child node sort between the node and its
+        # children, later ones just after the subtree of the child node
+        # before them
+        prefix = (node._lo, -seq)
+        tokennames = self.tokennames
+
+        for i, name in enumerate(node.names):
+            val = node.values[i]
+
+            if isinstance(val, BisonNode):
+                if val._index is self:
+                    prefix = (val._seq, 0)
+                continue
+
+            if isinstance(val, (list, tuple)):
+                items = _listchildren(val)
+                if items and items[0]._index is self:
+                    prefix = (items[0]._seq, 0)
+                continue
+
+            if name not in tokennames:
+                continue
+
+            try:
+                seqs, entries = self.tokens[name]
+            except KeyError:
+                seqs, entries = self.tokens[name] = array('i'), []
+            seqs.append(seq)
+            entries.append((prefix + (i,), node, i))
+
+    def addtree(self, tree):
+        """
+        Adds all nodes of a tree, in post-order. The tree can also be a
+        (possibly nested) list of trees, as returned by a parser whose start
+        target is a list rule; these are added one after the other.
+        """
+        if isinstance(tree, BisonNode):
+            roots = [tree]
+        else:
+            roots = _listchildren(tree)
+            roots.reverse()
+
+        for root in roots:
+            for node in root.iter_postorder():
+                self.add(node)
+
+    def find_all(self, target, within=None):
+        """
+        Returns the nodes of a target in document order.
+
+        If 'within' is given, only the nodes in the subtree of that node
+        (including the node itself) are returned.
+        """
+        try:
+            seqs, nodes = self.targets[target]
+        except KeyError:
+            return []
+
+        if within is None:
+            result = list(nodes)
+        else:
+            result = nodes[bisect_left(seqs, within._lo):
+                           bisect_right(seqs, within._seq)]
+
+        result.sort(key=_nodekey)
+        return result
+
+    def find_tokens(self, name, within=None):
+        """
+        Returns the tokens of a token name in document order, as a list of
+        (node, index) pairs.
+
+        If 'within' is given, only the tokens in the subtree of that node
+        are returned.
+        """
+        try:
+            seqs, entries = self.tokens[name]
+        except KeyError:
+            return []
+
+        if within is None:
+            result = list(entries)
+        else:
+            result = entries[bisect_left(seqs, within._lo):
+                             bisect_right(seqs, within._seq)]
+
+        result.sort(key=itemgetter(0))
+        return [(node, i) for key, node, i in result]
@@ -0,0 +1,88 @@
+"""
+Compact storage of the source locations of parse nodes.
+
+Released under the GNU General Public License, a copy of which should appear in
+this distribution in the file called 'COPYING'. If this file is missing, then
+you can obtain a copy of the GPL license document from the GNU website at
+http://www.gnu.org.
+
+This software is released with no warranty whatsoever. Use it at your own
+risk.
+
+If you wish to use this software in a commercial application, and wish to
+depart from the GPL licensing requirements, please contact the author and apply
+for a commercial license.
+"""
+from array import array
+from bisect import bisect_right
+
+
+class LocationTable(object):
+    """
+    Side-table holding the location of every reduction of a parse.
+
+    The locations are kept in a flat int array, with one record per node id
+    (the index of the reduction within the run). Each record consists of the
+    fields listed in LocationTable.fields. Lines and columns start at 1; the
+    last_column and last_byte fields point just past the end of the node.
+
+    The table also keeps the byte offsets at which each line of the input
+    starts, which is used to map offsets to line/column positions and back.
+    """
+    fields = ('first_line', 'first_column', 'last_line', 'last_column',
+              'first_byte', 'last_byte')
+
+    def __init__(self):
+        self.nodes = array('i')
+        self.lines = array('i', [0])
+
+    def __len__(self):
+        return len(self.nodes) // len(self.fields)
+
+    def extend(self, nodes, lines):
+        """
+        Appends raw location records and line offsets, as returned by
+        ParserEngine.locationData().
+        """
+        self.nodes.fromstring(nodes)
+        self.lines.fromstring(lines)
+
+    def location(self, node_id):
+        """
+        Returns the location record of a node as a tuple, or None if the
+        node id is unknown.
+        """
+        nfields = len(self.fields)
+        start = node_id * nfields
+
+        if node_id < 0 or start >= len(self.nodes):
+            return None
+
+        return tuple(self.nodes[start:start + nfields])
+
+    def field(self, node_id, index):
+        """
+        Returns a single field of the location record of a node.
+        """
+        start = node_id * len(self.fields)
+
+        if node_id < 0 or start >= len(self.nodes):
+            return None
+
+        return self.nodes[start + index]
+
+    def position(self, offset):
+        """
+        Maps a byte offset in the input to a (line, column) tuple.
+        """
+        line = bisect_right(self.lines, offset)
+        return line, offset - self.lines[line - 1] + 1
+
+    def offset(self, line, column):
+        """
+        Maps a (line, column) position in the input to a byte offset.
+        """
+        if line < 1 or line > len(self.lines):
+            raise IndexError('Line %d is out of range' % line)
+
+        return self.lines[line - 1] + column - 1
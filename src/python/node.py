@@ -16,7 +16,142 @@ If you wish to use this software in a commercial application, and wish to
 depart from the GPL licensing requirements, please contact the author and apply
 for a commercial license.
 """
-import xml
+import codecs
+import xml.dom.minidom
+from StringIO import StringIO
+
+
+def _escape(data):
+    """
+    Escapes text for use in xml character data and attribute values, the
+    same way xml.dom.minidom does.
+    """
+    return data.replace('&', '&amp;').replace('<', '&lt;') \
+               .replace('"', '&quot;').replace('>', '&gt;')
+
+
+def _children(node):
+    """
+    Returns the child nodes of a node in reverse order, ready to be pushed
+    onto a stack. Nodes held in (possibly nested) lists of values are
+    included.
+    """
+    values = node.values
+    result = []
+
+    for i in xrange(len(values) - 1, -1, -1):
+        val = values[i]
+        if isinstance(val, BisonNode):
+            result.append(val)
+        elif isinstance(val, (list, tuple)):
+            result.extend(_listchildren(val))
+
+    return result
+
+
+def _listchildren(items):
+    """
+    Returns the nodes in a (possibly nested) list in reverse order.
+    """
+    result = []
+    stack = [reversed(items)]
+
+    while stack:
+        for val in stack[-1]:
+            if isinstance(val, BisonNode):
+                result.append(val)
+            elif isinstance(val, (list, tuple)):
+                stack.append(reversed(val))
+                break
+        else:
+            stack.pop()
+
+    return result
+
+
+def _dumplist(items, indent):
+    """
+    Returns the dump() stack entries of the values in a list, in order:
+    nodes one level deeper than the list, and a line for each other value.
+    """
+    indents = ' ' * indent * 2
+    result = []
+
+    for val in items:
+        if isinstance(val, BisonNode):
+            result.append((val, indent + 1))
+        elif isinstance(val, (list, tuple)):
+            result.append((indents + '  -', None))
+            result.extend(_dumplist(val, indent + 1))
+        else:
+            result.append((indents + '  - %s' % (val,), None))
+
+    return result
+
+
+def _xmlwriter(rawwrite, encoding):
+    """
+    Returns a function which writes text to 'rawwrite' in an encoding (utf-8
+    if None), for writexml(). Byte strings are taken to be utf-8 encoded,
+    so in utf-8 they are written as they are.
+    """
+    codec = codecs.lookup(encoding or 'utf-8')
+
+    if codec.name == 'utf-8':
+        def write(text):
+            if isinstance(text, unicode):
+                text = text.encode('utf-8')
+            rawwrite(text)
+    else:
+        # one encoder for the whole document, which writes a byte order
+        # mark only once
+        encode = codec.incrementalencoder('xmlcharrefreplace').encode
+
+        def write(text):
+            if isinstance(text, str):
+                text = text.decode('utf-8')
+            rawwrite(encode(text))
+
+    return write
+
+
+def _xmllist(stack, name, items, ind, addindent, newl):
+    """
+    Pushes the xml of a list of values onto the writexml() stack: an
+    element with a '_list' attribute, holding the elements of the nodes in
+    the list and 'item' elements for its other values. Nested lists are
+    pushed the same way.
+    """
+    if not items:
+        stack.append(('%s<%s _list="1" target="%s"/>%s'
+                      % (ind, name, _escape(name), newl), None))
+        return
+
+    stack.append(('%s</%s>%s' % (ind, name, newl), None))
+
+    itemind = ind + addindent
+    for val in reversed(items):
+        if isinstance(val, BisonNode):
+            stack.append((val, itemind))
+        elif isinstance(val, (list, tuple)):
+            _xmllist(stack, 'item', val, itemind, addindent, newl)
+        else:
+            stack.append((_xmltoken('item', val, itemind, newl), None))
+
+    stack.append(('%s<%s _list="1" target="%s">%s'
+                  % (ind, name, _escape(name), newl), None))
+
+
+def _xmltoken(name, val, ind, newl):
+    """
+    Returns the xml of a token value, as written by writexml().
+    """
+    if not isinstance(val, basestring):
+        val = str(val)
+
+    return '%s<%s target="%s">%s</%s>%s' % (ind, name, _escape(name),
+                                            _escape(val), name, newl)
+
 
 class BisonNode:
     """
@@ -33,6 +168,18 @@ class BisonNode:
           keywords will be stored as attributes in the constructed object.
     """
 
+    # Location side-table and node id, set by the parser when locations are
+    # being tracked (see BisonParser.track_locations).
+    _locations = None
+    _node_id = None
+
+    # Node index, parent node and position in the index, set by the parser
+    # when an index is being built (see BisonParser.build_index).
+    _index = None
+    _parent = None
+    _seq = None
+    _lo = None
+
     def __init__(self, **kw):
 
         self.__dict__.update(kw)
@@ -46,6 +193,16 @@ class BisonNode:
         # mirror this dict to simplify dumping
         self.kw = kw
 
+    def __getstate__(self):
+        """
+        Leaves the location table and the index of the run out of pickles.
+        """
+        state = self.__dict__.copy()
+        for name in ('_locations', '_node_id', '_index', '_parent', '_seq',
+                     '_lo'):
+            state.pop(name, None)
+        return state
+
     def __str__(self):
         return '<BisonNode:%s>' % self.target
 
@@ -59,20 +216,92 @@ class BisonNode:
         If the subscript is a single number, it will be used as an
         index into this node's children list.
 
-        If the subscript is a list or tuple, we recursively fetch
-        the item by using the first element as an index into this
-        node's children, the second element as an index into that
-        child node's children, and so on
+        If the subscript is a list or tuple, we fetch the item by
+        using the first element as an index into this node's children,
+        the second element as an index into that child node's children,
+        and so on
         """
         if type(item) in [type(0), type(0L)]:
             return self.values[item]
         elif type(item) in [type(()), type([])]:
-            if len(item) == 0:
-                return self
-            return self.values[item[0]][item[1:]]
+            node = self
+            for index in item:
+                node = node.values[index]
+            return node
         else:
             raise TypeError('Can only index %s objects with an int or a'
-                            ' list/tuple' % self.__class.__name__)
+                            ' list/tuple' % self.__class__.__name__)
+
+    def _location_field(index):
+        def get(self):
+            if self._locations is None:
+                return None
+            return self._locations.field(self._node_id, index)
+        return property(get)
+
+    first_line = _location_field(0)
+    first_column = _location_field(1)
+    last_line = _location_field(2)
+    last_column = _location_field(3)
+    first_byte = _location_field(4)
+    last_byte = _location_field(5)
+
+    del _location_field
+
+    @property
+    def location(self):
+        """
+        The (first_line, first_column, last_line, last_column, first_byte,
+        last_byte) tuple of this node, or None if no locations were tracked.
+        """
+        if self._locations is None:
+            return None
+        return self._locations.location(self._node_id)
+
+    @property
+    def parent(self):
+        """
+        The node which holds this node, if the node was indexed.
+        """
+        return self._parent
+
+    def ancestors(self):
+        """
+        Generates the parent of this node, its parent, and so on up to the
+        root of the tree. Only works for indexed nodes.
+        """
+        node = self._parent
+        while node is not None:
+            yield node
+            node = node._parent
+
+    def find_all(self, target):
+        """
+        Returns the nodes of the given target in the subtree of this node,
+        including the node itself, in document order.
+
+        For indexed nodes, the nodes are looked up in the index. Otherwise
+        the subtree is walked.
+        """
+        if self._index is not None:
+            return self._index.find_all(target, self)
+
+        result = []
+        for node in self.iter_preorder():
+            if node.target == target:
+                result.append(node)
+        return result
+
+    def find_tokens(self, name):
+        """
+        Returns the tokens of the given token name in the subtree of this
+        node, as (node, index) pairs in document order, where
+        node.values[index] is the token value. Only works for indexed nodes.
+        """
+        if self._index is None:
+            raise ValueError('%s is not indexed' % self)
+
+        return self._index.find_tokens(name, self)
 
     def __len__(self):
 
@@ -84,41 +313,200 @@ class BisonNode:
     def __iter__(self):
         return iter(self.values)
 
+    def iter_preorder(self):
+        """
+        Generates this node and all nodes below it, each node before its
+        children.
+
+        Nodes held in lists of values are included. The tree is walked with
+        an explicit stack, so deep trees do not run into the recursion
+        limit.
+        """
+        stack = [self]
+
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(_children(node))
+
+    def iter_postorder(self):
+        """
+        Generates this node and all nodes below it, each node after its
+        children.
+        """
+        # nodes whose children have been pushed already are pushed again
+        # wrapped in a tuple
+        stack = [self]
+
+        while stack:
+            node = stack.pop()
+
+            if type(node) is tuple:
+                yield node[0]
+                continue
+
+            stack.append((node,))
+            stack.extend(_children(node))
+
+    def walk(self):
+        """
+        Generates ('enter', node) and ('leave', node) tuples while walking
+        the tree below this node, depth first. The 'enter' event of a node
+        comes before those of its children, the 'leave' event after them.
+        """
+        stack = [self]
+
+        while stack:
+            node = stack.pop()
+
+            if type(node) is tuple:
+                yield node
+                continue
+
+            yield 'enter', node
+            stack.append(('leave', node))
+            stack.extend(_children(node))
+
     def dump(self, indent=0):
         """
-        For debugging - prints a recursive dump of a parse tree node and its children
+        For debugging - prints a dump of a parse tree node and its children
         """
         specialAttribs = ['option', 'target', 'names', 'values']
-        indents = ' ' * indent * 2
-        #print "%s%s: %s %s" % (indents, self.target, self.option, self.names)
-        print '%s%s:' % (indents, self.target)
 
-        for name, val in self.kw.items() + zip(self.names, self.values):
-            if name in specialAttribs or name.startswith('_'):
+        # the stack holds nodes still to be dumped, with their indentation,
+        # and the lines printed for tokens and attributes
+        stack = [(self, indent)]
+
+        while stack:
+            node, indent = stack.pop()
+
+            if not isinstance(node, BisonNode):
+                print node
                 continue
 
-            if isinstance(val, BisonNode):
-                val.dump(indent + 1)
-            else:
-                print indents + '  %s=%s' % (name, val)
+            indents = ' ' * indent * 2
+            print '%s%s:' % (indents, node.target)
+
+            items = []
+            for name, val in node.kw.items() + zip(node.names, node.values):
+                if name in specialAttribs or name.startswith('_'):
+                    continue
+
+                if isinstance(val, BisonNode):
+                    items.append((val, indent + 1))
+                elif isinstance(val, (list, tuple)):
+                    items.append((indents + '  %s:' % name, None))
+                    items.extend(_dumplist(val, indent + 1))
+                else:
+                    items.append((indents + '  %s=%s' % (name, val), None))
 
-    def toxml(self):
+            items.reverse()
+            stack.extend(items)
+
+    def toxml(self, encoding=None):
         """
         Returns an xml serialisation of this node and its children, as a raw string
 
         Called on the toplevel node, the xml is a representation of the
         entire parse tree.
         """
-        return self.toxmldoc().toxml()
+        return self.toprettyxml('', '', encoding)
 
     def toprettyxml(self, indent='  ', newl='\n', encoding=None):
         """
         Returns a human-readable xml serialisation of this node and its
         children.
         """
-        return self.toxmldoc().toprettyxml(indent=indent,
-                                           newl=newl,
-                                           encoding=encoding)
+        writer = StringIO()
+        self.writexml(writer, '', indent, newl, encoding)
+        return writer.getvalue()
+
+    def writexml(self, writer, indent='', addindent='', newl='',
+                 encoding=None):
+        """
+        Writes an xml serialisation of this node and its children to the
+        file-like object 'writer', producing the same output as the
+        xml.dom.minidom document returned by toxmldoc().
+
+        Values which are lists (such as those built by list_rule handlers)
+        are written as elements with a '_list' attribute, holding the
+        elements of their nodes and an 'item' element for each other value.
+
+        The xml is written while walking the tree, without building a DOM
+        first. The tree is walked with an explicit stack, so deep trees do
+        not run into the recursion limit.
+
+        The text is written to the writer as a byte string in the given
+        encoding, which is named in the xml declaration, or in utf-8 if
+        the encoding is None. Byte string values are taken to be utf-8
+        encoded. Characters which the encoding lacks are written as
+        character references.
+
+        Arguments:
+            - writer - a file-like object with a write() method, taking
+              byte strings
+            - indent - the indentation of this node
+            - addindent - the indentation added for each nesting level
+            - newl - the newline string
+            - encoding - the encoding named in the xml declaration
+        """
+        specialAttribs = ['option', 'target', 'names', 'values']
+        write = _xmlwriter(writer.write, encoding)
+
+        if encoding is None:
+            write('<?xml version="1.0" ?>' + newl)
+        else:
+            write('<?xml version="1.0" encoding="%s"?>%s' % (encoding, newl))
+
+        # the stack holds nodes still to be written, along with their
+        # indentation, and the (pre-rendered) text of token elements and
+        # closing tags
+        stack = [(self, indent)]
+
+        while stack:
+            node, ind = stack.pop()
+
+            if not isinstance(node, BisonNode):
+                write(node)
+                continue
+
+            write(ind + '<' + node.target)
+
+            attribs = []
+            for name, val in node.kw.items():
+                if name in ['names', 'values'] or name.startswith('_'):
+                    continue
+                if not isinstance(val, basestring):
+                    val = str(val)
+                attribs.append((name, val))
+            attribs.sort()
+
+            for name, val in attribs:
+                write(' %s="%s"' % (name, _escape(val)))
+
+            children = []
+            for name, val in zip(node.names, node.values):
+                if name in specialAttribs or name.startswith('_'):
+                    continue
+                children.append((name, val))
+
+            if not children:
+                write('/>' + newl)
+                continue
+
+            write('>' + newl)
+            stack.append(('%s</%s>%s' % (ind, node.target, newl), None))
+
+            childind = ind + addindent
+            children.reverse()
+
+            for name, val in children:
+                if isinstance(val, BisonNode):
+                    stack.append((val, childind))
+                elif isinstance(val, (list, tuple)):
+                    _xmllist(stack, name, val, childind, addindent, newl)
+                else:
+                    stack.append((_xmltoken(name, val, childind, newl), None))
 
     def toxmldoc(self):
         """
@@ -136,33 +524,56 @@ class BisonNode:
         specialAttribs = ['option', 'target', 'names', 'values']
 
         # generate an xml element obj for this node
-        x = docobj.createElement(self.target)
+        root = docobj.createElement(self.target)
 
-        # set attribs
-        for name, val in self.kw.items():
-            if name in ['names', 'values'] or name.startswith('_'):
-                continue
+        # the elements of child nodes are created and appended when their
+        # parent is filled in, and filled in themselves when popped from
+        # the stack
+        stack = [(self, root)]
 
-            x.setAttribute(name, str(val))
-        #x.setAttribute('target', self.target)
-        #x.setAttribute('option', self.option)
+        while stack:
+            node, x = stack.pop()
 
-        # and add the children
-        for name, val in zip(self.names, self.values):
-            if name in specialAttribs or name.startswith('_'):
-                continue
+            # set attribs
+            for name, val in node.kw.items():
+                if name in ['names', 'values'] or name.startswith('_'):
+                    continue
 
-            if isinstance(val, BisonNode):
-                x.appendChild(val.toxmlelem(docobj))
-            else:
-                sn = docobj.createElement(name)
-                sn.setAttribute('target', name)
-                tn = docobj.createTextNode(val)
-                sn.appendChild(tn)
-                x.appendChild(sn)
+                x.setAttribute(name, str(val))
+
+            # and add the children
+            for name, val in zip(node.names, node.values):
+                if name in specialAttribs or name.startswith('_'):
+                    continue
+
+                x.appendChild(self._xmlvalue(docobj, stack, name, val))
 
         # done
-        return x
+        return root
+
+    def _xmlvalue(self, docobj, stack, name, val):
+        """
+        Returns the DOM Element of a value of a node, for toxmlelem(). The
+        elements of nodes are pushed onto the stack to be filled in; lists
+        become elements with a '_list' attribute, holding an element for
+        each of their values.
+        """
+        if isinstance(val, BisonNode):
+            sn = docobj.createElement(val.target)
+            stack.append((val, sn))
+            return sn
+
+        sn = docobj.createElement(name)
+        sn.setAttribute('target', name)
+
+        if isinstance(val, (list, tuple)):
+            sn.setAttribute('_list', '1')
+            for item in val:
+                sn.appendChild(self._xmlvalue(docobj, stack, 'item', item))
+        else:
+            sn.appendChild(docobj.createTextNode(val))
+
+        return sn
 
 
 
@@ -0,0 +1,146 @@
+"""
+Columnar storage of the token stream of a scanner run, and batching of the
+tokens of Python tokenizers.
+
+Released under the GNU General Public License, a copy of which should appear in
+this distribution in the file called 'COPYING'. If this file is missing, then
+you can obtain a copy of the GPL license document from the GNU website at
+http://www.gnu.org.
+
+This software is released with no warranty whatsoever. Use it at your own
+risk.
+
+If you wish to use this software in a commercial application, and wish to
+depart from the GPL licensing requirements, please contact the author and apply
+for a commercial license.
+"""
+from array import array
+from itertools import islice
+
+# Bison numbers the declared tokens from this value on, in the order of the
+# parser's tokens list. Lower ids are single character tokens.
+FIRST_TOKEN_ID = 258
+
+# Names of the token ids which bison reserves.
+SPECIAL_TOKENS = {-2: None, 0: '$end', 256: 'error', 257: '$undefined'}
+
+# Number of tokens per batch made by token_batches().
+BATCH_SIZE = 1024
+
+
+def token_name(tokenid, tokens):
+    """
+    Returns the name of a bison token id: the name from the parser's tokens
+    list, the character for single character tokens, or the name of one of
+    bison's own tokens (None for no token).
+    """
+    if tokenid in SPECIAL_TOKENS:
+        return SPECIAL_TOKENS[tokenid]
+
+    if tokenid < 256:
+        return chr(tokenid)
+
+    return tokens[tokenid - FIRST_TOKEN_ID]
+
+
+def token_batches(tokens, size=BATCH_SIZE):
+    """
+    Groups an iterable of (token, value, location) tuples into lists of up
+    to 'size' tokens, as returned by the tokenizer of a BisonParser, e.g.::
+
+        def tokenizer(self):
+            return token_batches(self.scan(self.file.read()))
+    """
+    tokens = iter(tokens)
+
+    while True:
+        batch = list(islice(tokens, size))
+        if not batch:
+            return
+        yield batch
+
+
+class TokenBuffer(object):
+    """
+    Tokens found by BisonParser.tokenize(), stored column by column.
+
+    Attributes:
+        - ids - the bison token ids, as an int array
+        - starts, ends - the byte offsets of the start and end of each token
+          in the source, as int arrays
+        - lines - the line each token starts on, as an int array
+        - source - the tokenized string
+        - texts - a sequence view of the token texts, which are sliced from
+          the source on access
+
+    The arrays support the buffer protocol, so they can be wrapped without
+    copying, e.g. numpy.frombuffer(tokens.ids, dtype=numpy.intc). The
+    offsets and lines need the default YY_USER_ACTION of the lex script.
+    """
+
+    def __init__(self, data, source, tokens):
+        self.ids = array('i')
+        self.starts = array('i')
+        self.ends = array('i')
+        self.lines = array('i')
+
+        self.ids.fromstring(data[0])
+        self.starts.fromstring(data[1])
+        self.ends.fromstring(data[2])
+        self.lines.fromstring(data[3])
+
+        self.source = source
+        self.tokens = list(tokens)
+        self.texts = TokenTexts(self)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        """
+        Returns the (name, start, end, line) tuple of a token.
+        """
+        return self.name(i), self.starts[i], self.ends[i], self.lines[i]
+
+    def name(self, i):
+        """
+        Returns the name of the i-th token: the name from the parser's
+        tokens list, or the character for single character tokens.
+        """
+        return self.idname(self.ids[i])
+
+    def idname(self, tokenid):
+        """
+        Returns the name of a token id.
+        """
+        return token_name(tokenid, self.tokens)
+
+    def text(self, i):
+        """
+        Returns the text of the i-th token.
+        """
+        return self.source[self.starts[i]:self.ends[i]]
+
+
+class TokenTexts(object):
+    """
+    Read-only sequence of the token texts of a TokenBuffer.
+    """
+
+    def __init__(self, tokens):
+        self._tokens = tokens
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            result = []
+            for j in xrange(*i.indices(len(self))):
+                result.append(self._tokens.text(j))
+            return result
+
+        if i < 0:
+            i += len(self)
+
+        return self._tokens.text(i)
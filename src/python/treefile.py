@@ -0,0 +1,482 @@
+"""
+Compact binary serialisation of parse trees.
+
+Released under the GNU General Public License, a copy of which should appear in
+this distribution in the file called 'COPYING'. If this file is missing, then
+you can obtain a copy of the GPL license document from the GNU website at
+http://www.gnu.org.
+
+This software is released with no warranty whatsoever. Use it at your own
+risk.
+
+If you wish to use this software in a commercial application, and wish to
+depart from the GPL licensing requirements, please contact the author and apply
+for a commercial license.
+
+File layout (all numbers are little endian):
+
+    header:       'PYBT', format version (uint8), string count (uint32)
+    string table: for each string, its length (uint32) and its bytes
+    tree:         the value record of the root node
+
+Value records start with a one byte kind:
+
+    'N' node:     length of the rest of the record (uint32), target string
+                  index (uint32), option (int32), attribute count (uint16),
+                  the attributes as (name string index, value record),
+                  child count (uint32), the children as (name string index,
+                  value record)
+    'L' list:     item count (uint32), the item value records
+    'S' string:   string index (uint32)
+    'U' unicode:  string index (uint32) of the utf-8 encoded string
+    'B' bool:     uint8 (format version 2)
+    'I' int:      int64
+    'F' float:    double
+    'Z' None
+
+The length prefix of node records allows skipping whole subtrees, which is
+what the lazy loading of memory-mapped files relies on.
+"""
+import mmap
+import struct
+
+from .node import BisonNode
+
+MAGIC = 'PYBT'
+VERSION = 2
+
+# Versions of the format which can be read: version 2 added bools.
+_READABLE = (1, 2)
+
+_header = struct.Struct('<4sBI')
+_uint16 = struct.Struct('<H')
+_uint32 = struct.Struct('<I')
+_int64 = struct.Struct('<q')
+_double = struct.Struct('<d')
+_bool = struct.Struct('<?')
+_nodehead = struct.Struct('<IIi')
+
+# Special attributes of nodes, which are not stored as attributes.
+_specialAttribs = ['target', 'option', 'names', 'values']
+
+# Operations on the encoder stack.
+_VALUE, _NAME, _END = range(3)
+
+
+def dump(tree, fileobj):
+    """
+    Writes a parse tree to a file object.
+
+    Nodes are stored with their target, option, children and those of
+    their attributes which hold strings or numbers. Children can be nodes,
+    lists, strings, numbers or None.
+    """
+    fileobj.write(dumps(tree))
+
+
+def dumps(tree):
+    """
+    Returns the binary serialisation of a parse tree, as a string.
+    """
+    strings = []
+    stringids = {}
+
+    def intern(s):
+        try:
+            return stringids[s]
+        except KeyError:
+            stringids[s] = len(strings)
+            strings.append(s)
+            return stringids[s]
+
+    body = _encode(tree, intern)
+
+    out = [_header.pack(MAGIC, VERSION, len(strings))]
+    for s in strings:
+        out.append(_uint32.pack(len(s)))
+        out.append(s)
+    out.append(str(body))
+
+    return ''.join(out)
+
+
+def load(fileobj, namespace=None, lazy=False):
+    """
+    Reads a parse tree from a file object.
+
+    Arguments:
+        - fileobj - a file object, opened in binary mode
+        - namespace - a dict or module object in which to look up a
+          'target_Node' class for each node. Targets without such a class
+          are loaded as BisonNode objects.
+        - lazy - if true, the file is memory-mapped, and the nodes are
+          loaded as LazyNode objects, which decode their children only
+          when these are first accessed. The file object needs to have a
+          fileno() method in that case, and the namespace is not used.
+
+    Returns:
+        - root node object of the loaded parse tree
+    """
+    if lazy:
+        buf = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        strings, pos = _readstrings(buf)
+        return _decodelazy(buf, pos, strings)[0]
+
+    return loads(fileobj.read(), namespace)
+
+
+def loads(data, namespace=None):
+    """
+    Returns the parse tree stored in the string 'data'.
+    """
+    strings, pos = _readstrings(data)
+    return _decode(data, pos, strings, _classlookup(namespace))
+
+
+def roundtrips(tree, namespace=None):
+    """
+    Tells if a parse tree comes back the same from loads(), when loaded with
+    the given namespace: each node has the class found for its target (or
+    is a BisonNode), and all its attributes are constructor keywords which
+    hold strings, numbers or None. Values other than nodes, lists, strings,
+    numbers and None don't come back the same; tuples come back as lists.
+    """
+    lookup = _classlookup(namespace)
+    stack = [tree]
+
+    while stack:
+        value = stack.pop()
+
+        if isinstance(value, BisonNode):
+            if value.__class__ is not lookup(value.target):
+                return False
+
+            kw = value.kw
+            for name, val in value.__dict__.items():
+                if name in _specialAttribs or name == 'kw' \
+                        or name.startswith('_'):
+                    continue
+                if name not in kw or kw[name] is not val \
+                        or not _isatom(val):
+                    return False
+
+            for name, val in kw.items():
+                if name in _specialAttribs or name.startswith('_'):
+                    continue
+                if not _isatom(val):
+                    return False
+
+            stack.extend(value.values)
+
+        elif isinstance(value, list):
+            stack.extend(value)
+
+        elif not _isatom(value):
+            return False
+
+    return True
+
+
+def _isatom(value):
+    return value is None or isinstance(value, (basestring, int, long, float))
+
+
+def _encode(tree, intern):
+    """
+    Encodes a value and, for nodes and lists, everything below it. Walks the
+    tree with an explicit stack instead of recursing.
+    """
+    buf = bytearray()
+    stack = [(_VALUE, tree)]
+
+    while stack:
+        op, value = stack.pop()
+
+        if op == _NAME:
+            buf += _uint32.pack(intern(value))
+            continue
+
+        if op == _END:
+            # patch in the length of the finished node record
+            _uint32.pack_into(buf, value, len(buf) - value - 4)
+            continue
+
+        if isinstance(value, BisonNode):
+            buf += 'N'
+            start = len(buf)
+            buf += _nodehead.pack(0, intern(value.target), int(value.option))
+
+            attribs = []
+            for name, val in value.kw.items():
+                if name in _specialAttribs or name.startswith('_'):
+                    continue
+                if val is None or isinstance(val, (basestring, int, long,
+                                                   float)):
+                    attribs.append((name, val))
+
+            buf += _uint16.pack(len(attribs))
+            for name, val in attribs:
+                buf += _uint32.pack(intern(name))
+                _encodeatom(buf, val, intern)
+
+            children = zip(value.names, value.values)
+            buf += _uint32.pack(len(children))
+
+            stack.append((_END, start))
+            children.reverse()
+            for name, val in children:
+                stack.append((_VALUE, val))
+                stack.append((_NAME, name))
+
+        elif isinstance(value, (list, tuple)):
+            buf += 'L'
+            buf += _uint32.pack(len(value))
+            for i in xrange(len(value) - 1, -1, -1):
+                stack.append((_VALUE, value[i]))
+
+        else:
+            _encodeatom(buf, value, intern)
+
+    return buf
+
+
+def _encodeatom(buf, value, intern):
+    if value is None:
+        buf += 'Z'
+    elif isinstance(value, str):
+        buf += 'S'
+        buf += _uint32.pack(intern(value))
+    elif isinstance(value, unicode):
+        buf += 'U'
+        buf += _uint32.pack(intern(value.encode('utf-8')))
+    elif isinstance(value, bool):
+        buf += 'B'
+        buf += _bool.pack(value)
+    elif isinstance(value, (int, long)):
+        buf += 'I'
+        buf += _int64.pack(value)
+    elif isinstance(value, float):
+        buf += 'F'
+        buf += _double.pack(value)
+    else:
+        raise TypeError('Cannot serialise %r' % value)
+
+
+def _readstrings(buf):
+    """
+    Reads the header and string table. Returns the list of strings, and the
+    offset of the tree.
+    """
+    magic, version, nstrings = _header.unpack_from(buf, 0)
+
+    if magic != MAGIC:
+        raise ValueError('Not a PyBison tree file')
+    if version not in _READABLE:
+        raise ValueError('Unsupported tree file version %d' % version)
+
+    pos = _header.size
+    strings = []
+
+    for i in xrange(nstrings):
+        n, = _uint32.unpack_from(buf, pos)
+        pos += 4
+        strings.append(buf[pos:pos + n])
+        pos += n
+
+    return strings, pos
+
+
+def _decodeatom(buf, pos, kind, strings):
+    """
+    Decodes a non-container value of the given kind at offset 'pos'.
+    Returns the value and the offset just after it.
+    """
+    if kind == 'S':
+        return strings[_uint32.unpack_from(buf, pos)[0]], pos + 4
+    if kind == 'U':
+        s = strings[_uint32.unpack_from(buf, pos)[0]]
+        return s.decode('utf-8'), pos + 4
+    if kind == 'I':
+        return _int64.unpack_from(buf, pos)[0], pos + 8
+    if kind == 'B':
+        return _bool.unpack_from(buf, pos)[0], pos + 1
+    if kind == 'F':
+        return _double.unpack_from(buf, pos)[0], pos + 8
+    if kind == 'Z':
+        return None, pos
+
+    raise ValueError('Corrupt tree file: unknown value kind %r at offset %d'
+                     % (kind, pos - 1))
+
+
+def _decodeattribs(buf, pos, strings):
+    """
+    Decodes the attributes of a node. Returns them as a dict, along with the
+    offset just after them.
+    """
+    nattribs, = _uint16.unpack_from(buf, pos)
+    pos += 2
+    attribs = {}
+
+    for i in xrange(nattribs):
+        name = strings[_uint32.unpack_from(buf, pos)[0]]
+        attribs[name], pos = _decodeatom(buf, pos + 5, buf[pos + 4], strings)
+
+    return attribs, pos
+
+
+def _classlookup(namespace):
+    """
+    Returns a function which maps target names to node classes.
+    """
+    if namespace is None:
+        namespace = {}
+    elif not isinstance(namespace, dict):
+        namespace = namespace.__dict__
+
+    classes = {}
+
+    def lookup(target):
+        try:
+            return classes[target]
+        except KeyError:
+            classes[target] = namespace.get(target + '_Node', BisonNode)
+            return classes[target]
+
+    return lookup
+
+
+def _decode(buf, pos, strings, lookup):
+    """
+    Decodes the value at offset 'pos', with everything below it. Uses an
+    explicit stack instead of recursing.
+    """
+    result = []
+
+    # each stack entry holds the values list being filled, the number of
+    # values still to be read into it, and the list of names to fill
+    # alongside (for nodes) or None (for lists)
+    stack = [[result, 1, None]]
+
+    while stack:
+        top = stack[-1]
+        if not top[1]:
+            stack.pop()
+            continue
+
+        top[1] -= 1
+
+        if top[2] is not None:
+            top[2].append(strings[_uint32.unpack_from(buf, pos)[0]])
+            pos += 4
+
+        kind = buf[pos]
+        pos += 1
+
+        if kind == 'N':
+            length, target, option = _nodehead.unpack_from(buf, pos)
+            target = strings[target]
+            attribs, pos = _decodeattribs(buf, pos + _nodehead.size, strings)
+            nchildren, = _uint32.unpack_from(buf, pos)
+            pos += 4
+
+            names = []
+            values = []
+            attribs['target'] = target
+            attribs['option'] = option
+            attribs['names'] = names
+            attribs['values'] = values
+
+            value = lookup(target)(**attribs)
+            stack.append([values, nchildren, names])
+
+        elif kind == 'L':
+            nitems, = _uint32.unpack_from(buf, pos)
+            pos += 4
+            value = []
+            stack.append([value, nitems, None])
+
+        else:
+            value, pos = _decodeatom(buf, pos, kind, strings)
+
+        top[0].append(value)
+
+    return result[0]
+
+
+def _decodelazy(buf, pos, strings):
+    """
+    Decodes the value at offset 'pos', returning nodes as LazyNode objects.
+    Returns the value and the offset just after it.
+    """
+    kind = buf[pos]
+    pos += 1
+
+    if kind == 'N':
+        length, = _uint32.unpack_from(buf, pos)
+        return LazyNode(buf, pos, strings), pos + 4 + length
+
+    if kind == 'L':
+        nitems, = _uint32.unpack_from(buf, pos)
+        pos += 4
+        items = []
+        for i in xrange(nitems):
+            item, pos = _decodelazy(buf, pos, strings)
+            items.append(item)
+        return items, pos
+
+    return _decodeatom(buf, pos, kind, strings)
+
+
+class LazyNode(BisonNode):
+    """
+    Parse node loaded from a memory-mapped tree file.
+
+    Only the target and option are read when the node is created. The rest
+    of the node (names, values and other attributes) is decoded when any of
+    it is first accessed, and its child nodes are LazyNode objects again.
+    """
+    def __init__(self, buf, pos, strings):
+        length, target, option = _nodehead.unpack_from(buf, pos)
+
+        self.target = strings[target]
+        self.option = option
+
+        self._buf = buf
+        self._pos = pos + _nodehead.size
+        self._strings = strings
+
+    def __getattr__(self, name):
+        if name.startswith('__') or '_buf' not in self.__dict__:
+            raise AttributeError(name)
+
+        self._load()
+        return getattr(self, name)
+
+    def _load(self):
+        buf, pos, strings = self._buf, self._pos, self._strings
+
+        attribs, pos = _decodeattribs(buf, pos, strings)
+        nchildren, = _uint32.unpack_from(buf, pos)
+        pos += 4
+
+        names = []
+        values = []
+
+        for i in xrange(nchildren):
+            names.append(strings[_uint32.unpack_from(buf, pos)[0]])
+            value, pos = _decodelazy(buf, pos + 4, strings)
+            values.append(value)
+
+        self.__dict__.update(attribs)
+
+        attribs['target'] = self.target
+        attribs['option'] = self.option
+        attribs['names'] = names
+        attribs['values'] = values
+
+        self.names = names
+        self.values = values
+        self.kw = attribs
+
+        del self._buf, self._pos, self._strings
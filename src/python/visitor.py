@@ -0,0 +1,122 @@
+"""
+Visitor base class for walking parse trees.
+
+Released under the GNU General Public License, a copy of which should appear in
+this distribution in the file called 'COPYING'. If this file is missing, then
+you can obtain a copy of the GPL license document from the GNU website at
+http://www.gnu.org.
+
+This software is released with no warranty whatsoever. Use it at your own
+risk.
+
+If you wish to use this software in a commercial application, and wish to
+depart from the GPL licensing requirements, please contact the author and apply
+for a commercial license.
+"""
+from .node import _children
+
+# Returned by a visit method to skip the children of the visited node.
+SKIP = object()
+
+
+class NodeVisitor(object):
+    """
+    Walks a parse tree depth first, calling a method for each node.
+
+    Subclasses define visit_<target>(node) methods, which are called when a
+    node of that target is entered, before its children are visited, and
+    leave_<target>(node) methods, which are called after its children have
+    been visited. Nodes without such a method are passed to generic_visit()
+    and generic_leave(), which do nothing by default.
+
+    If a visit method returns SKIP, the children of the node are not
+    visited; its leave method is still called.
+
+    The methods are looked up once per target for each visitor class, and
+    the tree is walked with an explicit stack, so deep trees do not run
+    into the recursion limit. As the lookup is done on the class, methods
+    assigned to visitor instances are not used.
+
+    Example::
+
+        class Counter(NodeVisitor):
+            numbers = 0
+            def visit_exp(self, node):
+                if node.option == 0:
+                    self.numbers += 1
+
+        counter = Counter()
+        counter.visit(parser.run())
+    """
+    SKIP = SKIP
+
+    def visit(self, tree):
+        """
+        Visits all nodes of a tree.
+        """
+        handlers = self._handlers()
+        lookup = self._lookup
+
+        # nodes are pushed again as (node, leave) tuples, if they have a
+        # leave method, to call it once their children are done
+        stack = [tree]
+
+        while stack:
+            node = stack.pop()
+
+            if type(node) is tuple:
+                node[1](self, node[0])
+                continue
+
+            try:
+                visit, leave = handlers[node.target]
+            except KeyError:
+                visit, leave = lookup(node.target)
+
+            if leave is not None:
+                stack.append((node, leave))
+
+            if visit is not None and visit(self, node) is SKIP:
+                continue
+
+            stack.extend(_children(node))
+
+    def generic_visit(self, node):
+        """
+        Called when entering nodes without a visit_<target> method.
+        """
+
+    def generic_leave(self, node):
+        """
+        Called when leaving nodes without a leave_<target> method.
+        """
+
+    @classmethod
+    def _handlers(cls):
+        """
+        Returns the dict which maps targets to the (visit, leave) functions
+        of this class.
+        """
+        try:
+            return cls.__dict__['_handler_cache']
+        except KeyError:
+            cls._handler_cache = {}
+            return cls._handler_cache
+
+    @classmethod
+    def _lookup(cls, target):
+        """
+        Looks up and caches the visit and leave functions for a target. The
+        default handlers are returned as None if they are not overridden, so
+        that nodes don't need to be passed to them.
+        """
+        visit = getattr(cls, 'visit_' + target, cls.generic_visit).im_func
+        if visit is NodeVisitor.generic_visit.im_func:
+            visit = None
+
+        leave = getattr(cls, 'leave_' + target, cls.generic_leave).im_func
+        if leave is NodeVisitor.generic_leave.im_func:
+            leave = None
+
+        cls._handlers()[target] = visit, leave
+        return visit, leave
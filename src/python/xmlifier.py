@@ -17,12 +17,24 @@ depart from the GPL licensing requirements, please contact the author and apply
 for a commercial license.
 """
 
-# TODO: use cElementTree instead of Python's xml module.
 # TODO: test this module, since it is currently only moved to another file.
 
 import xml.dom
 import xml.dom.minidom
+import re
 import types
+from cStringIO import StringIO
+
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+# Marks the xml elements of tokens on the loadxmlfile() stack.
+_token = object()
+
+# Encoding named in an xml declaration.
+_encodingdecl = re.compile(r'<\?xml[^>]*encoding=["\']([^"\']+)["\']')
 
 class XMLifier(object):
 
@@ -59,9 +71,131 @@ class XMLifier(object):
         Returns:
             - root node object of reconstituted parse tree
         """
-        doc = xml.dom.minidom.parseString(raw)
-        tree = self.loadxmldoc(doc, namespace)
-        return tree
+        # unicode text is parsed in the encoding its declaration names
+        if isinstance(raw, unicode):
+            match = _encodingdecl.match(raw)
+            encoding = match and match.group(1) or 'utf-8'
+            raw = raw.encode(encoding, 'xmlcharrefreplace')
+
+        return self.loadxmlfile(StringIO(raw), namespace)
+
+    def loadxmlfile(self, fileobj, namespace=None):
+        """
+        Loads a parse tree from an xml file, without building a DOM of the
+        whole document first.
+
+        The document is parsed incrementally, and each xml element is
+        discarded as soon as it has been turned into a node or token, so
+        the memory used on top of the resulting tree stays small. The tree
+        is built without recursion, and the node class of each target is
+        looked up only once.
+
+        Arguments:
+            - fileobj - a file object or the name of the file to read
+            - namespace - a dict or module object, where the node classes required for
+              reconstituting the parse tree, can be found
+
+        Returns:
+            - root node object of reconstituted parse tree
+        """
+        namespace = self._namespace(namespace)
+
+        # node class of each target name, or None for tokens
+        classes = {}
+
+        # stack of the nodes and lists being built (or _token markers),
+        # alongside the stack of their xml elements
+        nodes = []
+        elems = []
+        root = None
+
+        for event, elem in iterparse(fileobj, events=('start', 'end')):
+            if event == 'start':
+                if elems and elem.get('_list') is not None:
+                    nodes.append([])
+                    elems.append(elem)
+                    continue
+
+                if elems:
+                    name = elem.get('target')
+                    if name not in classes:
+                        classes[name] = namespace.get(name + '_Node', None)
+                    isnode = classes[name] is not None
+                else:
+                    isnode = True
+
+                if isnode:
+                    nodeobj = self._createnode(elem.tag, elem.attrib.items(),
+                                               namespace, classes)
+                else:
+                    nodeobj = _token
+
+                nodes.append(nodeobj)
+                elems.append(elem)
+                continue
+
+            nodeobj = nodes.pop()
+            elems.pop()
+
+            if not elems:
+                root = nodeobj
+                elem.clear()
+                break
+
+            if nodeobj is _token:
+                nodeobj = elem.text or ''
+
+            parent = nodes[-1]
+            if isinstance(parent, list):
+                parent.append(nodeobj)
+            else:
+                parent.names.append(elem.get('target'))
+                parent.values.append(nodeobj)
+
+            # drop the finished element, which is the last child of its
+            # parent element at this point
+            elem.clear()
+            del elems[-1][-1]
+
+        return root
+
+    def _namespace(self, namespace):
+        """
+        Returns the dict in which to look up node classes.
+        """
+        if type(namespace) is types.ModuleType:
+            return namespace.__dict__
+        elif namespace == None:
+            return globals()
+        return namespace
+
+    def _createnode(self, tagname, attributes, namespace, classes=None):
+        """
+        Creates a node object for an xml element, and sets its attributes.
+        Returns None for a root element which is a token.
+        """
+        if classes is None:
+            classobj = namespace.get(tagname + '_Node', None)
+        else:
+            if tagname not in classes:
+                classes[tagname] = namespace.get(tagname + '_Node', None)
+            classobj = classes[tagname]
+
+        # barf if node is not a known parse node or token
+        if (not classobj) and tagname not in self.parser.tokens:
+            raise Exception('Cannot reconstitute %s: can\'t find required'
+                    ' node class or token %s' % (tagname, tagname + '_Node'))
+
+        if not classobj:
+            return None
+
+        nodeobj = classobj()
+
+        # add the attribs
+        for k, v in attributes:
+            setattr(nodeobj, k, v)
+
+        return nodeobj
 
     def loadxmldoc(self, xmldoc, namespace=None):
         """
@@ -85,31 +219,10 @@ class XMLifier(object):
             - namespace - a namespace from which the node classes
               needed for reconstituting the tree, can be found
         """
-        # check on namespace
-        if type(namespace) is types.ModuleType:
-            namespace = namespace.__dict__
-        elif namespace == None:
-            namespace = globals()
-
-        objname = xmlobj.tagName
-        classname = objname + '_Node'
-        classobj = namespace.get(classname, None)
-
-        namespacekeys = namespace.keys()
+        namespace = self._namespace(namespace)
 
-        # barf if node is not a known parse node or token
-        if (not classobj) and objname not in self.tokens:
-            raise Exception('Cannot reconstitute %s: can\'t find required'
-                    ' node class or token %s' % (objname, classname))
-
-        if classobj:
-            nodeobj = classobj()
-
-            # add the attribs
-            for k, v in xmlobj.attributes.items():
-                setattr(nodeobj, k, v)
-        else:
-            nodeobj = None
+        nodeobj = self._createnode(xmlobj.tagName, xmlobj.attributes.items(),
+                                   namespace)
 
         #print '----------------'
         #print 'objname=%s' % repr(objname)
@@ -122,15 +235,25 @@ class XMLifier(object):
             #print '%s attributes=%s' % (child, child.attributes.items())
             childname = child.attributes['target'].value
             #print 'childname=%s' % childname
-            if childname + '_Node' in namespacekeys:
-                #print 'we have a node for class %s' % classname
-                childobj = self.loadxmlobj(child, namespace)
-            else:
-                # it's a token
-                childobj = child.childNodes[0].nodeValue
-                #print 'got token %s=%s' % (childname, childobj)
+            childobj = self._loadxmlvalue(child, namespace)
 
             nodeobj.names.append(childname)
             nodeobj.values.append(childobj)
 
         return nodeobj
+
+    def _loadxmlvalue(self, xmlobj, namespace):
+        """
+        Returns the value of a node, reconstituted from the
+        xml.dom.minidom.Element object of a child node, a token or a list.
+        """
+        if xmlobj.hasAttribute('_list'):
+            return [self._loadxmlvalue(child, namespace)
+                    for child in xmlobj.childNodes]
+
+        if xmlobj.attributes['target'].value + '_Node' in namespace:
+            #print 'we have a node for class %s' % classname
+            return self.loadxmlobj(xmlobj, namespace)
+
+        # it's a token
+        return xmlobj.childNodes[0].nodeValue
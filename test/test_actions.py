@@ -0,0 +1,52 @@
+"""
+Tests of the decorators declaring native rule actions.
+"""
+import unittest
+
+from bison import native_actions, list_rule
+
+
+class NativeActionsTest(unittest.TestCase):
+
+    def test_declares_actions(self):
+        @native_actions({0: 1, 2: None})
+        def on_exp(self, target, option, names, values):
+            pass
+
+        self.assertEqual(on_exp.native_actions, {0: 1, 2: None})
+        self.assertEqual(on_exp.__name__, 'on_exp')
+
+    def test_invalid_options(self):
+        self.assertRaises(ValueError, native_actions, {-1: 1})
+        self.assertRaises(ValueError, native_actions, {'0': 1})
+
+    def test_invalid_terms(self):
+        self.assertRaises(ValueError, native_actions, {0: 0})
+        self.assertRaises(ValueError, native_actions, {0: '1'})
+        self.assertRaises(ValueError, native_actions, {0: 1.0})
+
+
+class ListRuleTest(unittest.TestCase):
+
+    def test_bare(self):
+        @list_rule
+        def on_input(self, target, option, names, values):
+            pass
+
+        self.assertEqual(on_input.list_rule, {})
+        self.assertEqual(on_input.__name__, 'on_input')
+
+    def test_elements(self):
+        @list_rule({1: 3})
+        def on_args(self, target, option, names, values):
+            pass
+
+        self.assertEqual(on_args.list_rule, {1: 3})
+
+    def test_invalid_elements(self):
+        self.assertRaises(ValueError, list_rule, {0: 0})
+        self.assertRaises(ValueError, list_rule, {-2: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+"""
+Tests of the on-disk parse result cache.
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from bison import BisonNode
+from bison.cache import ParseCache, ENTRY_SUFFIX
+
+
+class exp_Node(BisonNode):
+    pass
+
+
+def sample_tree():
+    leaf = BisonNode(target='exp', option=0, names=['NUMBER'], values=['1'])
+    return BisonNode(target='input', option=1, names=['exp'], values=[leaf])
+
+
+class ParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ParseCache(os.path.join(self.directory, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def entries(self):
+        return [name for name in os.listdir(self.cache.directory)
+                if name.endswith(ENTRY_SUFFIX)]
+
+    def test_keys(self):
+        key = self.cache.key('engine', 'input')
+        self.assertEqual(key, self.cache.key('engine', 'input'))
+        self.assertNotEqual(key, self.cache.key('engine2', 'input'))
+        self.assertNotEqual(key, self.cache.key('engine', 'input2'))
+
+    def test_miss_and_hit(self):
+        key = self.cache.key('engine', 'input')
+        self.assertEqual(self.cache.get(key), (False, None))
+
+        self.cache.put(key, sample_tree())
+        found, tree = self.cache.get(key)
+
+        self.assertTrue(found)
+        self.assertEqual(tree.target, 'input')
+        self.assertEqual(tree.values[0].values, ['1'])
+        self.assertEqual(self.cache.stats(),
+                         {'hits': 1, 'misses': 1, 'stored': 1})
+
+    def test_list_results(self):
+        # the result of a parser whose start target is a list rule
+        self.cache.put('k', [sample_tree(), sample_tree()])
+
+        f = open(self.cache._path('k'), 'rb')
+        self.assertEqual(f.read(1), 'T')
+        f.close()
+
+        found, trees = self.cache.get('k')
+        self.assertTrue(found)
+        self.assertEqual([tree.target for tree in trees], ['input', 'input'])
+
+    def test_other_results(self):
+        self.cache.put('k', {'answer': 42})
+        self.assertEqual(self.cache.get('k'), (True, {'answer': 42}))
+
+    def test_handler_attributes_kept(self):
+        tree = sample_tree()
+        tree.values[0].num = 1.5
+
+        self.cache.put('k', tree)
+        found, loaded = self.cache.get('k')
+
+        self.assertTrue(found)
+        self.assertEqual(loaded.values[0].num, 1.5)
+
+    def test_node_classes_kept(self):
+        tree = exp_Node(target='other', option=0, names=[], values=[])
+
+        self.cache.put('k', tree)
+        found, loaded = self.cache.get('k')
+
+        self.assertTrue(isinstance(loaded, exp_Node))
+        self.assertEqual(loaded.target, 'other')
+
+    def test_run_state_not_pickled(self):
+        tree = sample_tree()
+        tree.values[0].num = 1.5
+        tree._index = object()
+
+        self.cache.put('k', tree)
+        found, loaded = self.cache.get('k')
+
+        self.assertTrue(found)
+        self.assertEqual(loaded._index, None)
+
+    def test_none_not_cached(self):
+        self.cache.put('k', None)
+        self.assertEqual(self.entries(), [])
+        self.assertEqual(self.cache.get('k'), (False, None))
+
+    def test_unserialisable_not_cached(self):
+        self.cache.put('k', lambda: None)
+        self.assertEqual(self.entries(), [])
+
+    def test_damaged_entry(self):
+        self.cache.put('k', sample_tree())
+        f = open(self.cache._path('k'), 'wb')
+        f.write('Tgarbage')
+        f.close()
+
+        self.assertEqual(self.cache.get('k'), (False, None))
+        self.assertEqual(self.entries(), [])
+
+    def test_write_failure_ignored(self):
+        shutil.rmtree(self.cache.directory)
+        self.cache.put('k', sample_tree())
+        self.assertEqual(self.cache.stored, 0)
+
+    def test_evict_by_size(self):
+        self.cache.put('old', 'x' * 1000)
+        self.cache.put('new', 'y' * 1000)
+
+        now = time.time()
+        os.utime(self.cache._path('old'), (now - 100, now - 100))
+
+        self.cache.max_bytes = 1500
+        self.cache.evict()
+
+        self.assertEqual(self.entries(), ['new' + ENTRY_SUFFIX])
+
+    def test_evict_by_age(self):
+        self.cache.put('old', 'x')
+        self.cache.put('new', 'y')
+
+        now = time.time()
+        os.utime(self.cache._path('old'), (now - 100, now - 100))
+
+        self.cache.max_age = 50
+        self.cache.evict()
+
+        self.assertEqual(self.entries(), ['new' + ENTRY_SUFFIX])
+
+    def test_clear(self):
+        self.cache.put('a', 1)
+        self.cache.put('b', 2)
+        self.cache.clear()
+        self.assertEqual(self.entries(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
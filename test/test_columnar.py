@@ -0,0 +1,84 @@
+"""
+Tests of parse trees stored in columns.
+"""
+import unittest
+from array import array
+
+from bison import BisonNode
+from bison.columnar import ColumnarTree, NodeView
+
+
+RULES = (('$accept', 0), ('exp', 0), ('exp', 1))
+TOKENS = ['NUMBER', 'PLUS']
+
+
+def sample_tree():
+    # the columns the engine builds for '1+2' from
+    #   exp : NUMBER | exp PLUS exp
+    data = [array('i', column) for column in (
+        [-258, 1, -259, -258, 1, 2],    # symbols
+        [-1, 0, -1, -1, 3, 1],          # first children
+        [-1, 2, 4, -1, -1, -1],         # next siblings
+        [0, 0, 1, 2, 2, 0],             # starts
+        [1, 1, 2, 3, 3, 3],             # ends
+        [0, -1, 1, 2, -1, -1],          # value indices
+        )]
+    return ColumnarTree(data + [['1', '+', '2']], RULES, TOKENS)
+
+
+class ColumnarTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = sample_tree()
+
+    def test_entries(self):
+        tree = self.tree
+        self.assertEqual(len(tree), 6)
+        self.assertEqual([tree.is_node(i) for i in range(6)],
+                         [False, True, False, False, True, True])
+        self.assertEqual([tree.name(i) for i in range(6)],
+                         ['NUMBER', 'exp', 'PLUS', 'NUMBER', 'exp', 'exp'])
+        self.assertEqual(tree.target(5), 'exp')
+        self.assertEqual(tree.option(5), 1)
+        self.assertEqual(list(tree.children(5)), [1, 2, 4])
+        self.assertEqual(list(tree.children(0)), [])
+        self.assertEqual(tree.text(4, '1+2'), '2')
+
+    def test_columns_kept(self):
+        self.assertTrue(isinstance(self.tree.symbols, array))
+        self.assertEqual(str(buffer(self.tree.ends)),
+                         array('i', [1, 1, 2, 3, 3, 3]).tostring())
+
+    def test_root(self):
+        root = self.tree.root
+        self.assertTrue(isinstance(root, NodeView))
+        self.assertTrue(isinstance(root, BisonNode))
+        self.assertEqual(root.target, 'exp')
+        self.assertEqual(root.option, 1)
+        self.assertEqual(root.names, ['exp', 'PLUS', 'exp'])
+        self.assertEqual((root.first_byte, root.last_byte), (0, 3))
+
+        left, plus, right = root.values
+        self.assertEqual(plus, '+')
+        self.assertEqual(left.values, ['1'])
+        self.assertEqual(right.values, ['2'])
+        self.assertEqual(right.kw, {'target': 'exp', 'option': 0})
+
+    def test_views_shared(self):
+        self.assertTrue(self.tree.node(1) is self.tree.root.values[0])
+        self.assertRaises(ValueError, self.tree.node, 0)
+
+    def test_find_all(self):
+        self.assertEqual(self.tree.find_all('exp'), [1, 4, 5])
+        self.assertEqual(self.tree.find_all('missing'), [])
+
+    def test_empty(self):
+        data = [array('i') for i in range(6)] + [None]
+        tree = ColumnarTree(data, RULES, TOKENS)
+        self.assertEqual(len(tree), 0)
+        self.assertTrue(tree.root is None)
+        self.assertEqual(tree.values, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Tests of the garbage collector control of GCPause.
+"""
+import gc
+import unittest
+
+from bison.gcpause import GCPause
+
+
+class GCPauseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.enabled = gc.isenabled()
+        self.thresholds = gc.get_threshold()
+        gc.enable()
+
+    def tearDown(self):
+        gc.set_threshold(*self.thresholds)
+        if self.enabled:
+            gc.enable()
+        else:
+            gc.disable()
+
+    def test_invalid_mode(self):
+        self.assertRaises(ValueError, GCPause, 'bogus')
+
+    def test_suspend_restores(self):
+        pause = GCPause('suspend')
+        pause.start()
+        self.assertFalse(gc.isenabled())
+        pause.finish()
+
+        self.assertTrue(gc.isenabled())
+        self.assertEqual(gc.get_threshold(), self.thresholds)
+
+        stats = pause.stats()
+        self.assertEqual(stats['mode'], 'suspend')
+        self.assertEqual(stats['collections'], 0)
+        self.assertEqual(stats['settle_collections'], 1)
+
+    def test_raise_restores(self):
+        pause = GCPause('raise', 10)
+        pause.start()
+        self.assertTrue(gc.isenabled())
+        self.assertEqual(gc.get_threshold(),
+                         tuple([n * 10 for n in self.thresholds]))
+        pause.finish()
+
+        self.assertEqual(gc.get_threshold(), self.thresholds)
+
+        stats = pause.stats()
+        if hasattr(gc, 'callbacks'):
+            self.assertTrue(stats['collections'] >= 0)
+        else:
+            self.assertEqual(stats['collections'], None)
+            self.assertEqual(stats['gc_time'], None)
+
+    def test_nested_pauses(self):
+        outer = GCPause('raise', 10)
+        inner = GCPause('suspend')
+
+        outer.start()
+        inner.start()
+        inner.finish()
+
+        # the outer pause is still active, so nothing is restored yet
+        self.assertEqual(gc.get_threshold(),
+                         tuple([n * 10 for n in self.thresholds]))
+        self.assertEqual(inner.stats()['settle_collections'], 0)
+
+        outer.finish()
+        self.assertTrue(gc.isenabled())
+        self.assertEqual(gc.get_threshold(), self.thresholds)
+
+    def test_disabled_collector_stays_disabled(self):
+        gc.disable()
+
+        pause = GCPause('raise')
+        pause.start()
+        self.assertEqual(gc.get_threshold(), self.thresholds)
+        pause.finish()
+
+        self.assertFalse(gc.isenabled())
+        self.assertEqual(pause.stats()['settle_collections'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+Tests of the per-target node index.
+"""
+import unittest
+
+from bison import BisonNode
+from bison.index import NodeIndex
+
+
+def num(text):
+    return BisonNode(target='exp', option=0, names=['NUMBER'], values=[text])
+
+
+def add(left, right):
+    return BisonNode(target='exp', option=1, names=['exp', 'PLUS', 'exp'],
+                     values=[left, '+', right])
+
+
+class NodeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        # (1 + 2) + 3, and a list of statements holding it
+        self.one, self.two, self.three = num('1'), num('2'), num('3')
+        self.inner = add(self.one, self.two)
+        self.outer = add(self.inner, self.three)
+        self.stmt = BisonNode(target='stmt', option=0, names=['exp'],
+                              values=[self.outer])
+        self.other = BisonNode(target='stmt', option=0, names=['NUMBER'],
+                               values=['4'])
+        self.root = BisonNode(target='input', option=0,
+                              names=['stmts', 'NUMBER'],
+                              values=[[self.stmt, self.other], '5'])
+
+        self.index = NodeIndex(['NUMBER', 'PLUS'])
+        self.index.addtree(self.root)
+
+    def test_count(self):
+        self.assertEqual(len(self.index), 8)
+
+        # adding a node again is ignored
+        self.index.add(self.inner)
+        self.assertEqual(len(self.index), 8)
+
+    def test_find_all(self):
+        self.assertEqual(self.index.find_all('exp'),
+                         [self.outer, self.inner, self.one, self.two,
+                          self.three])
+        self.assertEqual(self.index.find_all('stmt'), [self.stmt, self.other])
+        self.assertEqual(self.index.find_all('missing'), [])
+
+    def test_find_all_within(self):
+        self.assertEqual(self.inner.find_all('exp'),
+                         [self.inner, self.one, self.two])
+        self.assertEqual(self.three.find_all('exp'), [self.three])
+        self.assertEqual(self.other.find_all('exp'), [])
+        self.assertEqual(self.root.find_all('stmt'), [self.stmt, self.other])
+
+    def test_find_tokens(self):
+        numbers = [node.values[i] for node, i in
+                   self.root.find_tokens('NUMBER')]
+        self.assertEqual(numbers, ['1', '2', '3', '4', '5'])
+
+        self.assertEqual(self.outer.find_tokens('PLUS'),
+                         [(self.inner, 1), (self.outer, 1)])
+        self.assertEqual(self.inner.find_tokens('PLUS'), [(self.inner, 1)])
+        self.assertEqual(self.one.find_tokens('PLUS'), [])
+
+    def test_parents(self):
+        self.assertTrue(self.two.parent is self.inner)
+        self.assertTrue(self.stmt.parent is self.root)
+        self.assertEqual(list(self.one.ancestors()),
+                         [self.inner, self.outer, self.stmt, self.root])
+        self.assertTrue(self.root.parent is None)
+
+    def test_list_of_trees(self):
+        index = NodeIndex(['NUMBER'])
+        index.addtree([self.inner, [self.three]])
+
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.find_all('exp'),
+                         [self.inner, self.one, self.two, self.three])
+        self.assertEqual(self.inner.find_all('exp'),
+                         [self.inner, self.one, self.two])
+        self.assertEqual([node.values[i] for node, i in
+                          index.find_tokens('NUMBER')], ['1', '2', '3'])
+
+    def test_unindexed_nodes(self):
+        dropped = num('6')
+        self.assertEqual(dropped.find_all('exp'), [dropped])
+        self.assertTrue(dropped._index is None)
+        self.assertEqual(len(self.index.find_all('exp')), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
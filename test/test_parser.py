@@ -0,0 +1,198 @@
+"""
+Tests of parser runs, with an engine built from a small grammar. They need
+bison, flex and a C compiler, and are skipped without them.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from distutils.spawn import find_executable
+
+from bison import BisonParser, BisonNode, ParseLimitExceeded, list_rule
+
+
+class SumParser(BisonParser):
+    """
+    Parses lines of sums, such as '1 + 2'.
+    """
+    tokens = ['NUMBER', 'PLUS', 'NEWLINE']
+    start = 'input'
+
+    def on_input(self, target, option, names, values):
+        """
+        input :
+              | input line
+        """
+        return BisonNode(target=target, option=option, names=names,
+                         values=values)
+
+    def on_line(self, target, option, names, values):
+        """
+        line : exp NEWLINE
+        """
+        return BisonNode(target=target, option=option, names=names,
+                         values=values)
+
+    def on_exp(self, target, option, names, values):
+        """
+        exp : NUMBER
+            | exp PLUS NUMBER
+        """
+        if option == 0:
+            return int(values[0])
+        return values[0] + int(values[2])
+
+    lexscript = r"""
+%{
+#include <stdio.h>
+#include <string.h>
+#include "Python.h"
+#define YYSTYPE void *
+#include "tokens.h"
+int yywrap() { return(1); }
+extern void *py_parser;
+extern void (*py_input)(PyObject *parser, char *buf, int *result, int max_size);
+#define returntoken(tok) yylval = PyString_FromString(yytext); return (tok);
+#define YY_INPUT(buf,result,max_size) { (*py_input)(py_parser, buf, &result, max_size); }
+%}
+
+%%
+
+[0-9]+  { returntoken(NUMBER); }
+"+"     { returntoken(PLUS); }
+\n      { returntoken(NEWLINE); }
+[ \t]   { }
+
+%%
+"""
+
+
+class ListParser(SumParser):
+    """
+    Parses lines of sums into a list of lines, without input nodes.
+    """
+    build_index = 1
+
+    @list_rule
+    def on_input(self, target, option, names, values):
+        """
+        input :
+              | input line
+        """
+
+
+def sums(tree):
+    """
+    Returns the sums of the lines of a parse tree.
+    """
+    return [line.values[0] for line in tree.find_all('line')]
+
+
+class ParserTestCase(unittest.TestCase):
+    """
+    Builds the engine of parser_class once for the tests of a class, in a
+    temporary directory, which also holds the result cache.
+    """
+    parser_class = None
+
+    @classmethod
+    def setUpClass(cls):
+        if not (find_executable('bison') and find_executable('flex')):
+            raise unittest.SkipTest('needs bison and flex')
+
+        cls.directory = tempfile.mkdtemp()
+
+        class Parser(cls.parser_class):
+            buildDirectory = cls.directory + os.sep
+            bisonEngineLibName = 'test_parser-' + cls.__name__
+            cache_directory = os.path.join(cls.directory, 'cache')
+
+        cls.parser = Parser()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def input(self, text):
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        os.write(fd, text)
+        os.close(fd)
+        return path
+
+
+class ParserTest(ParserTestCase):
+    parser_class = SumParser
+
+    def test_run(self):
+        tree = self.parser.run(file=self.input('1 + 2\n3\n'))
+        self.assertEqual(sums(tree), [3, 3])
+
+    def test_aborted_parse_not_cached(self):
+        path = self.input('1 + 2 + 3 + 4 + 5\n' * 20)
+        stored = self.parser.cache.stored
+
+        for i in range(2):
+            self.assertRaises(ParseLimitExceeded, self.parser.run,
+                              file=path, max_tokens=5)
+        self.assertEqual(self.parser.cache.stored, stored)
+
+    def test_run_after_abort(self):
+        path = self.input('1 + 2 + 3 + 4 + 5\n' * 1000)
+        self.assertRaises(ParseLimitExceeded, self.parser.run, file=path,
+                          max_tokens=5, cache=0)
+
+        # nothing of the aborted input is left in the scanner's buffer
+        tree = self.parser.run(file=self.input('7\n'), cache=0)
+        self.assertEqual(sums(tree), [7])
+
+        tree = self.parser.run(file=path, cache=0)
+        self.assertEqual(sums(tree), [15] * 1000)
+
+    def test_tokenize_after_abort(self):
+        self.assertRaises(ParseLimitExceeded, self.parser.run,
+                          file=self.input('1 + 2\n' * 1000), max_tokens=5,
+                          cache=0)
+
+        tokens = self.parser.tokenize('8 + 9\n')
+        self.assertEqual([tokens.name(i) for i in range(len(tokens))],
+                         ['NUMBER', 'PLUS', 'NUMBER', 'NEWLINE'])
+
+    def test_run_after_failfast(self):
+        self.parser.error_mode = 'failfast'
+        try:
+            tree = self.parser.run(file=self.input('1 + + 2\n3\n' * 1000),
+                                   cache=0)
+            self.assertTrue(tree is None)
+            self.assertEqual(len(self.parser.errors), 1)
+        finally:
+            del self.parser.error_mode
+
+        tree = self.parser.run(file=self.input('4\n'), cache=0)
+        self.assertEqual(sums(tree), [4])
+
+
+class ListParserTest(ParserTestCase):
+    parser_class = ListParser
+
+    def test_list_result(self):
+        path = self.input('1 + 2\n3\n')
+        lines = self.parser.run(file=path)
+
+        self.assertTrue(isinstance(lines, list))
+        self.assertEqual([line.values[0] for line in lines], [3, 3])
+        self.assertEqual(self.parser.index.find_all('line'), lines)
+
+    def test_list_result_cached(self):
+        path = self.input('4\n5 + 6\n')
+        stored = self.parser.cache.stored
+
+        self.parser.run(file=path)
+        self.assertEqual(self.parser.cache.stored, stored + 1)
+
+        lines = self.parser.run(file=path)
+        self.assertEqual([line.values[0] for line in lines], [4, 11])
+        self.assertEqual(self.parser.index.find_all('line'), lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Tests of the binary tree file format.
+"""
+import os
+import tempfile
+import unittest
+
+from bison import BisonNode
+from bison import treefile
+
+
+class exp_Node(BisonNode):
+    pass
+
+
+def sample_tree():
+    one = BisonNode(target='exp', option=0, names=['NUMBER'], values=['1'])
+    two = BisonNode(target='exp', option=0, names=['NUMBER'],
+                    values=[u'2\xe9'])
+    return BisonNode(target='exp', option=1, names=['exp', 'PLUS', 'exp'],
+                     values=[one, '+', [two, None, 3, 4.5]], depth=2)
+
+
+class TreeFileTest(unittest.TestCase):
+
+    def assertSameTree(self, a, b):
+        self.assertEqual(a.target, b.target)
+        self.assertEqual(a.option, b.option)
+        self.assertEqual(a.names, b.names)
+        self.assertEqual(len(a.values), len(b.values))
+
+        for x, y in zip(a.values, b.values):
+            if isinstance(x, BisonNode):
+                self.assertSameTree(x, y)
+            elif isinstance(x, list):
+                self.assertEqual(len(x), len(y))
+                for i, j in zip(x, y):
+                    if isinstance(i, BisonNode):
+                        self.assertSameTree(i, j)
+                    else:
+                        self.assertEqual(i, j)
+            else:
+                self.assertEqual(x, y)
+
+    def test_roundtrip(self):
+        tree = sample_tree()
+        loaded = treefile.loads(treefile.dumps(tree))
+
+        self.assertSameTree(tree, loaded)
+        self.assertEqual(loaded.depth, 2)
+        self.assertEqual(loaded.values[2][0].values[0], u'2\xe9')
+
+    def test_bools(self):
+        tree = BisonNode(target='flag', option=0, names=['on', 'off'],
+                         values=[True, False], checked=True)
+        self.assertTrue(treefile.roundtrips(tree))
+
+        loaded = treefile.loads(treefile.dumps(tree))
+        self.assertTrue(loaded.checked is True)
+        self.assertTrue(loaded.values[0] is True)
+        self.assertTrue(loaded.values[1] is False)
+
+    def test_version_1(self):
+        # files written before bools had a kind of their own
+        data = treefile.dumps(sample_tree())
+        data = data[:4] + '\x01' + data[5:]
+        self.assertEqual(treefile.loads(data).depth, 2)
+
+    def test_namespace_classes(self):
+        loaded = treefile.loads(treefile.dumps(sample_tree()),
+                                {'exp_Node': exp_Node})
+        self.assertTrue(isinstance(loaded, exp_Node))
+        self.assertTrue(isinstance(loaded.values[0], exp_Node))
+
+    def test_lazy_load(self):
+        tree = sample_tree()
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, treefile.dumps(tree))
+            os.close(fd)
+
+            f = open(path, 'rb')
+            try:
+                loaded = treefile.load(f, lazy=True)
+                self.assertTrue(isinstance(loaded, treefile.LazyNode))
+                self.assertSameTree(tree, loaded)
+                self.assertEqual(loaded.depth, 2)
+            finally:
+                f.close()
+        finally:
+            os.unlink(path)
+
+    def test_bad_magic(self):
+        self.assertRaises(ValueError, treefile.loads, 'XXXX\x01\0\0\0\0')
+
+    def test_roundtrips(self):
+        self.assertTrue(treefile.roundtrips(sample_tree()))
+        self.assertTrue(treefile.roundtrips(sample_tree(),
+                                            {'exp_Node': exp_Node}) is False)
+
+    def test_roundtrips_attributes(self):
+        # attributes set after construction are not stored
+        tree = sample_tree()
+        tree.values[0].num = 1.5
+        self.assertFalse(treefile.roundtrips(tree))
+
+        # nor are values other than strings and numbers
+        tree = sample_tree()
+        tree.values[0].kw['extra'] = object()
+        self.assertFalse(treefile.roundtrips(tree))
+
+        tree = sample_tree()
+        tree.values[2] = (1, 2)
+        self.assertFalse(treefile.roundtrips(tree))
+
+    def test_roundtrips_classes(self):
+        tree = exp_Node(target='exp', option=0, names=['NUMBER'],
+                        values=['1'])
+        self.assertTrue(treefile.roundtrips(tree, {'exp_Node': exp_Node}))
+        self.assertFalse(treefile.roundtrips(tree))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Tests of the xml serialisation of parse trees.
+"""
+import unittest
+
+from bison import BisonNode
+from bison.xmlifier import XMLifier
+
+
+class input_Node(BisonNode):
+    pass
+
+
+class line_Node(BisonNode):
+    pass
+
+
+class FakeParser(object):
+    tokens = ['NUMBER', 'NEWLINE']
+
+
+NAMESPACE = {'input_Node': input_Node, 'line_Node': line_Node}
+
+
+def line(text):
+    return line_Node(target='line', option=0, names=['NUMBER', 'NEWLINE'],
+                     values=[text, '\n'])
+
+
+def sample_tree():
+    # a list value, as built by a list_rule handler
+    lines = [line('1'), 'x < y', [line('2'), '3'], []]
+    return input_Node(target='input', option=1, names=['lines', 'NUMBER'],
+                      values=[lines, '4'])
+
+
+class XMLTest(unittest.TestCase):
+
+    def setUp(self):
+        self.xmlifier = XMLifier(FakeParser())
+
+    def assertSample(self, tree):
+        self.assertTrue(isinstance(tree, input_Node))
+        self.assertEqual(tree.names, ['lines', 'NUMBER'])
+
+        lines, number = tree.values
+        self.assertEqual(number, '4')
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(isinstance(lines[0], line_Node))
+        self.assertEqual(lines[0].values, ['1', '\n'])
+        self.assertEqual(lines[1], 'x < y')
+        self.assertEqual(lines[2][0].values, ['2', '\n'])
+        self.assertEqual(lines[2][1], '3')
+        self.assertEqual(lines[3], [])
+
+    def test_writexml_matches_dom(self):
+        tree = sample_tree()
+        self.assertEqual(tree.toxml(), tree.toxmldoc().toxml())
+        self.assertEqual(tree.toprettyxml(),
+                         tree.toxmldoc().toprettyxml(indent="  "))
+
+    def test_list_elements(self):
+        xml = sample_tree().toxml()
+        self.assertTrue('<lines _list="1" target="lines"><line ' in xml)
+        self.assertTrue('<item target="item">x &lt; y</item>' in xml)
+        self.assertTrue('<item _list="1" target="item"/>' in xml)
+
+    def test_loadxml(self):
+        xml = sample_tree().toxml()
+        self.assertSample(self.xmlifier.loadxml(xml, NAMESPACE))
+
+    def test_non_ascii(self):
+        tree = input_Node(target='input', option=0, names=['lines'],
+                          values=[[line(u'caf\xe9'), line('na\xc3\xafve'),
+                                   line(u'\u20ac')]], title=u'\xe0 la')
+
+        for encoding in (None, 'utf-8', 'latin-1', 'utf-16'):
+            xml = tree.toxml(encoding)
+            self.assertTrue(isinstance(xml, str))
+
+            loaded = self.xmlifier.loadxml(xml, NAMESPACE)
+            self.assertEqual(loaded.title, u'\xe0 la')
+            self.assertEqual([l.values[0] for l in loaded.values[0]],
+                             [u'caf\xe9', u'na\xefve', u'\u20ac'])
+
+    def test_declared_encoding(self):
+        tree = input_Node(target='input', option=0, names=['NUMBER'],
+                          values=[u'\xe9'])
+        xml = tree.toxml('latin-1')
+
+        self.assertTrue(xml.startswith(
+            '<?xml version="1.0" encoding="latin-1"?>'))
+        self.assertTrue('>\xe9<' in xml)
+        self.assertEqual(xml, tree.toxmldoc().toxml('latin-1'))
+        self.assertEqual(self.xmlifier.loadxml(xml.decode('latin-1'),
+                                               NAMESPACE).values, [u'\xe9'])
+
+    def test_loadxmldoc(self):
+        doc = sample_tree().toxmldoc()
+        self.assertSample(self.xmlifier.loadxmldoc(doc, NAMESPACE))
+
+
+if __name__ == '__main__':
+    unittest.main()